@@ -0,0 +1,220 @@
+'''
+Read-only JSON API.
+
+    /api/user/<username>/       a user's bookmarks
+    /api/tag/<tag>/             the bookmarks with a tag
+    /api/friends/<username>/    a user's friends feed
+    /api/popular/?period=day    the popular ranking
+    /api/search/?query=...      search results
+
+Lists come newest first, PAGE_SIZE bookmarks at a time, with the cursors
+of the neighbouring pages in "next" and "previous" to pass back as
+?cursor=.  Search results are ranked rather than ordered by id, so they
+are paged with ?page= instead.  ?fields=id,title picks the fields
+returned for each bookmark.
+
+Every response has an ETag and a Last-Modified header made from the
+list's fragment cache version (see bookmarks/cache.py), which changes
+whenever the list does.  A client sending them back gets an empty 304
+for as long as the list stays the same, and finding that out costs one
+cache lookup and no queries.
+
+Friends feeds cost one query more.  Bookmarks of friends with more than
+FEED_FANOUT_LIMIT followers are read on demand and don't change their
+followers' versions (see bookmarks/feeds.py), so the id of the newest
+one goes into the ETag, and feeds that have them get no Last-Modified.
+'''
+import hashlib
+import json
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
+from bookmarks import cache, feeds, pagination, popularity, search
+from bookmarks.models import Bookmark, Tag
+
+# Bump when the format of the responses changes, so cached copies
+# aren't revalidated.
+API_VERSION = 1
+
+PAGE_SIZE = 20
+
+FIELDS = ('id', 'title', 'url', 'user', 'tags')
+POPULAR_FIELDS = FIELDS + ('votes', )
+
+
+def _validators(request, scope, ident, newest):
+    # Looked up once per request, for both headers.
+    if not hasattr(request, '_api_validators'):
+        version, changed = cache.get_validators(scope, ident)
+        latest = newest and newest(ident)
+        if latest is not None:
+            # The version alone doesn't cover the list, and there's no
+            # time to go with latest.
+            version, changed = '%s:%s' % (version, latest), None
+        request._api_validators = version, changed
+    return request._api_validators
+
+
+def conditional(scope, ident = None, newest = None):
+    '''
+    Answer conditional GETs for a view that lists what scope and ident
+    cover.  Without ident the view's first argument is used.  newest,
+    if given, is called with ident and returns the id of the newest
+    item the version doesn't account for, or None.
+    '''
+    def etag(request, *args):
+        version, changed = _validators(
+            request, scope, ident or args[0], newest
+        )
+        return hashlib.md5('%s:%s:%s' % (
+            API_VERSION, version, request.get_full_path()
+        )).hexdigest()
+
+    def last_modified(request, *args):
+        version, changed = _validators(
+            request, scope, ident or args[0], newest
+        )
+        if changed is None:
+            return None
+        return datetime.utcfromtimestamp(changed)
+
+    return condition(etag_func = etag, last_modified_func = last_modified)
+
+
+def _json_response(data, status = 200):
+    return HttpResponse(
+        json.dumps(data), mimetype = 'application/json', status = status
+    )
+
+
+def _fields(request, available):
+    if 'fields' not in request.GET:
+        return available
+    fields = [name for name in request.GET['fields'].split(',') if name]
+    unknown = set(fields).difference(available)
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    return fields
+
+
+def _query(query_set, fields):
+    # Only join and prefetch what the requested fields need.
+    related = [name for name, field in (('link', 'url'), ('user', 'user'))
+               if field in fields]
+    if related:
+        query_set = query_set.select_related(*related)
+    if 'tags' in fields:
+        query_set = query_set.prefetch_related('tag_set')
+    return query_set
+
+
+def _serialize(bookmark, fields):
+    values = {
+        'id': lambda: bookmark.id,
+        'title': lambda: bookmark.title,
+        'url': lambda: bookmark.link.url,
+        'user': lambda: bookmark.user.username,
+        'tags': lambda: [tag.name for tag in bookmark.tag_set.all()],
+    }
+    return dict((name, values[name]()) for name in fields if name in values)
+
+
+def _in_order(query_set, ids, fields):
+    found = dict((bookmark.id, bookmark)
+                 for bookmark in _query(query_set.filter(id__in = ids), fields))
+    return [found[id] for id in ids if id in found]
+
+
+def _bookmark_page(request, query_set):
+    try:
+        fields = _fields(request, FIELDS)
+        page = pagination.paginate(
+            _query(query_set, fields), request.GET.get('cursor'), PAGE_SIZE
+        )
+    except ValueError as e:
+        # Also catches pagination.InvalidCursor.
+        return _json_response({'error': str(e)}, status = 400)
+
+    return _json_response({
+        'bookmarks': [_serialize(bookmark, fields) for bookmark in page.items],
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    })
+
+
+@conditional('user')
+def api_user_bookmarks(request, username):
+    user = get_object_or_404(User, username = username)
+    return _bookmark_page(request, user.bookmark_set.all())
+
+
+@conditional('tag')
+def api_tag_bookmarks(request, tag_name):
+    tag = get_object_or_404(Tag, name = tag_name)
+    return _bookmark_page(request, tag.bookmarks.all())
+
+
+def _newest_read_on_demand(username):
+    # The newest bookmark of username's friends whose bookmarks aren't
+    # fanned out.  Their saves don't invalidate 'friends'.
+    return Bookmark.objects.filter(
+        user__to_friend_set__from_friend__username = username,
+        user__follower_count__count__gt = feeds.FANOUT_LIMIT
+    ).aggregate(Max('id'))['id__max']
+
+
+@conditional('friends', newest = _newest_read_on_demand)
+def api_friends_feed(request, username):
+    user = get_object_or_404(User, username = username)
+    return _bookmark_page(request, feeds.feed_query(user))
+
+
+@conditional('shared', 'all')
+def api_popular(request):
+    period = request.GET.get('period', popularity.DEFAULT_PERIOD)
+    if period not in popularity.PERIODS:
+        raise Http404
+    try:
+        fields = _fields(request, POPULAR_FIELDS)
+    except ValueError as e:
+        return _json_response({'error': str(e)}, status = 400)
+
+    shared = popularity.top(period, PAGE_SIZE)
+    bookmarks = _in_order(
+        Bookmark.objects.all(), [item.bookmark_id for item in shared], fields
+    )
+    votes = dict((item.bookmark_id, item.votes) for item in shared)
+    items = []
+    for bookmark in bookmarks:
+        data = _serialize(bookmark, fields)
+        if 'votes' in fields:
+            data['votes'] = votes[bookmark.id]
+        items.append(data)
+    return _json_response({'period': period, 'bookmarks': items})
+
+
+@conditional('search', 'all')
+def api_search(request):
+    query = request.GET.get('query', '').strip()
+    try:
+        fields = _fields(request, FIELDS)
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError as e:
+        return _json_response({'error': str(e)}, status = 400)
+
+    # One extra result tells whether there's a next page.
+    ids = search.search_bookmarks(
+        query, offset = (page_number - 1) * PAGE_SIZE, limit = PAGE_SIZE + 1
+    )
+    has_next = len(ids) > PAGE_SIZE
+    bookmarks = _in_order(Bookmark.objects.all(), ids[:PAGE_SIZE], fields)
+    return _json_response({
+        'query': query,
+        'bookmarks': [_serialize(bookmark, fields) for bookmark in bookmarks],
+        'page': page_number,
+        'next': has_next and page_number + 1 or None,
+        'previous': page_number > 1 and page_number - 1 or None,
+    })
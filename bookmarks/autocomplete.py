@@ -0,0 +1,132 @@
+'''
+Tag autocompletion.
+
+Each process keeps every tag name in a sorted list, next to the number
+of bookmarks carrying it, so the tags starting with a prefix are one
+bisect away and suggestions never query the database.  A user's own tag
+counts are loaded the first time they ask for suggestions and kept for
+the USER_CACHE_SIZE most recent users.  Tags the user already uses come
+first, most used first, then everyone else's by overall use.  Prefixes
+match case-insensitively, so "Python" is offered to someone typing "py"
+before they create "python".
+
+_bookmark_save and the importer update the index of the process they
+run in as tags are added and removed, once their transaction has
+committed (through bookmarks.cache.after_commit), so a rollback can't
+leave counts behind.  Other processes catch up by reloading theirs once
+it is REFRESH_INTERVAL seconds old.
+'''
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Count
+from bookmarks.models import Tag
+
+REFRESH_INTERVAL = getattr(settings, 'TAG_AUTOCOMPLETE_REFRESH', 60 * 5)
+USER_CACHE_SIZE = 1000
+MAX_SUGGESTIONS = 50
+
+
+class TagIndex(object):
+    '''
+    Tag names sorted case-insensitively, with their bookmark counts.
+    '''
+
+    def __init__(self, counts):
+        self.loaded = time.time()
+        self.counts = dict(counts)
+        self.keys = sorted((name.lower(), name) for name in self.counts)
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update(self, changes, user_id = None):
+        '''
+        Apply changes, a {tag name: change in bookmark count} dictionary,
+        made by user_id.
+        '''
+        with self.lock:
+            user_counts = self.users.get(user_id)
+            for name, change in changes.items():
+                if name not in self.counts:
+                    bisect.insort(self.keys, (name.lower(), name))
+                    self.counts[name] = 0
+                self.counts[name] += change
+                if user_counts is not None:
+                    user_counts[name] = user_counts.get(name, 0) + change
+
+    def user_counts(self, user_id):
+        with self.lock:
+            counts = self.users.pop(user_id, None)
+            if counts is not None:
+                # Now the most recently used.
+                self.users[user_id] = counts
+                return counts
+
+        counts = dict(Tag.objects.filter(bookmarks__user = user_id).values(
+            'name'
+        ).annotate(uses = Count('bookmarks')).values_list('name', 'uses'))
+        with self.lock:
+            self.users[user_id] = counts
+            while len(self.users) > USER_CACHE_SIZE:
+                self.users.popitem(last = False)
+        return counts
+
+    def suggest(self, prefix, user_id = None, limit = 10):
+        mine = user_id and self.user_counts(user_id) or {}
+        prefix = prefix.lower()
+        with self.lock:
+            matches = []
+            keys = self.keys
+            for i in xrange(bisect.bisect_left(keys, (prefix, )), len(keys)):
+                key, name = keys[i]
+                if not key.startswith(prefix):
+                    break
+                if self.counts[name] > 0:
+                    matches.append((mine.get(name, 0), self.counts[name], name))
+        # Ties stay in alphabetical order.
+        return [name for uses, count, name in
+                heapq.nlargest(limit, matches, key = lambda match: match[:2])]
+
+
+_index = [None]
+_load_lock = threading.Lock()
+
+
+def get_index():
+    '''
+    Return this process's TagIndex, loading it if it's missing or old.
+    '''
+    index = _index[0]
+    if index is None or time.time() - index.loaded > REFRESH_INTERVAL:
+        with _load_lock:
+            index = _index[0]
+            if index is None or time.time() - index.loaded > REFRESH_INTERVAL:
+                index = _index[0] = TagIndex(Tag.objects.filter(
+                    bookmark_count__gt = 0
+                ).values_list('name', 'bookmark_count'))
+    return index
+
+
+def tags_changed(changes, user_id = None):
+    '''
+    Record tag count changes ({name: change}) in this process's index.
+    Nothing needs doing if it hasn't been loaded yet.
+    '''
+    index = _index[0]
+    if index is not None and changes:
+        index.update(changes, user_id)
+
+
+def suggest(prefix, user_id = None, limit = 10):
+    '''
+    Return up to limit tag names starting with prefix, best first,
+    ranked for user_id if given.
+    '''
+    return get_index().suggest(prefix, user_id, min(limit, MAX_SUGGESTIONS))
+
+
+def reset():
+    _index[0] = None
@@ -0,0 +1,457 @@
+'''
+Synthetic data and benchmarks.
+
+generate_dataset() fills the database with a realistic looking data set:
+link and tag popularity follow a Zipf distribution, users have friends,
+and a share of the bookmarks are shared and voted on.  Everything is
+inserted with bulk_create() and the same seed always produces the same
+data.
+
+run_benchmarks() requests every URL in django_bookmarks.urls through
+the test client and reports latency percentiles and query counts, so
+results can be saved and compared between commits.  The
+generate_bookmarks and run_benchmarks management commands wrap them.
+
+measure_startup() times a worker's cold start: new processes import the
+WSGI application and serve one URL, as a freshly started worker would.
+"manage.py benchmark_startup --settings=..." compares settings profiles.
+
+measure_concurrency() runs reader and writer threads against the
+database at the same time and counts "database is locked" errors, to
+check SQLite tuning (see bookmarks/sqlite_tuning.py) with
+"manage.py benchmark_concurrency".
+'''
+import bisect
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import RegexURLResolver
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.test.client import Client
+from bookmarks import frontpage, instrumentation, links, sqlite_tuning
+from bookmarks.models import Bookmark, Friendship, Link, SharedBookmark, Tag
+
+USERNAME = 'bench_user_%d'
+PASSWORD = 'bench'
+
+
+class ZipfSampler(object):
+    '''
+    Draws integers in [0, size) with P(k) proportional to 1 / (k + 1) ** s.
+    '''
+
+    def __init__(self, size, s, rng):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for k in range(size):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+
+    def sample(self):
+        return bisect.bisect_left(
+            self.cumulative, self.rng.random() * self.cumulative[-1]
+        )
+
+    def distinct(self, count):
+        # Up to count different values.
+        values = set()
+        for attempt in range(count * 10):
+            values.add(self.sample())
+            if len(values) == count:
+                break
+        return values
+
+
+def _bulk_create(model, objects, batch_size):
+    for start in range(0, len(objects), batch_size):
+        model.objects.bulk_create(objects[start:start + batch_size])
+
+
+@transaction.commit_on_success
+def generate_dataset(users = 100, bookmarks_per_user = 50, tags = 500,
+                     tags_per_bookmark = 3, friends_per_user = 10,
+                     share_ratio = 0.2, votes_per_share = 5, zipf = 1.1,
+                     seed = 0, batch_size = 1000):
+    '''
+    Insert a synthetic data set and return a dictionary of row counts.
+    Users are named bench_user_0, bench_user_1, ... with the password
+    "bench"; bench_user_0 is staff.
+    '''
+    rng = random.Random(seed)
+    counts = {}
+
+    password = make_password(PASSWORD)
+    _bulk_create(User, [
+        User(username = USERNAME % i, email = (USERNAME % i) + '@example.com',
+             password = password, is_staff = (i == 0))
+        for i in range(users)
+    ], batch_size)
+    user_ids = list(User.objects.filter(
+        username__in = [USERNAME % i for i in range(users)]
+    ).order_by('id').values_list('id', flat = True))
+    counts['users'] = len(user_ids)
+
+    tag_names = ['tag%d' % i for i in range(tags)]
+    existing = set(Tag.objects.filter(name__in = tag_names).values_list('name', flat = True))
+    _bulk_create(Tag, [Tag(name = name) for name in tag_names
+                       if name not in existing], batch_size)
+    tag_ids = dict(Tag.objects.filter(name__in = tag_names).values_list('name', 'id'))
+    tag_ids = [tag_ids[name] for name in tag_names]
+    counts['tags'] = len(tag_ids)
+
+    # Popular links are bookmarked by many users.
+    link_count = max(users * bookmarks_per_user // 2, 1)
+    urls = ['http://site%d.example.com/page%d' % (i % 997, i) for i in range(link_count)]
+    existing = set(Link.objects.filter(url__in = urls).values_list('url', flat = True))
+    _bulk_create(Link, [Link(url = url, url_hash = links.url_key(url))
+                        for url in urls if url not in existing], batch_size)
+    link_ids = dict(Link.objects.filter(url__in = urls).values_list('url', 'id'))
+    link_ids = [link_ids[url] for url in urls]
+
+    link_sampler = ZipfSampler(len(link_ids), zipf, rng)
+    bookmarks = []
+    for user_id in user_ids:
+        for link in link_sampler.distinct(bookmarks_per_user):
+            bookmarks.append(Bookmark(
+                title = 'Synthetic bookmark %d' % link,
+                user_id = user_id, link_id = link_ids[link]
+            ))
+    _bulk_create(Bookmark, bookmarks, batch_size)
+    bookmark_ids = list(Bookmark.objects.filter(
+        user__in = user_ids
+    ).values_list('id', 'user_id'))
+    counts['bookmarks'] = len(bookmark_ids)
+
+    Through = Tag.bookmarks.through
+    tag_sampler = ZipfSampler(len(tag_ids), zipf, rng)
+    _bulk_create(Through, [
+        Through(bookmark_id = bookmark_id, tag_id = tag_ids[tag])
+        for bookmark_id, user_id in bookmark_ids
+        for tag in tag_sampler.distinct(tags_per_bookmark)
+    ], batch_size)
+
+    friendships = []
+    for user_id in user_ids:
+        others = rng.sample(user_ids, min(friends_per_user + 1, len(user_ids)))
+        friendships.extend(
+            Friendship(from_friend_id = user_id, to_friend_id = other)
+            for other in others[:friends_per_user] if other != user_id
+        )
+    _bulk_create(Friendship, friendships, batch_size)
+    counts['friendships'] = len(friendships)
+
+    shared = rng.sample(bookmark_ids, int(len(bookmark_ids) * share_ratio))
+    voters = dict((bookmark_id, [user_id] + rng.sample(
+        user_ids, min(rng.randint(0, votes_per_share * 2), len(user_ids))
+    )) for bookmark_id, user_id in shared)
+    _bulk_create(SharedBookmark, [
+        SharedBookmark(bookmark_id = bookmark_id,
+                       votes = len(set(voters[bookmark_id])))
+        for bookmark_id, user_id in shared
+    ], batch_size)
+    Vote = SharedBookmark.users_voted.through
+    _bulk_create(Vote, [
+        Vote(sharedbookmark_id = shared_id, user_id = user_id)
+        for shared_id, bookmark_id in SharedBookmark.objects.filter(
+            bookmark__in = voters.keys()
+        ).values_list('id', 'bookmark_id')
+        for user_id in set(voters[bookmark_id])
+    ], batch_size)
+    counts['shared'] = len(shared)
+
+    # Fill in everything that is normally maintained as bookmarks
+    # are saved.
+    for command in ('update_tag_counts', 'rebuild_search_index',
+                    'refresh_popularity', 'rebuild_feeds'):
+        call_command(command, verbosity = 0)
+
+    return counts
+
+
+# Sample URLs for every view in django_bookmarks.urls, keyed by view
+# name.  None means the view is deliberately not benchmarked.
+SAMPLE_URLS = {
+    'main_page': '/',
+    'test_page': '/test/',
+    'popular_page': '/popular/?period=week',
+    'user_page': '/user/%(username)s/',
+    'bookmark_export_page': '/user/%(username)s/export/?format=json',
+    'tag_page': '/tag/%(tag)s/',
+    'tag_cloud_page': '/tag/?top=200',
+    'tag_autocomplete_page': '/tags/autocomplete/?q=tag1',
+    'search_page': '/search/?query=%(tag)s',
+    'bookmark_page': '/bookmark/%(shared_id)d/',
+    'friends_page': '/friends/%(username)s/',
+    'friend_add': '/friends/add/?username=%(other)s',
+    'login': '/login/',
+    'logout_page': None,
+    'register_page': '/register/',
+    'direct_to_template': '/register/success/',
+    'bookmark_save_page': '/save/?url=%(url)s',
+    'bookmark_import_page': '/import/',
+    'bookmark_vote_page': '/vote/?id=%(shared_id)d&ajax',
+    'cache_stats_page': '/stats/cache/',
+    'api_user_bookmarks': '/api/user/%(username)s/',
+    'api_tag_bookmarks': '/api/tag/%(tag)s/',
+    'api_friends_feed': '/api/friends/%(username)s/',
+    'api_popular': '/api/popular/?period=week',
+    'api_search': '/api/search/?query=%(tag)s',
+    'view_stats_page': '/stats/views/',
+    'task_stats_page': '/stats/tasks/',
+    'serve': None,
+}
+
+
+def benchmark_urls(urlpatterns, values):
+    '''
+    Return (view name, URL) pairs for urlpatterns and the names of the
+    views without a sample URL.  Included URL confs (the admin and
+    comments apps) are left out.
+    '''
+    urls = []
+    missing = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, RegexURLResolver):
+            continue
+        name = pattern.callback.__name__
+        if name not in SAMPLE_URLS:
+            missing.append(name)
+        elif SAMPLE_URLS[name] is not None:
+            urls.append((name, SAMPLE_URLS[name] % values))
+    return urls, missing
+
+
+def _sample_values():
+    user = User.objects.get(username = USERNAME % 0)
+    bookmark = Bookmark.objects.filter(user = user).select_related('link')[0]
+    tag = Tag.objects.order_by('-bookmark_count')[0]
+    other = User.objects.exclude(id = user.id).order_by('id')[0]
+    return {
+        'username': user.username,
+        'other': other.username,
+        'tag': tag.name,
+        'url': bookmark.link.url,
+        'shared_id': SharedBookmark.objects.order_by('-votes')[0].id,
+    }
+
+
+def run_benchmarks(urlpatterns, iterations = 20):
+    '''
+    Request each URL iterations times as bench_user_0 (after one warm up
+    request) and return {view name: {url, status, p50_ms, p95_ms,
+    max_ms, queries}} plus the list of views without a sample URL.
+    '''
+    urls, missing = benchmark_urls(urlpatterns, _sample_values())
+    client = Client()
+    client.login(username = USERNAME % 0, password = PASSWORD)
+
+    results = {}
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for name, url in urls:
+            response = client.get(url)
+            timings = []
+            queries = []
+            for i in range(iterations):
+                start_queries = len(connection.queries)
+                start = time.time()
+                response = client.get(url)
+                # Streamed responses are only done once consumed.
+                ''.join(response)
+                timings.append((time.time() - start) * 1000)
+                queries.append(len(connection.queries) - start_queries)
+                del connection.queries[:]
+            timings.sort()
+            results[name] = {
+                'url': url,
+                'status': response.status_code,
+                'p50_ms': instrumentation.percentile(timings, 50),
+                'p95_ms': instrumentation.percentile(timings, 95),
+                'max_ms': timings[-1],
+                'queries': max(queries),
+            }
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+    return results, missing
+
+
+# Run in a new process by measure_startup().  It only imports what a
+# WSGI server would before the first request.
+STARTUP_SCRIPT = r'''
+import json, sys, time
+from StringIO import StringIO
+start = time.time()
+from django_bookmarks.wsgi import application
+loaded = time.time()
+
+def request(path):
+    status = []
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': False,
+        'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    ''.join(application(environ, lambda s, h, e = None: status.append(s)))
+    return int(status[0].split()[0])
+
+status = request(sys.argv[1])
+first = time.time()
+request(sys.argv[1])
+second = time.time()
+print(json.dumps({
+    'status': status,
+    'load_ms': (loaded - start) * 1000,
+    'first_ms': (first - loaded) * 1000,
+    'second_ms': (second - first) * 1000,
+}))
+'''
+
+
+def measure_startup(path = '/', runs = 5):
+    '''
+    Start runs new processes that each load the WSGI application and
+    request path twice.  Returns the medians of: the whole cold start,
+    from starting the process to the first response (total_ms); loading
+    the application, including any warm-up (load_ms); the first request
+    (first_ms) and the second, warm one (second_ms).  The processes use
+    the current DJANGO_SETTINGS_MODULE.
+    '''
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path))
+    samples = []
+    for i in range(runs):
+        start = time.time()
+        output = subprocess.check_output(
+            [sys.executable, '-c', STARTUP_SCRIPT, path], env = env
+        )
+        total = (time.time() - start) * 1000
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['total_ms'] = total - sample['second_ms']
+        samples.append(sample)
+
+    result = {'status': samples[-1]['status']}
+    for metric in ('total_ms', 'load_ms', 'first_ms', 'second_ms'):
+        result[metric] = instrumentation.percentile(
+            sorted(sample[metric] for sample in samples), 50
+        )
+    return result
+
+
+CONCURRENCY_USERNAME = 'bench_concurrency'
+CONCURRENCY_URL = 'http://concurrency.example.com/%d/%d'
+REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout',
+                    'cache_size', 'mmap_size')
+
+
+def _read(user_id, i):
+    # What the front page and a user page read.
+    if i % 2:
+        frontpage.build()
+    else:
+        list(Bookmark.objects.filter(user = user_id).select_related(
+            'link'
+        ).order_by('-id')[:10])
+
+
+@transaction.commit_on_success
+def _write(user_id, shared_id, thread, i):
+    # What _bookmark_save and bookmark_vote_page write.  The vote
+    # update takes the write lock without changing the count.
+    if i % 2:
+        SharedBookmark.objects.filter(id = shared_id).update(votes = F('votes'))
+    else:
+        link, created = links.get_or_create_link(CONCURRENCY_URL % (thread, i))
+        Bookmark.objects.create(
+            title = 'Concurrency %d %d' % (thread, i), user_id = user_id,
+            link = link
+        )
+
+
+def measure_concurrency(readers = 4, writers = 2, seconds = 5.0):
+    '''
+    Run readers reading and writers writing threads against the
+    database for seconds and return the operations done per second,
+    their latency percentiles, how many failed with "database is locked"
+    (lock_errors) or anything else (errors, with the first messages in
+    error_samples) and the SQLite pragmas in effect.  It needs a
+    database every thread can open, so not an in-memory one.  The rows
+    written are deleted afterwards.
+    '''
+    user, created = User.objects.get_or_create(username = CONCURRENCY_USERNAME)
+    shared = SharedBookmark.objects.order_by('id')[:1]
+    shared_id = shared and shared[0].id or 0
+    transaction.commit_unless_managed()
+
+    lock = threading.Lock()
+    timings = {'read': [], 'write': []}
+    failures = {'lock_errors': 0, 'errors': 0, 'error_samples': []}
+    deadline = time.time() + seconds
+
+    def work(kind, thread):
+        i = 0
+        try:
+            while time.time() < deadline:
+                start = time.time()
+                try:
+                    if kind == 'read':
+                        _read(user.id, i)
+                    else:
+                        _write(user.id, shared_id, thread, i)
+                except DatabaseError as e:
+                    with lock:
+                        if 'locked' in str(e):
+                            failures['lock_errors'] += 1
+                        else:
+                            failures['errors'] += 1
+                            if len(failures['error_samples']) < 5:
+                                failures['error_samples'].append(str(e))
+                else:
+                    elapsed = (time.time() - start) * 1000
+                    with lock:
+                        timings[kind].append(elapsed)
+                i += 1
+        finally:
+            # Each thread has its own connection.
+            connection.close()
+
+    threads = [threading.Thread(target = work, args = ('read', n))
+               for n in range(readers)]
+    threads += [threading.Thread(target = work, args = ('write', n))
+                for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    Bookmark.objects.filter(user = user).delete()
+    Link.objects.filter(url__startswith = CONCURRENCY_URL.split('%')[0]).delete()
+    user.delete()
+    transaction.commit_unless_managed()
+
+    result = dict(failures, readers = readers, writers = writers,
+                  seconds = seconds)
+    for kind in ('read', 'write'):
+        values = sorted(timings[kind])
+        result[kind + 's'] = len(values)
+        result[kind + 's_per_s'] = len(values) / float(seconds)
+        result[kind + '_p50_ms'] = instrumentation.percentile(values, 50)
+        result[kind + '_p95_ms'] = instrumentation.percentile(values, 95)
+    if connection.vendor == 'sqlite':
+        connection.cursor()
+        result['pragmas'] = sqlite_tuning.current_pragmas(
+            connection.connection, REPORTED_PRAGMAS
+        )
+    return result
@@ -0,0 +1,208 @@
+'''
+Versioned cache for rendered template fragments.
+
+Every fragment belongs to a scope ("user", "tag", "friends" or "shared")
+and an identifier within it, e.g. ("user", "flaugher").  Each scope and
+identifier pair has a version number stored in the cache and the version
+is part of the fragment's key, so invalidating a pair is a single
+increment: the old fragments are simply never read again and expire on
+their own.
+
+The time of each pair's last invalidation is kept next to its version.
+Together they make cheap validators for conditional GETs (see
+bookmarks/api.py): if neither changed, nothing under the pair did.
+"search" "all" is invalidated whenever the search index changes, for
+the same purpose.
+
+A version must only change once the change it stands for is committed:
+bumped any earlier, a concurrent request could render the old rows under
+the new version, and they would be served until the next change.
+Functions that write and invalidate in one transaction are decorated
+with commit_on_success() below instead of transaction's, which holds
+their invalidate() and after_commit() calls back until the commit, and
+drops them if the transaction rolls back.
+
+Cache hits and misses are counted in the cache too, so every process
+sharing the cache reports the same numbers through cache_stats().  All
+of this needs a cache the processes share: with the per process
+LocMemCache, an invalidation made by one (say "manage.py run_tasks")
+never reaches the web workers.
+'''
+import hashlib
+import threading
+import time
+import warnings
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# How long rendered fragments live.  Invalidation doesn't depend on it,
+# but time based pages such as the popular page do.
+FRAGMENT_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 5)
+
+# Versions must outlive the fragments that use them.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+if 'locmem' in settings.CACHES['default']['BACKEND'].lower() and \
+        not settings.DEBUG:
+    warnings.warn(
+        'The default cache is a LocMemCache, so fragments invalidated by '
+        'one process stay cached in the others.  Use a shared cache such '
+        'as memcached or the database cache.', RuntimeWarning
+    )
+
+STATS_KEYS = {
+    'hits': 'bookmarks:fragment-stats:hits',
+    'misses': 'bookmarks:fragment-stats:misses',
+    'invalidations': 'bookmarks:fragment-stats:invalidations',
+}
+
+
+def _version_key(scope, ident):
+    return 'bookmarks:version:%s:%s' % (
+        scope, hashlib.md5(unicode(ident).encode('utf-8')).hexdigest()
+    )
+
+
+def _changed_key(scope, ident):
+    return 'bookmarks:changed:%s:%s' % (
+        scope, hashlib.md5(unicode(ident).encode('utf-8')).hexdigest()
+    )
+
+
+def _new_version():
+    # If a version is ever evicted, starting again from 1 could bring
+    # back fragments rendered under an older 1.  Starting from the
+    # current time can't collide with anything still cached.
+    return int(time.time() * 1000)
+
+
+def get_version(scope, ident):
+    key = _version_key(scope, ident)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, VERSION_TIMEOUT)
+        version = cache.get(key, version)
+    return version
+
+
+# Per thread, a list of held back callbacks for each commit_on_success()
+# function running.
+_held = threading.local()
+
+
+def commit_on_success(function):
+    '''
+    transaction.commit_on_success, with the function's invalidate() and
+    after_commit() calls run once its transaction has committed.
+    '''
+    function = transaction.commit_on_success(function)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = _held.__dict__.setdefault('stack', [])
+        stack.append([])
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            # Dropped if function raised, since it rolled back.
+            callbacks = stack.pop()
+        for callback, callback_args in callbacks:
+            callback(*callback_args)
+        return result
+    return wrapper
+
+
+def after_commit(callback, *args):
+    '''
+    Call callback(*args) once the running commit_on_success() function
+    has committed, or now outside one.
+    '''
+    stack = getattr(_held, 'stack', None)
+    if stack:
+        stack[-1].append((callback, args))
+    else:
+        callback(*args)
+
+
+def invalidate(scope, *idents):
+    '''
+    Throw away every cached fragment for the given scope and identifiers.
+    '''
+    after_commit(_invalidate, scope, idents)
+
+
+def _invalidate(scope, idents):
+    for ident in idents:
+        key = _version_key(scope, ident)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not in the cache, so nothing was rendered from it yet.
+            cache.set(key, _new_version(), VERSION_TIMEOUT)
+        cache.set(_changed_key(scope, ident), int(time.time()), VERSION_TIMEOUT)
+        _count('invalidations')
+
+
+def get_validators(scope, ident):
+    '''
+    Return the current version of scope and ident and the time it was
+    last invalidated, in seconds since the epoch.
+    '''
+    version_key = _version_key(scope, ident)
+    changed_key = _changed_key(scope, ident)
+    values = cache.get_many([version_key, changed_key])
+    if len(values) < 2:
+        # Either one was evicted, so as far as we know it changed just
+        # now.
+        values[changed_key] = int(time.time())
+        cache.set(changed_key, values[changed_key], VERSION_TIMEOUT)
+        values[version_key] = get_version(scope, ident)
+    return values[version_key], values[changed_key]
+
+
+def fragment_key(scope, ident, vary_on = ()):
+    '''
+    Build the cache key for a fragment from its scope, identifier,
+    current version and whatever else the fragment depends on.
+    '''
+    vary = hashlib.md5(
+        u':'.join(unicode(value) for value in vary_on).encode('utf-8')
+    ).hexdigest()
+    return 'bookmarks:fragment:%s:%s:%s' % (
+        _version_key(scope, ident), get_version(scope, ident), vary
+    )
+
+
+def get_fragment(key):
+    content = cache.get(key)
+    _count(content is None and 'misses' or 'hits')
+    return content
+
+
+def set_fragment(key, content):
+    cache.set(key, content, FRAGMENT_TIMEOUT)
+
+
+def _count(name):
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, VERSION_TIMEOUT):
+            cache.incr(key)
+
+
+def cache_stats():
+    '''
+    Return the hit, miss and invalidation counters and the hit ratio.
+    '''
+    values = cache.get_many(STATS_KEYS.values())
+    stats = dict(
+        (name, values.get(key, 0)) for name, key in STATS_KEYS.items()
+    )
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = lookups and float(stats['hits']) / lookups or 0.0
+    return stats
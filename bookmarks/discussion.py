@@ -0,0 +1,142 @@
+'''
+Comments on shared bookmarks.
+
+django.contrib.comments finds an object's comments through a generic
+relation (a content type and a text object_pk), and its template tags
+count and load them with a query each, after which bookmark_page ran
+escape|urlizetrunc|linebreaks over every comment on every view.
+
+Instead, a comment is rendered with comments/comment.html once, when it
+is posted, and stored as a RenderedComment under its shared bookmark's
+id, and the bookmark's comment_count goes up by one.  bookmark_page then
+gets the count along with the bookmark and reads one page of ready made
+HTML through an ordinary foreign key.  Comments a moderator removes or
+that are deleted drop out of both.
+
+"manage.py render_comments" renders the comments posted before this
+existed and recounts every bookmark.
+'''
+from django.contrib.comments.models import Comment
+from django.contrib.comments.signals import comment_was_flagged, \
+    comment_was_posted
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.template.loader import render_to_string
+from bookmarks.models import RenderedComment, SharedBookmark
+
+PER_PAGE = 20
+
+
+def _shared_bookmark_id(comment):
+    # The id of the shared bookmark comment is about, or None if it's
+    # about something else.
+    content_type = ContentType.objects.get_for_model(SharedBookmark)
+    if comment.content_type_id != content_type.id:
+        return None
+    return int(comment.object_pk)
+
+
+def _is_visible(comment):
+    return comment.is_public and not comment.is_removed
+
+
+def render(comment):
+    return render_to_string('comments/comment.html', {'comment': comment})
+
+
+def add(comment):
+    '''
+    Render comment and count it, if it's a visible comment on a shared
+    bookmark that hasn't been rendered yet.
+    '''
+    shared_bookmark_id = _shared_bookmark_id(comment)
+    if shared_bookmark_id is None or not _is_visible(comment):
+        return
+    if RenderedComment.objects.filter(comment = comment.id).exists():
+        return
+    RenderedComment.objects.create(
+        comment = comment,
+        shared_bookmark_id = shared_bookmark_id,
+        html = render(comment)
+    )
+    SharedBookmark.objects.filter(id = shared_bookmark_id).update(
+        comment_count = F('comment_count') + 1
+    )
+
+
+def comment_posted(sender, comment, **kwargs):
+    add(comment)
+
+
+def comment_flagged(sender, comment, **kwargs):
+    # Moderators remove comments and approve held ones by flagging them.
+    if _is_visible(comment):
+        add(comment)
+    else:
+        RenderedComment.objects.filter(comment = comment.id).delete()
+
+
+def rendered_comment_deleted(sender, instance, **kwargs):
+    # Also runs when the deletion of a comment cascades to its
+    # RenderedComment.
+    SharedBookmark.objects.filter(id = instance.shared_bookmark_id).update(
+        comment_count = F('comment_count') - 1
+    )
+
+
+comment_was_posted.connect(
+    comment_posted, dispatch_uid = 'bookmarks.discussion.comment_posted'
+)
+comment_was_flagged.connect(
+    comment_flagged, dispatch_uid = 'bookmarks.discussion.comment_flagged'
+)
+post_delete.connect(
+    rendered_comment_deleted, sender = RenderedComment,
+    dispatch_uid = 'bookmarks.discussion.rendered_comment_deleted'
+)
+
+
+@transaction.commit_on_success
+def render_batch(after_id = 0, batch_size = 500):
+    '''
+    Render the batch_size visible shared bookmark comments after
+    after_id that have no RenderedComment yet.  Doesn't touch the counts;
+    see recount().  Returns the last comment id looked at (None once
+    there are none left) and the number rendered.
+    '''
+    comments = list(Comment.objects.filter(
+        content_type = ContentType.objects.get_for_model(SharedBookmark),
+        is_public = True,
+        is_removed = False,
+        id__gt = after_id,
+        rendered__isnull = True
+    ).select_related('user').order_by('id')[:batch_size])
+    if not comments:
+        return None, 0
+    RenderedComment.objects.bulk_create([
+        RenderedComment(
+            comment = comment,
+            shared_bookmark_id = int(comment.object_pk),
+            html = render(comment)
+        ) for comment in comments
+    ])
+    return comments[-1].id, len(comments)
+
+
+def recount():
+    '''
+    Recompute every SharedBookmark.comment_count from the rendered
+    comments.
+    '''
+    shared_table = SharedBookmark._meta.db_table
+    rendered_table = RenderedComment._meta.db_table
+    # One correlated UPDATE instead of one COUNT(*) per bookmark.
+    connection.cursor().execute(
+        'UPDATE %s SET comment_count = '
+        '(SELECT COUNT(*) FROM %s WHERE %s.shared_bookmark_id = %s.id)' % (
+            shared_table, rendered_table, rendered_table, shared_table
+        )
+    )
+    transaction.commit_unless_managed()
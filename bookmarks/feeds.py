@@ -0,0 +1,152 @@
+'''
+Friends feeds.
+
+When a bookmark is created it is copied into the FeedItem table once
+for every user who has its owner as a friend, so reading a feed is a
+range scan over the reader's own rows whatever the number of friends.
+
+Users with more than FEED_FANOUT_LIMIT followers would make every save
+write that many rows, so their bookmarks aren't copied; feed_query()
+mixes them in when the feed is read instead.  Who they are is read from
+FollowerCount, which friend_add keeps up to date through
+follower_added(), rather than counted on every read.  "manage.py
+rebuild_feeds" recounts it.
+'''
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from bookmarks.models import Bookmark, FeedItem, FollowerCount, Friendship
+
+FANOUT_LIMIT = getattr(settings, 'FEED_FANOUT_LIMIT', 1000)
+
+# How many of a new friend's recent bookmarks are copied into the feed.
+BACKFILL_SIZE = 50
+
+
+def follower_added(user):
+    '''
+    Count a new follower of user, after the Friendship is saved.
+    '''
+    followers = FollowerCount.objects.filter(user = user)
+    if followers.update(count = F('count') + 1):
+        return
+    # The first one counted: start from the followers already there.
+    sid = transaction.savepoint()
+    try:
+        FollowerCount.objects.create(
+            user = user,
+            count = Friendship.objects.filter(to_friend = user).count()
+        )
+    except IntegrityError:
+        # Someone else created it first.
+        transaction.savepoint_rollback(sid)
+        followers.update(count = F('count') + 1)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+def recount_followers():
+    '''
+    Recompute every FollowerCount from the Friendship table.
+    '''
+    FollowerCount.objects.all().delete()
+    FollowerCount.objects.bulk_create([
+        FollowerCount(user_id = user_id, count = count)
+        for user_id, count in Friendship.objects.values('to_friend').annotate(
+            count = Count('id')
+        ).values_list('to_friend', 'count')
+    ])
+
+
+def is_fanned_out(user):
+    '''
+    Whether user has few enough followers for their bookmarks to be
+    copied into their feeds.
+    '''
+    return not FollowerCount.objects.filter(
+        user = user, count__gt = FANOUT_LIMIT
+    ).exists()
+
+
+def follower_ids(user):
+    '''
+    Return the ids of the users who have user as a friend, or None if
+    there are too many of them to fan out to.
+    '''
+    if not is_fanned_out(user):
+        return None
+    return list(Friendship.objects.filter(to_friend = user).values_list(
+        'from_friend_id', flat = True
+    ))
+
+
+def fan_out(bookmark):
+    '''
+    Put a newly created bookmark in its owner's followers' feeds.
+    '''
+    fan_out_batch(bookmark.user_id, [bookmark.id])
+
+
+def fan_out_batch(user, bookmark_ids):
+    '''
+    Put user's newly created bookmarks in their followers' feeds, with
+    one insert.  Rows that are there already, e.g. from a backfill() of
+    a new friend, are skipped, so running it twice is harmless.
+    '''
+    followers = follower_ids(user)
+    if not followers or not bookmark_ids:
+        return
+    existing = set(FeedItem.objects.filter(
+        owner__in = followers, bookmark__in = bookmark_ids
+    ).values_list('owner_id', 'bookmark_id'))
+    FeedItem.objects.bulk_create([
+        FeedItem(owner_id = follower, bookmark_id = bookmark_id)
+        for follower in followers for bookmark_id in bookmark_ids
+        if (follower, bookmark_id) not in existing
+    ])
+
+
+def backfill(user, friend, count = BACKFILL_SIZE):
+    '''
+    Copy friend's latest bookmarks into user's feed after they become
+    friends.
+    '''
+    if not is_fanned_out(friend):
+        return
+    recent = list(Bookmark.objects.filter(user = friend).order_by('-id').values_list(
+        'id', flat = True
+    )[:count])
+    existing = set(FeedItem.objects.filter(
+        owner = user, bookmark__in = recent
+    ).values_list('bookmark_id', flat = True))
+    FeedItem.objects.bulk_create([
+        FeedItem(owner = user, bookmark_id = id)
+        for id in recent if id not in existing
+    ])
+
+
+def feed_query(user):
+    '''
+    Return a Bookmark QuerySet of user's friends feed.  Order and slice
+    it by id, e.g. with bookmarks.pagination.
+    '''
+    # Friends whose bookmarks weren't fanned out.
+    popular = list(Friendship.objects.filter(
+        from_friend = user,
+        to_friend__follower_count__count__gt = FANOUT_LIMIT
+    ).values_list('to_friend', flat = True))
+
+    if popular:
+        return Bookmark.objects.filter(
+            Q(feeditem__owner = user) | Q(user__in = popular)
+        ).distinct()
+    return Bookmark.objects.filter(feeditem__owner = user)
+
+
+def rebuild(user):
+    '''
+    Rebuild user's whole feed from their friends' bookmarks.
+    '''
+    FeedItem.objects.filter(owner = user).delete()
+    for friendship in Friendship.objects.filter(from_friend = user):
+        backfill(user, friendship.to_friend_id, count = None)
@@ -85,3 +85,18 @@ class SearchForm(forms.Form):
         label = u'Enter a keyword to search for',
         widget = forms.TextInput(attrs = { 'size': 32 })
     )
+
+IMPORT_FORMATS = (
+    ('', 'Guess from file name'),
+    ('html', 'Browser bookmarks (HTML)'),
+    ('json', 'JSON Lines'),
+    ('csv', 'CSV'),
+)
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label = u'Bookmarks file')
+    format = forms.ChoiceField(
+        label = u'Format',
+        choices = IMPORT_FORMATS,
+        required = False
+    )
@@ -0,0 +1,84 @@
+'''
+Front page snapshot.
+
+The front page lists the SIZE most recently shared bookmarks.  Rather
+than loading SharedBookmarks and following each one to its bookmark,
+link and user while rendering, snapshot() keeps the list as plain rows
+(id, title, url, username, votes) read with one joined query.
+
+The rows are stored in the cache under the "shared" "all" version (see
+bookmarks/cache.py), which sharing, voting and editing a shared bookmark
+already bump, so the first request after a change rebuilds them and
+every other process picks up the new copy.  Each process also keeps the
+last rows it saw and reuses them for as long as the version is
+unchanged, which costs a single cache lookup.
+'''
+from django.core.cache import cache as shared_cache
+from bookmarks import cache
+from bookmarks.models import SharedBookmark
+
+SIZE = 10
+
+# Row keys and the fields they're read from.
+COLUMNS = (
+    ('id', 'id'),
+    ('title', 'bookmark__title'),
+    ('url', 'bookmark__link__url'),
+    ('username', 'bookmark__user__username'),
+    ('votes', 'votes'),
+)
+
+
+def row(shared_bookmark):
+    '''
+    The display row of a SharedBookmark whose bookmark, link and user
+    are already loaded.
+    '''
+    bookmark = shared_bookmark.bookmark
+    return {
+        'id': shared_bookmark.id,
+        'title': bookmark.title,
+        'url': bookmark.link.url,
+        'username': bookmark.user.username,
+        'votes': shared_bookmark.votes,
+    }
+
+
+def build(size = SIZE):
+    '''
+    Read the rows of the size most recently shared bookmarks.
+    '''
+    names = [name for name, field in COLUMNS]
+    return [dict(zip(names, values)) for values in
+            SharedBookmark.objects.order_by('-date').values_list(
+                *[field for name, field in COLUMNS]
+            )[:size]]
+
+
+def _snapshot_key(version):
+    return 'bookmarks:frontpage:%s' % version
+
+
+# This process's (version, rows).
+_local = [None]
+
+
+def snapshot():
+    '''
+    Return the front page rows, newest share first.
+    '''
+    version = cache.get_version('shared', 'all')
+    local = _local[0]
+    if local is not None and local[0] == version:
+        return local[1]
+
+    rows = shared_cache.get(_snapshot_key(version))
+    if rows is None:
+        rows = build()
+        shared_cache.set(_snapshot_key(version), rows, cache.FRAGMENT_TIMEOUT)
+    _local[0] = (version, rows)
+    return rows
+
+
+def reset():
+    _local[0] = None
@@ -0,0 +1,358 @@
+'''
+Bulk bookmark import.
+
+The parsers read browser export files a chunk or a line at a time and
+yield one dictionary per bookmark with 'url', 'title' and 'tags' keys,
+so a file never has to be held in memory.  import_bookmarks() then
+saves the records in batches: each batch looks up its links, bookmarks
+and tags with one query per table and inserts whatever is missing with
+bulk_create().
+
+A file that stops parsing part way raises ParseError.  The batches
+before it stay imported, and the error's stats say how many there were.
+'''
+import codecs
+import csv
+import json
+import re
+import time
+from htmlentitydefs import name2codepoint
+from HTMLParser import HTMLParseError, HTMLParser
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from bookmarks import autocomplete, cache, links, metadata, search, tasks
+from bookmarks.models import Bookmark, Link, Tag
+
+CHUNK_SIZE = 64 * 1024
+
+# Field lengths from bookmarks.models.
+URL_LENGTH = Link._meta.get_field('url').max_length
+TITLE_LENGTH = Bookmark._meta.get_field('title').max_length
+TAG_LENGTH = Tag._meta.get_field('name').max_length
+
+# The only URLs imported.  Anything else (javascript:, data:, file:)
+# would end up in an href on every bookmark list.
+SCHEMES = ('http', 'https', 'ftp')
+
+_validate_url = URLValidator()
+
+
+class ParseError(Exception):
+    '''
+    The file isn't valid in the format it's read as.  import_bookmarks()
+    sets stats to what it imported before the error.
+    '''
+    stats = None
+
+
+def _split_tags(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(value)
+    return [name[:TAG_LENGTH] for name in re.split(r'[,\s]+', value) if name]
+
+
+def _record(url, title, tags):
+    url = (url or '').strip()
+    title = (title or '').strip() or url
+    return {
+        'url': url,
+        'title': title[:TITLE_LENGTH],
+        'tags': _split_tags(tags),
+    }
+
+
+def _clean_url(url):
+    # The canonical form of url, or None if it isn't a valid http, https
+    # or ftp URL that fits in a Link.
+    try:
+        url = links.canonicalize(url)
+    except ValueError:
+        return None
+    if url.split('://', 1)[0] not in SCHEMES or len(url) > URL_LENGTH:
+        return None
+    try:
+        _validate_url(url)
+    except ValidationError:
+        return None
+    return url
+
+
+def _json_record(item, where):
+    if not isinstance(item, dict):
+        raise ParseError('%s is not a JSON object.' % where)
+    return _record(item.get('url'), item.get('title'), item.get('tags'))
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class NetscapeParser(HTMLParser):
+    '''
+    Collects the <a href="..." tags="..."> entries of a Netscape
+    bookmark file (the format every browser exports).
+    '''
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.records = []
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            attrs = dict(attrs)
+            self._current = {
+                'url': attrs.get('href'),
+                'tags': attrs.get('tags'),
+                'title': [],
+            }
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._current is not None:
+            current = self._current
+            self.records.append(_record(
+                current['url'], u''.join(current['title']), current['tags']
+            ))
+            self._current = None
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current['title'].append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+
+    def handle_charref(self, name):
+        try:
+            if name.lower().startswith('x'):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except ValueError:
+            pass
+
+
+def parse_netscape(fileobj):
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    parser = NetscapeParser()
+    try:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(decoder.decode(chunk))
+            for record in parser.records:
+                yield record
+            parser.records = []
+        parser.feed(decoder.decode('', True))
+        parser.close()
+    except HTMLParseError as e:
+        raise ParseError('Line %d is not valid HTML: %s' % (e.lineno, e.msg))
+    for record in parser.records:
+        yield record
+
+
+def parse_json(fileobj):
+    '''
+    Reads JSON Lines, one {"url", "title", "tags"} object per line.  A
+    file holding a single JSON array is accepted too, but has to be
+    loaded whole.
+    '''
+    # Look at the first character that isn't blank.  Only read methods
+    # are used: on a real file, iterating reads ahead, and a read()
+    # after that raises rather than lose the data read ahead.
+    first = fileobj.read(1)
+    while first and first.isspace():
+        first = fileobj.read(1)
+    if first == '[':
+        try:
+            items = json.loads(first + fileobj.read())
+        except ValueError as e:
+            raise ParseError('The file is not valid JSON: %s' % e)
+        for number, item in enumerate(items):
+            yield _json_record(item, 'Item %d' % (number + 1))
+        return
+
+    line = first + fileobj.readline()
+    number = 1
+    while line:
+        line = line.strip()
+        if line:
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ParseError('Line %d is not valid JSON: %s' % (number, e))
+            yield _json_record(item, 'Line %d' % number)
+        line = fileobj.readline()
+        number += 1
+
+
+def parse_csv(fileobj):
+    '''
+    Reads CSV files with a header row naming url, title and tags columns.
+    '''
+    reader = csv.DictReader(fileobj)
+    try:
+        for row in reader:
+            yield _record(
+                _text(row.get('url')), _text(row.get('title')), _text(row.get('tags'))
+            )
+    except csv.Error as e:
+        raise ParseError('Line %d is not valid CSV: %s' % (reader.line_num, e))
+
+
+PARSERS = {
+    'html': parse_netscape,
+    'json': parse_json,
+    'csv': parse_csv,
+}
+
+EXTENSIONS = {
+    'htm': 'html',
+    'html': 'html',
+    'json': 'json',
+    'jsonl': 'json',
+    'csv': 'csv',
+}
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return EXTENSIONS.get(extension, 'html')
+
+
+def get_or_create_tags(names):
+    '''
+    Return a {name: id} dictionary for the tags with the given names,
+    creating the missing ones with a single bulk insert.
+    '''
+    if not names:
+        return {}
+    tags = dict(Tag.objects.filter(name__in = names).values_list('name', 'id'))
+    missing = [name for name in names if name not in tags]
+    if missing:
+        sid = transaction.savepoint()
+        try:
+            Tag.objects.bulk_create([Tag(name = name) for name in missing])
+        except IntegrityError:
+            # Someone else created one of them first.
+            transaction.savepoint_rollback(sid)
+            for name in missing:
+                Tag.objects.get_or_create(name = name)
+        else:
+            transaction.savepoint_commit(sid)
+        tags.update(Tag.objects.filter(name__in = missing).values_list('name', 'id'))
+    return tags
+
+
+def import_bookmarks(user, records, batch_size = 500):
+    '''
+    Save the bookmark records for user, skipping invalid URLs and URLs
+    the user has already bookmarked.  Returns a dictionary of statistics: records
+    read, bookmarks created, records skipped and seconds taken.
+
+    If records raises ParseError, the records before it are still saved
+    and the error is raised again with its stats set.
+    '''
+    stats = {'read': 0, 'created': 0, 'skipped': 0}
+    start = time.time()
+    batch = []
+    error = None
+    try:
+        for record in records:
+            stats['read'] += 1
+            url = record['url'] and _clean_url(record['url'])
+            if not url:
+                stats['skipped'] += 1
+                continue
+            record['url'] = url
+            batch.append(record)
+            if len(batch) == batch_size:
+                stats['created'] += _import_batch(user, batch)
+                batch = []
+    except ParseError as e:
+        error = e
+    if batch:
+        stats['created'] += _import_batch(user, batch)
+
+    stats['skipped'] = stats['read'] - stats['created']
+    stats['seconds'] = time.time() - start
+    cache.invalidate('user', user.username)
+    if error is not None:
+        error.stats = stats
+        raise error
+    return stats
+
+
+@cache.commit_on_success
+def _import_batch(user, batch):
+    # Links: reuse the existing ones, under any spelling of their URL,
+    # and bulk insert the rest.  The URLs are already canonical.
+    link_ids, created = links.get_or_create_links(
+        set(record['url'] for record in batch)
+    )
+    metadata.enqueue(created)
+
+    # Later duplicates of a link in the same batch win.
+    records = dict((link_ids[record['url']], record) for record in batch)
+
+    # Bookmarks: skip the links this user already has.
+    existing = set(Bookmark.objects.filter(
+        user = user, link__in = records.keys()
+    ).values_list('link_id', flat = True))
+    new = [(link_id, record) for link_id, record in records.items()
+           if link_id not in existing]
+    if not new:
+        return 0
+    Bookmark.objects.bulk_create([
+        Bookmark(title = record['title'], user = user, link_id = link_id)
+        for link_id, record in new
+    ])
+    bookmark_ids = dict(Bookmark.objects.filter(
+        user = user, link__in = [link_id for link_id, record in new]
+    ).values_list('link_id', 'id'))
+
+    # Tags: same as links.
+    names = set()
+    for link_id, record in new:
+        names.update(record['tags'])
+    tag_ids = get_or_create_tags(names)
+
+    # Tag/bookmark rows, then the tag counts they add up to.
+    Through = Tag.bookmarks.through
+    rows = []
+    counts = {}
+    for link_id, record in new:
+        for name in set(record['tags']):
+            rows.append(Through(tag_id = tag_ids[name], bookmark_id = bookmark_ids[link_id]))
+            counts[name] = counts.get(name, 0) + 1
+    Through.objects.bulk_create(rows)
+    by_increment = {}
+    for name, count in counts.items():
+        by_increment.setdefault(count, []).append(tag_ids[name])
+    for increment, ids in by_increment.items():
+        Tag.objects.filter(id__in = ids).update(
+            bookmark_count = F('bookmark_count') + increment
+        )
+
+    search.get_backend().index([
+        (bookmark_ids[link_id], record['title'], record['url'], record['tags'])
+        for link_id, record in new
+    ])
+    # The followers' friends feeds are filled in the background, once
+    # this batch has committed (see bookmarks/tasks.py).
+    tasks.enqueue(
+        'bookmarks_imported', user_id = user.id,
+        bookmark_ids = [bookmark_ids[link_id] for link_id, record in new]
+    )
+    cache.after_commit(autocomplete.tags_changed, counts, user.id)
+    cache.invalidate('tag', *counts.keys())
+    cache.invalidate('search', 'all')
+    return len(new)
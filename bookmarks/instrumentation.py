@@ -0,0 +1,149 @@
+'''
+Per-view performance statistics.
+
+bookmarks.middleware.InstrumentationMiddleware records, for every
+request, the view's wall time, number of database queries, time spent in
+the database, template rendering time and response size.  The queries
+and database time are also recorded per database alias, as
+"queries:<alias>" and "db_ms:<alias>".  Each process
+keeps the most recent SAMPLE_SIZE samples per view and metric, so memory
+use is fixed and percentiles always describe recent traffic.
+
+Every PUBLISH_INTERVAL seconds a process copies its samples into the
+cache, where report() merges the samples of all processes.  That needs
+a cache shared between processes (e.g. memcached) to cover a whole
+deployment; with the local memory cache each process only sees itself.
+'''
+import os
+import socket
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+
+SAMPLE_SIZE = getattr(settings, 'VIEW_STATS_SAMPLE_SIZE', 500)
+PUBLISH_INTERVAL = getattr(settings, 'VIEW_STATS_PUBLISH_INTERVAL', 10)
+
+METRICS = ('wall_ms', 'queries', 'db_ms', 'template_ms', 'bytes')
+PERCENTILES = (50, 95, 99)
+
+PROCESSES_KEY = 'bookmarks:view-stats:processes'
+PROCESS_KEY = 'bookmarks:view-stats:%s:%d' % (socket.gethostname(), os.getpid())
+# Published samples outlive a few missed publishes, then expire with
+# their process.
+PUBLISH_TIMEOUT = PUBLISH_INTERVAL * 30
+PROCESSES_TIMEOUT = 60 * 60 * 24 * 30
+
+_lock = threading.Lock()
+_samples = {}
+_counts = {}
+_last_publish = [0.0]
+
+
+def record(view, values):
+    '''
+    Add one request's measurements for view.  values maps metric names
+    to numbers; metrics that couldn't be measured are left out.
+    '''
+    with _lock:
+        samples = _samples.get(view)
+        if samples is None:
+            samples = _samples[view] = dict(
+                (metric, deque(maxlen = SAMPLE_SIZE)) for metric in METRICS
+            )
+        for metric, value in values.items():
+            if metric not in samples:
+                # A per alias metric.
+                samples[metric] = deque(maxlen = SAMPLE_SIZE)
+            samples[metric].append(value)
+        _counts[view] = _counts.get(view, 0) + 1
+
+    now = time.time()
+    if now - _last_publish[0] > PUBLISH_INTERVAL:
+        _last_publish[0] = now
+        publish()
+
+
+def _local_snapshot():
+    with _lock:
+        return dict(
+            (view, {
+                'count': _counts[view],
+                'samples': dict(
+                    (metric, list(values)) for metric, values in samples.items()
+                )
+            })
+            for view, samples in _samples.items()
+        )
+
+
+def publish():
+    '''
+    Copy this process's samples into the cache.
+    '''
+    cache.set(PROCESS_KEY, _local_snapshot(), PUBLISH_TIMEOUT)
+    processes = cache.get(PROCESSES_KEY) or []
+    if PROCESS_KEY not in processes:
+        cache.set(PROCESSES_KEY, processes + [PROCESS_KEY], PROCESSES_TIMEOUT)
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+
+
+def percentile(values, percent):
+    # Nearest rank percentile of an already sorted list.
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def summarize(snapshot):
+    '''
+    Turn {view: {'count', 'samples'}} into {view: {'count', metric:
+    {'p50', 'p95', 'p99', 'max'}}}.
+    '''
+    report = {}
+    for view, data in snapshot.items():
+        summary = {'count': data['count']}
+        for metric, values in data['samples'].items():
+            values = sorted(values)
+            if not values:
+                continue
+            summary[metric] = dict(
+                ('p%d' % percent, percentile(values, percent))
+                for percent in PERCENTILES
+            )
+            summary[metric]['max'] = values[-1]
+        report[view] = summary
+    return report
+
+
+def report():
+    '''
+    Summarize the samples published by every process.
+    '''
+    publish()
+    processes = cache.get(PROCESSES_KEY) or []
+    snapshots = cache.get_many(processes)
+
+    merged = {}
+    for snapshot in snapshots.values():
+        for view, data in snapshot.items():
+            target = merged.setdefault(view, {
+                'count': 0,
+                'samples': dict((metric, []) for metric in METRICS)
+            })
+            target['count'] += data['count']
+            for metric, values in data['samples'].items():
+                target['samples'].setdefault(metric, []).extend(values)
+
+    # Forget processes whose samples have expired.
+    live = [key for key in processes if key in snapshots]
+    if live != processes:
+        cache.set(PROCESSES_KEY, live, PROCESSES_TIMEOUT)
+    return summarize(merged)
@@ -0,0 +1,339 @@
+'''
+Canonical URLs.
+
+The same page is reachable under many spellings of its URL: with or
+without the scheme's default port, a trailing dot on the host, redundant
+"." and ".." path segments, tracking parameters or a fragment.
+canonicalize() reduces them to one form and url_key() hashes that form,
+without the scheme, into the fixed width Link.url_hash, so
+"http://x.com", "https://x.com/" and "x.com/?utm_source=..." are all
+one Link.
+
+Links saved before url_hash existed have none.  merge_batch(), run by
+"manage.py merge_links", gives them their keys and folds duplicates into
+the Link that was saved first, moving their bookmarks, tags and votes
+along.
+'''
+import hashlib
+import re
+import urlparse
+from django.contrib.comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, Q
+from bookmarks import cache, popularity, search
+from bookmarks.models import Bookmark, Friendship, Link, PendingVote, \
+    RenderedComment, SharedBookmark, Tag
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only say where a visitor came from.
+TRACKING_PARAMS = set([
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_hsenc', '_hsmi',
+])
+TRACKING_PREFIXES = ('utm_', )
+
+UNRESERVED = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~'
+)
+
+
+def _normalize_escapes(value):
+    # Decode escaped unreserved characters and upper case the rest.
+    def fix(match):
+        char = chr(int(match.group(1), 16))
+        if char in UNRESERVED:
+            return char
+        return '%' + match.group(1).upper()
+    return re.sub(r'%([0-9A-Fa-f]{2})', fix, value)
+
+
+def _remove_dot_segments(path):
+    segments = path.split('/')[1:]
+    output = []
+    for segment in segments:
+        if segment == '..':
+            if output:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return '/' + '/'.join(output)
+
+
+def _is_tracking(pair):
+    name = pair.split('=', 1)[0].lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize(url):
+    '''
+    Return the canonical form of url: lower case scheme and host, no
+    default port, a normalized path, the query parameters sorted and
+    stripped of tracking parameters, and no fragment.  URLs without a
+    scheme are taken to be http.
+    '''
+    url = url.strip()
+    if '://' not in url:
+        url = 'http://' + url
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        # IPv6 address.
+        host = '[%s]' % host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = '%s:%d' % (host, port)
+    userinfo = parts.netloc.rpartition('@')[0]
+    if userinfo:
+        host = '%s@%s' % (userinfo, host)
+
+    path = _remove_dot_segments(_normalize_escapes(parts.path) or '/')
+    query = '&'.join(sorted(
+        _normalize_escapes(pair) for pair in parts.query.split('&')
+        if pair and not _is_tracking(pair)
+    ))
+    return urlparse.urlunsplit((scheme, host, path, query, ''))
+
+
+def url_key(url):
+    '''
+    The Link.url_hash of url: a SHA-1 of its canonical form without the
+    scheme, so the http and https versions of a page share a key.
+    '''
+    address = canonicalize(url).split('://', 1)[1]
+    return hashlib.sha1(address.encode('utf-8')).hexdigest()
+
+
+def get_link(url):
+    '''
+    Return the Link for url, or raise Link.DoesNotExist.  Links that
+    don't have a url_hash yet are matched on their canonical URL.
+    '''
+    url = canonicalize(url)
+    return Link.objects.filter(
+        Q(url_hash = url_key(url)) | Q(url = url, url_hash__isnull = True)
+    )[:1].get()
+
+
+def get_or_create_link(url):
+    '''
+    Like Link.objects.get_or_create(), but for any spelling of url.
+    New links are saved with the canonical URL.
+    '''
+    url = canonicalize(url)
+    key = url_key(url)
+    try:
+        return Link.objects.get(url_hash = key), False
+    except Link.DoesNotExist:
+        pass
+    # A link saved before url_hash existed.
+    if Link.objects.filter(url = url, url_hash__isnull = True).update(url_hash = key):
+        return Link.objects.get(url_hash = key), False
+    return Link.objects.get_or_create(url_hash = key, defaults = {'url': url})
+
+
+def get_or_create_links(urls):
+    '''
+    Bulk version of get_or_create_link().  Returns {url: link id} for
+    the given urls and the ids of the links that were created.
+    '''
+    keys = dict((url, url_key(url)) for url in urls)
+    ids = dict(Link.objects.filter(
+        url_hash__in = set(keys.values())
+    ).values_list('url_hash', 'id'))
+
+    missing = dict((key, canonicalize(url)) for url, key in keys.items()
+                   if key not in ids)
+    if missing:
+        # Links saved before url_hash existed.
+        for url, id in Link.objects.filter(
+            url__in = missing.values(), url_hash__isnull = True
+        ).values_list('url', 'id'):
+            key = url_key(url)
+            Link.objects.filter(id = id).update(url_hash = key)
+            ids[key] = id
+            del missing[key]
+
+    created = []
+    if missing:
+        Link.objects.bulk_create([
+            Link(url = url, url_hash = key) for key, url in missing.items()
+        ])
+        created = list(Link.objects.filter(
+            url_hash__in = missing.keys()
+        ).values_list('id', flat = True))
+        ids.update(Link.objects.filter(
+            id__in = created
+        ).values_list('url_hash', 'id'))
+
+    return dict((url, ids[key]) for url, key in keys.items()), created
+
+
+Through = Tag.bookmarks.through
+Vote = SharedBookmark.users_voted.through
+
+
+@cache.commit_on_success
+def merge_batch(after_id = 0, batch_size = 500):
+    '''
+    Give the batch_size links after after_id their url_hash, merging
+    each one that duplicates an earlier link into it.  Returns the last
+    link id looked at (None once there are no links left) and the number
+    of links merged away.
+    '''
+    links = list(Link.objects.filter(id__gt = after_id).order_by('id').values_list(
+        'id', 'url', 'url_hash'
+    )[:batch_size])
+    if not links:
+        return None, 0
+
+    keys = dict((id, url_key(url)) for id, url, url_hash in links)
+    keepers = dict(Link.objects.filter(
+        url_hash__in = set(keys.values())
+    ).values_list('url_hash', 'id'))
+
+    touched = {'bookmarks': set(), 'removed': set(), 'shared': set(), 'tags': set()}
+    merged = 0
+    for id, url, url_hash in links:
+        key = keys[id]
+        keeper = keepers.setdefault(key, id)
+        if keeper != id:
+            _merge_link(id, keeper, touched)
+            merged += 1
+        elif url_hash != key:
+            Link.objects.filter(id = id).update(url_hash = key)
+
+    if merged:
+        _refresh(touched)
+    return links[-1][0], merged
+
+
+def _merge_link(link_id, keeper_id, touched):
+    # Users who bookmarked both links keep their bookmark of the keeper;
+    # everybody else's bookmark simply moves over.
+    kept = dict(Bookmark.objects.filter(
+        link = keeper_id
+    ).values_list('user_id', 'id'))
+    bookmarks = Bookmark.objects.filter(link = link_id)
+    moved = list(bookmarks.exclude(
+        user__in = kept.keys()
+    ).values_list('id', flat = True))
+    Bookmark.objects.filter(id__in = moved).update(link = keeper_id)
+    touched['bookmarks'].update(moved)
+
+    for bookmark_id, user_id in bookmarks.values_list('id', 'user_id'):
+        _merge_bookmark(bookmark_id, kept[user_id], touched)
+
+    # Takes the link's metadata and fetch job with it.
+    Link.objects.filter(id = link_id).delete()
+
+
+def _merge_bookmark(bookmark_id, keeper_id, touched):
+    # Tags the kept bookmark doesn't have yet move over; the rest go
+    # away with the duplicate.
+    has = set(Through.objects.filter(
+        bookmark = keeper_id
+    ).values_list('tag_id', flat = True))
+    tags = set(Through.objects.filter(
+        bookmark = bookmark_id
+    ).values_list('tag_id', flat = True))
+    Through.objects.filter(
+        bookmark = bookmark_id, tag__in = tags - has
+    ).update(bookmark = keeper_id)
+    Tag.objects.filter(id__in = tags & has).update(
+        bookmark_count = F('bookmark_count') - 1
+    )
+    touched['tags'].update(tags)
+
+    # A share moves over too, or its votes and comments do if both were
+    # shared.
+    shares = dict(SharedBookmark.objects.filter(
+        bookmark__in = [bookmark_id, keeper_id]
+    ).values_list('bookmark_id', 'id'))
+    if bookmark_id in shares and keeper_id not in shares:
+        SharedBookmark.objects.filter(id = shares[bookmark_id]).update(
+            bookmark = keeper_id
+        )
+        touched['shared'].add(shares[bookmark_id])
+    elif bookmark_id in shares:
+        _merge_comments(shares[bookmark_id], shares[keeper_id])
+        _merge_votes(shares[bookmark_id], shares[keeper_id])
+        touched['shared'].add(shares[keeper_id])
+
+    Bookmark.objects.filter(id = bookmark_id).delete()
+    touched['bookmarks'].add(keeper_id)
+    touched['removed'].add(bookmark_id)
+
+
+def _merge_comments(shared_id, keeper_id):
+    # Before the duplicate share is deleted, which would take the
+    # rendered comments with it and leave the comments pointing nowhere.
+    Comment.objects.filter(
+        content_type = ContentType.objects.get_for_model(SharedBookmark),
+        object_pk = unicode(shared_id)
+    ).update(object_pk = unicode(keeper_id))
+    RenderedComment.objects.filter(shared_bookmark = shared_id).update(
+        shared_bookmark = keeper_id
+    )
+    SharedBookmark.objects.filter(id = keeper_id).update(
+        comment_count = RenderedComment.objects.filter(
+            shared_bookmark = keeper_id
+        ).count()
+    )
+
+
+def _merge_votes(shared_id, keeper_id):
+    voters = set(Vote.objects.filter(
+        sharedbookmark = keeper_id
+    ).values_list('user_id', flat = True))
+    new = set(Vote.objects.filter(
+        sharedbookmark = shared_id
+    ).values_list('user_id', flat = True)) - voters
+    Vote.objects.bulk_create([
+        Vote(sharedbookmark_id = keeper_id, user_id = user_id) for user_id in new
+    ])
+    SharedBookmark.objects.filter(id = keeper_id).update(
+        votes = F('votes') + len(new)
+    )
+
+    # Buffered votes go along unless the user has one waiting already.
+    PendingVote.objects.filter(shared_bookmark = shared_id).exclude(
+        user__in = list(voters) + list(PendingVote.objects.filter(
+            shared_bookmark = keeper_id
+        ).values_list('user_id', flat = True))
+    ).update(shared_bookmark = keeper_id)
+
+    SharedBookmark.objects.filter(id = shared_id).delete()
+
+
+def _refresh(touched):
+    # Bring the search index, popularity scores and cached fragments in
+    # line with the merged bookmarks.
+    backend = search.get_backend()
+    backend.remove(touched['removed'])
+    backend.index(search.bookmark_documents(
+        Bookmark.objects.filter(id__in = list(touched['bookmarks']))
+    ))
+    popularity.update_scores(touched['shared'])
+
+    user_ids = set(Bookmark.objects.filter(
+        id__in = list(touched['bookmarks'])
+    ).values_list('user_id', flat = True))
+    cache.invalidate('user', *Bookmark.objects.filter(
+        id__in = list(touched['bookmarks'])
+    ).values_list('user__username', flat = True).distinct())
+    cache.invalidate('friends', *Friendship.objects.filter(
+        to_friend__in = user_ids
+    ).values_list('from_friend__username', flat = True).distinct())
+    cache.invalidate('tag', *Tag.objects.filter(
+        id__in = list(touched['tags'])
+    ).values_list('name', flat = True))
+    cache.invalidate('shared', 'all')
+    cache.invalidate('search', 'all')
@@ -0,0 +1,57 @@
+import json
+from optparse import make_option
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+from bookmarks.benchmarks import measure_concurrency
+
+
+class Command(NoArgsCommand):
+    help = ('Runs reader and writer threads against the database side by '
+            'side and reports their throughput, latency and lock errors.  '
+            'Use --settings to compare SQLITE_PRAGMAS.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--readers', type = 'int', default = 4,
+                    help = 'Number of reading threads.'),
+        make_option('--writers', type = 'int', default = 2,
+                    help = 'Number of writing threads.'),
+        make_option('--seconds', type = 'float', default = 5.0,
+                    help = 'How long to run.'),
+        make_option('--json', action = 'store_true', dest = 'json',
+                    default = False, help = 'Print the result as JSON.'),
+    )
+
+    def handle_noargs(self, **options):
+        if (connection.vendor == 'sqlite' and
+                connection.settings_dict['NAME'] in ('', ':memory:')):
+            raise CommandError('An in-memory database is private to each '
+                               'thread; use a database file.')
+
+        result = measure_concurrency(
+            options['readers'], options['writers'], options['seconds']
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent = 2) + '\n')
+            return
+
+        if 'pragmas' in result:
+            self.stdout.write('pragmas: %s\n' % ', '.join(
+                '%s=%s' % item for item in sorted(result['pragmas'].items())
+            ))
+        for kind, threads in (('read', 'readers'), ('write', 'writers')):
+            self.stdout.write(
+                '%d %s threads: %d %ss (%.0f/s), p50 %s ms, p95 %s ms\n' % (
+                    result[threads], kind, result[kind + 's'], kind,
+                    result[kind + 's_per_s'],
+                    _ms(result[kind + '_p50_ms']), _ms(result[kind + '_p95_ms'])
+                )
+            )
+        self.stdout.write('lock errors: %d, other errors: %d\n' % (
+            result['lock_errors'], result['errors']
+        ))
+        for message in result['error_samples']:
+            self.stdout.write('  %s\n' % message)
+
+
+def _ms(value):
+    return '-' if value is None else '%.1f' % value
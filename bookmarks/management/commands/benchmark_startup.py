@@ -0,0 +1,28 @@
+import os
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks.benchmarks import measure_startup
+
+
+class Command(NoArgsCommand):
+    help = ('Measures how long a new worker takes from starting to its '
+            'first response.  Use --settings to compare profiles, e.g. '
+            'django_bookmarks.settings_production.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--url', default = '/',
+                    help = 'URL to request.'),
+        make_option('--runs', type = 'int', default = 5,
+                    help = 'Number of processes to start.'),
+    )
+
+    def handle_noargs(self, **options):
+        result = measure_startup(options['url'], options['runs'])
+        self.stdout.write(
+            '%s with %s: status %d, cold start %.0f ms (load %.0f ms, '
+            'first request %.0f ms), warm request %.1f ms\n' % (
+                options['url'], os.environ['DJANGO_SETTINGS_MODULE'],
+                result['status'], result['total_ms'], result['load_ms'],
+                result['first_ms'], result['second_ms']
+            )
+        )
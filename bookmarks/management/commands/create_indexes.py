@@ -0,0 +1,43 @@
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import DatabaseError, connection, models, transaction
+from bookmarks.models import Bookmark
+
+# Constraints that syncdb puts in CREATE TABLE, for tables that were
+# created before they were added to the models.
+EXTRA_SQL = [
+    'CREATE UNIQUE INDEX bookmarks_bookmark_user_id_link_id '
+    'ON bookmarks_bookmark (user_id, link_id)',
+]
+
+
+class Command(NoArgsCommand):
+    help = ('Adds the bookmarks indexes to a database created before '
+            'they existed.  Indexes that are already there are skipped.')
+
+    def handle_noargs(self, **options):
+        style = no_style()
+        statements = []
+        for model in models.get_models(models.get_app('bookmarks')):
+            statements.extend(connection.creation.sql_indexes_for_model(model, style))
+            statements.extend(custom_sql_for_model(model, style, connection))
+        statements.extend(EXTRA_SQL)
+
+        created = 0
+        cursor = connection.cursor()
+        for statement in statements:
+            sid = transaction.savepoint()
+            try:
+                cursor.execute(statement)
+            except DatabaseError:
+                # Already exists.
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.savepoint_commit(sid)
+                created += 1
+        transaction.commit_unless_managed()
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Ran %d of %d index statements.\n'
+                              % (created, len(statements)))
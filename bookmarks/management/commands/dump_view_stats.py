@@ -0,0 +1,34 @@
+import json
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks import instrumentation
+
+
+class Command(NoArgsCommand):
+    help = 'Prints the per-view latency and query statistics.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--json', action = 'store_true', dest = 'json',
+                    default = False, help = 'Print the raw report as JSON.'),
+    )
+
+    def handle_noargs(self, **options):
+        report = instrumentation.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent = 2) + '\n')
+            return
+
+        columns = [(metric, 'p%d' % percent)
+                   for metric in instrumentation.METRICS
+                   for percent in instrumentation.PERCENTILES]
+        self.stdout.write('%-45s %7s %s\n' % (
+            'view', 'count',
+            ' '.join('%14s' % ('%s %s' % column) for column in columns)
+        ))
+        for view in sorted(report, key = lambda view: -report[view]['count']):
+            summary = report[view]
+            cells = []
+            for metric, percent in columns:
+                value = summary.get(metric, {}).get(percent)
+                cells.append('%14s' % ('-' if value is None else '%.1f' % value))
+            self.stdout.write('%-45s %7d %s\n' % (view, summary['count'], ' '.join(cells)))
@@ -0,0 +1,38 @@
+import sys
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from bookmarks import exporters
+
+
+class Command(BaseCommand):
+    args = '<username>'
+    help = ("Writes a user's bookmarks as Netscape HTML, JSON Lines or CSV.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest = 'format', default = 'html',
+                    choices = exporters.FORMATS.keys(),
+                    help = 'Output format (html, json or csv).'),
+        make_option('--output', dest = 'output', default = None,
+                    help = 'File to write to.  Defaults to standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_bookmarks %s' % self.args)
+
+        try:
+            user = User.objects.get(username = args[0])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % args[0])
+
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = sys.stdout
+        try:
+            for chunk in exporters.export_bookmarks(user, options['format']):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,46 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks import metadata
+
+
+class Command(NoArgsCommand):
+    help = ('Fetches the titles, canonical URLs, favicons and HTTP status '
+            'of newly bookmarked links.  Runs once unless --interval is '
+            'given.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 100,
+                    help = 'Number of links to claim at a time.'),
+        make_option('--workers', type = 'int', dest = 'workers',
+                    default = metadata.FETCH_WORKERS,
+                    help = 'Number of pages to fetch at once.'),
+        make_option('--interval', type = 'float', dest = 'interval',
+                    default = None,
+                    help = 'Keep running, checking for new links every '
+                           'INTERVAL seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        # One throttle for the whole run, so the per-host delay holds
+        # across batches too.
+        throttle = metadata.HostThrottle(metadata.HOST_DELAY)
+        while True:
+            taken = finished = 0
+            while True:
+                batch_taken, batch_finished = metadata.fetch_pending(
+                    options['batch_size'], options['workers'], throttle
+                )
+                taken += batch_taken
+                finished += batch_finished
+                if batch_taken < options['batch_size']:
+                    break
+            if int(options['verbosity']) > 0:
+                self.stdout.write('Fetched %d links, %d to be retried.\n' % (
+                    taken, taken - finished
+                ))
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks.votes import flush_votes
+
+
+class Command(NoArgsCommand):
+    help = ('Applies buffered votes to their shared bookmarks.  Runs once '
+            'unless --interval is given.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 1000,
+                    help = 'Number of votes to apply per transaction.'),
+        make_option('--interval', type = 'float', dest = 'interval',
+                    default = None,
+                    help = 'Keep running, flushing every INTERVAL seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        while True:
+            total = 0
+            while True:
+                flushed = flush_votes(options['batch_size'])
+                total += flushed
+                if flushed < options['batch_size']:
+                    break
+            if int(options['verbosity']) > 0:
+                self.stdout.write('Flushed %d votes.\n' % total)
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks.benchmarks import generate_dataset
+
+
+class Command(NoArgsCommand):
+    help = ('Fills the database with synthetic users, bookmarks, tags, '
+            'friendships and votes for benchmarking.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--users', type = 'int', default = 100),
+        make_option('--bookmarks-per-user', type = 'int', dest = 'bookmarks_per_user',
+                    default = 50),
+        make_option('--tags', type = 'int', default = 500,
+                    help = 'Number of distinct tags.'),
+        make_option('--tags-per-bookmark', type = 'int', dest = 'tags_per_bookmark',
+                    default = 3),
+        make_option('--friends-per-user', type = 'int', dest = 'friends_per_user',
+                    default = 10),
+        make_option('--share-ratio', type = 'float', dest = 'share_ratio',
+                    default = 0.2,
+                    help = 'Fraction of bookmarks that are shared.'),
+        make_option('--votes-per-share', type = 'int', dest = 'votes_per_share',
+                    default = 5,
+                    help = 'Average number of extra votes per shared bookmark.'),
+        make_option('--zipf', type = 'float', default = 1.1,
+                    help = 'Zipf exponent of link and tag popularity.'),
+        make_option('--seed', type = 'int', default = 0),
+    )
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        counts = generate_dataset(
+            users = options['users'],
+            bookmarks_per_user = options['bookmarks_per_user'],
+            tags = options['tags'],
+            tags_per_bookmark = options['tags_per_bookmark'],
+            friends_per_user = options['friends_per_user'],
+            share_ratio = options['share_ratio'],
+            votes_per_share = options['votes_per_share'],
+            zipf = options['zipf'],
+            seed = options['seed']
+        )
+        self.stdout.write('Created %s in %.1f seconds.\n' % (
+            ', '.join('%d %s' % (count, name) for name, count in sorted(counts.items())),
+            time.time() - start
+        ))
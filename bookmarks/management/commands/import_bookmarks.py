@@ -0,0 +1,46 @@
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from bookmarks import importers
+
+
+class Command(BaseCommand):
+    args = '<username> <file>'
+    help = ('Imports bookmarks for a user from a Netscape HTML, '
+            'JSON Lines or CSV export file.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest = 'format', default = None,
+                    choices = importers.PARSERS.keys(),
+                    help = 'File format (html, json or csv).  Guessed from '
+                           'the file extension by default.'),
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 500,
+                    help = 'Number of bookmarks to insert per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: import_bookmarks %s' % self.args)
+        username, filename = args
+
+        try:
+            user = User.objects.get(username = username)
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % username)
+
+        format = options['format'] or importers.guess_format(filename)
+        with open(filename, 'rb') as fileobj:
+            stats = importers.import_bookmarks(
+                user,
+                importers.PARSERS[format](fileobj),
+                options['batch_size']
+            )
+
+        self.stdout.write(
+            'Read %d records, created %d bookmarks, skipped %d '
+            'in %.1f seconds (%.0f records/second).\n' % (
+                stats['read'], stats['created'], stats['skipped'],
+                stats['seconds'], stats['read'] / max(stats['seconds'], 0.001)
+            )
+        )
@@ -0,0 +1,51 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from bookmarks import links
+from bookmarks.models import Link
+
+
+class Command(NoArgsCommand):
+    help = ('Gives every link its canonical URL key and merges links that '
+            'are different spellings of the same URL, moving their '
+            'bookmarks over.  Adds the url_hash column to databases '
+            'created before it existed.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 500,
+                    help = 'Number of links to handle per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        added = self._add_column()
+
+        last_id = 0
+        merged = 0
+        while last_id is not None:
+            last_id, batch_merged = links.merge_batch(last_id, options['batch_size'])
+            merged += batch_merged
+        total = Link.objects.count()
+
+        if added:
+            # Only possible now that the duplicates are gone.
+            connection.cursor().execute(
+                'CREATE UNIQUE INDEX bookmarks_link_url_hash ON %s (url_hash)'
+                % Link._meta.db_table
+            )
+            transaction.commit_unless_managed()
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Merged %d duplicate links, %d links left.\n'
+                              % (merged, total))
+
+    def _add_column(self):
+        table = Link._meta.db_table
+        cursor = connection.cursor()
+        columns = [column[0] for column in
+                   connection.introspection.get_table_description(cursor, table)]
+        if 'url_hash' in columns:
+            return False
+        cursor.execute('ALTER TABLE %s ADD COLUMN url_hash varchar(40) NULL' % table)
+        transaction.commit_unless_managed()
+        return True
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from bookmarks import feeds
+
+
+class Command(BaseCommand):
+    args = '[username ...]'
+    help = ("Recounts everyone's followers and rebuilds the friends "
+            "feeds of the given users, or of everyone if no users are "
+            "given.")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if args:
+            users = users.filter(username__in = args)
+            if users.count() != len(set(args)):
+                raise CommandError('Unknown user given.')
+
+        with transaction.commit_on_success():
+            feeds.recount_followers()
+
+        count = 0
+        for user in users.iterator():
+            with transaction.commit_on_success():
+                feeds.rebuild(user)
+            count += 1
+        self.stdout.write('Rebuilt %d feeds.\n' % count)
@@ -0,0 +1,37 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks import cache, search
+from bookmarks.models import Bookmark
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the bookmark full-text search index.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 1000,
+                    help = 'Number of bookmarks to index at a time.'),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        backend = search.get_backend()
+        backend.create()
+        backend.clear()
+
+        start = time.time()
+        total = 0
+        batch = []
+        for document in search.bookmark_documents(Bookmark.objects.all(), batch_size):
+            batch.append(document)
+            if len(batch) == batch_size:
+                backend.index(batch)
+                total += len(batch)
+                batch = []
+        backend.index(batch)
+        total += len(batch)
+        cache.invalidate('search', 'all')
+
+        self.stdout.write('Indexed %d bookmarks in %.1f seconds.\n'
+                          % (total, time.time() - start))
@@ -0,0 +1,27 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks import popularity
+
+
+class Command(NoArgsCommand):
+    help = ('Rebuilds the popular page rankings.  Runs once unless '
+            '--interval is given.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--interval', type = 'float', dest = 'interval',
+                    default = None,
+                    help = 'Keep running, refreshing every INTERVAL seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        while True:
+            for period in popularity.PERIODS:
+                count = popularity.refresh(period)
+                if int(options['verbosity']) > 0:
+                    self.stdout.write('Ranked %d bookmarks for %s.\n'
+                                      % (count, period))
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
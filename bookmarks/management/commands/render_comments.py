@@ -0,0 +1,46 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from bookmarks import discussion
+from bookmarks.models import SharedBookmark
+
+
+class Command(NoArgsCommand):
+    help = ('Renders the comments on shared bookmarks that have no '
+            'RenderedComment yet and recomputes SharedBookmark.'
+            'comment_count.  Adds the comment_count column to databases '
+            'created before it existed.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 500,
+                    help = 'Number of comments to render per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        self._add_column()
+
+        last_id = 0
+        rendered = 0
+        while last_id is not None:
+            last_id, batch_rendered = discussion.render_batch(
+                last_id, options['batch_size']
+            )
+            rendered += batch_rendered
+        discussion.recount()
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Rendered %d comments.\n' % rendered)
+
+    def _add_column(self):
+        table = SharedBookmark._meta.db_table
+        cursor = connection.cursor()
+        columns = [column[0] for column in
+                   connection.introspection.get_table_description(cursor, table)]
+        if 'comment_count' in columns:
+            return
+        cursor.execute(
+            'ALTER TABLE %s ADD COLUMN comment_count integer NOT NULL DEFAULT 0'
+            % table
+        )
+        transaction.commit_unless_managed()
@@ -0,0 +1,73 @@
+import json
+from optparse import make_option
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.utils.importlib import import_module
+from django.conf import settings
+from django.core.cache import cache
+from bookmarks.benchmarks import run_benchmarks
+
+
+class Command(NoArgsCommand):
+    help = ('Requests every URL of the site through the test client and '
+            'reports latency and query counts.  By default a test database '
+            'is created and filled by generate_bookmarks, so runs are '
+            'repeatable.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--iterations', type = 'int', default = 20,
+                    help = 'Requests per URL.'),
+        make_option('--users', type = 'int', default = 100,
+                    help = 'Size of the generated data set.'),
+        make_option('--seed', type = 'int', default = 0),
+        make_option('--use-existing-db', action = 'store_true',
+                    dest = 'use_existing_db', default = False,
+                    help = 'Run against the configured database, which '
+                           'must already hold generate_bookmarks data.'),
+        make_option('--output', default = None,
+                    help = 'Save the results as JSON to this file.'),
+        make_option('--compare', default = None,
+                    help = 'Show changes against results saved with --output.'),
+    )
+
+    def handle_noargs(self, **options):
+        if not options['use_existing_db']:
+            old_name = connection.creation.create_test_db(verbosity = 0)
+        try:
+            cache.clear()
+            if not options['use_existing_db']:
+                call_command('generate_bookmarks', users = options['users'],
+                             seed = options['seed'], verbosity = 0)
+            urls = import_module(settings.ROOT_URLCONF)
+            results, missing = run_benchmarks(urls.urlpatterns, options['iterations'])
+        finally:
+            if not options['use_existing_db']:
+                connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        self.stdout.write('%-22s %6s %9s %9s %9s %8s %10s\n' % (
+            'view', 'status', 'p50 ms', 'p95 ms', 'max ms', 'queries', 'p50 change'
+        ))
+        for name in sorted(results):
+            result = results[name]
+            change = ''
+            if name in baseline and baseline[name]['p50_ms']:
+                change = '%+.0f%%' % (
+                    100.0 * (result['p50_ms'] - baseline[name]['p50_ms'])
+                    / baseline[name]['p50_ms']
+                )
+            self.stdout.write('%-22s %6d %9.1f %9.1f %9.1f %8d %10s\n' % (
+                name, result['status'], result['p50_ms'], result['p95_ms'],
+                result['max_ms'], result['queries'], change
+            ))
+        if missing:
+            self.stdout.write('No sample URL for: %s\n' % ', '.join(missing))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent = 2)
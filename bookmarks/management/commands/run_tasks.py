@@ -0,0 +1,44 @@
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from bookmarks import tasks
+
+
+class Command(NoArgsCommand):
+    help = ('Runs the background tasks that are due, such as friends feed '
+            'fan-out and search indexing of saved bookmarks.  Runs once '
+            'unless --interval is given.  Start several to run tasks in '
+            'more processes.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type = 'int', dest = 'batch_size',
+                    default = 100,
+                    help = 'Number of tasks to claim at a time.'),
+        make_option('--workers', type = 'int', dest = 'workers',
+                    default = tasks.WORKERS,
+                    help = 'Number of tasks to run at once.'),
+        make_option('--interval', type = 'float', dest = 'interval',
+                    default = None,
+                    help = 'Keep running, checking for new tasks every '
+                           'INTERVAL seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        while True:
+            taken = succeeded = 0
+            while True:
+                batch_taken, batch_succeeded = tasks.run_pending(
+                    options['batch_size'], options['workers']
+                )
+                taken += batch_taken
+                succeeded += batch_succeeded
+                if batch_taken < options['batch_size']:
+                    break
+            if int(options['verbosity']) > 0:
+                self.stdout.write('Ran %d tasks, %d failed.\n' % (
+                    taken, taken - succeeded
+                ))
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
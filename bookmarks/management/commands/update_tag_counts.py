@@ -0,0 +1,24 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from bookmarks.models import Tag
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes Tag.bookmark_count from the tag/bookmark table.'
+
+    def handle_noargs(self, **options):
+        tag_table = Tag._meta.db_table
+        through_table = Tag.bookmarks.through._meta.db_table
+
+        # One correlated UPDATE instead of one COUNT(*) per tag.
+        cursor = connection.cursor()
+        cursor.execute(
+            'UPDATE %s SET bookmark_count = '
+            '(SELECT COUNT(*) FROM %s WHERE %s.tag_id = %s.id)' % (
+                tag_table, through_table, through_table, tag_table
+            )
+        )
+        transaction.commit_unless_managed()
+
+        self.stdout.write('Updated bookmark counts for %d tags.\n'
+                          % Tag.objects.count())
@@ -0,0 +1,19 @@
+from django.core.management.base import CommandError, NoArgsCommand
+from bookmarks.warmup import warm_up
+
+
+class Command(NoArgsCommand):
+    help = ('Imports the URLconf and compiles every template, as workers '
+            'do at startup when WARM_UP_ON_START is on, and reports the '
+            'templates that fail to compile.')
+
+    def handle_noargs(self, **options):
+        stats = warm_up()
+        for name, error in stats['errors']:
+            self.stderr.write('%s: %s\n' % (name, error))
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Compiled %d templates in %.2f seconds.\n'
+                              % (stats['templates'], stats['seconds']))
+        if stats['errors']:
+            raise CommandError('%d templates failed to compile.'
+                               % len(stats['errors']))
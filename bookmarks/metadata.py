@@ -0,0 +1,441 @@
+'''
+Background fetching of link metadata.
+
+Saving a bookmark for a new link only inserts a LinkFetchJob row, so
+bookmark_save_page never waits on the network.  fetch_pending(), which
+"manage.py fetch_metadata" runs once or on an interval, claims the jobs
+that are due, fetches their pages on a pool of FETCH_WORKERS threads and
+stores each page's title, canonical URL, favicon and HTTP status as the
+link's LinkMetadata.
+
+The threads only talk to the network; every database read and write
+happens in the calling thread.  Requests to the same host are spaced at
+least HOST_DELAY seconds apart, at most MAX_BYTES of a page are read,
+and jobs that fail with a network error are retried with an exponential
+backoff up to MAX_ATTEMPTS times.
+
+Anyone can make the fetcher request any URL by bookmarking it, so it
+only speaks HTTP and HTTPS, and every host it connects to, redirects
+included, is resolved and refused if it's on a loopback, private,
+link-local or otherwise reserved address, unless
+METADATA_ALLOW_PRIVATE_ADDRESSES is set.  Such links are given up on
+straight away.
+'''
+import binascii
+import httplib
+import os
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+import uuid
+from datetime import timedelta
+from httplib import HTTPException
+from HTMLParser import HTMLParser, HTMLParseError
+from Queue import Empty, Queue
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from bookmarks.models import LinkFetchJob, LinkMetadata
+
+FETCH_WORKERS = getattr(settings, 'METADATA_FETCH_WORKERS', 4)
+HOST_DELAY = getattr(settings, 'METADATA_HOST_DELAY', 1.0)
+TIMEOUT = getattr(settings, 'METADATA_TIMEOUT', 10)
+MAX_BYTES = 256 * 1024
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60
+# How long a claimed job belongs to its worker.  Jobs of a worker that
+# dies come back after this.
+LEASE = 60 * 10
+USER_AGENT = 'django_bookmarks metadata fetcher'
+ALLOW_PRIVATE_ADDRESSES = getattr(
+    settings, 'METADATA_ALLOW_PRIVATE_ADDRESSES', False
+)
+SCHEMES = ('http', 'https')
+
+# Networks that aren't on the public internet.  IPv4-mapped and NAT64
+# IPv6 addresses are checked by the IPv4 address they stand for.
+PRIVATE_NETWORKS = {
+    socket.AF_INET: [
+        ('0.0.0.0', 8), ('10.0.0.0', 8), ('100.64.0.0', 10),
+        ('127.0.0.0', 8), ('169.254.0.0', 16), ('172.16.0.0', 12),
+        ('192.0.0.0', 24), ('192.0.2.0', 24), ('192.168.0.0', 16),
+        ('198.18.0.0', 15), ('198.51.100.0', 24), ('203.0.113.0', 24),
+        ('224.0.0.0', 4), ('240.0.0.0', 4),
+    ],
+    socket.AF_INET6: [
+        ('::', 96), ('100::', 64), ('2001:db8::', 32), ('fc00::', 7),
+        ('fe80::', 10), ('fec0::', 10), ('ff00::', 8),
+    ],
+}
+EMBEDDED_IPV4 = [('::ffff:0:0', 96), ('64:ff9b::', 96)]
+
+# Field lengths from bookmarks.models.
+TITLE_LENGTH = LinkMetadata._meta.get_field('title').max_length
+URL_LENGTH = LinkMetadata._meta.get_field('canonical_url').max_length
+ERROR_LENGTH = LinkFetchJob._meta.get_field('error').max_length
+
+
+class FetchError(Exception):
+    '''
+    The page couldn't be fetched at all (DNS, connection or protocol
+    failure, or a timeout).
+    '''
+    pass
+
+
+class RefusedURL(FetchError):
+    '''
+    The URL, or one it redirected to, isn't a public HTTP or HTTPS
+    address.  Not worth retrying.
+    '''
+    pass
+
+
+def _address_number(family, address):
+    return int(binascii.hexlify(socket.inet_pton(family, address)), 16)
+
+
+def _in_networks(family, number, networks):
+    bits = family == socket.AF_INET and 32 or 128
+    for network, prefix in networks:
+        shift = bits - prefix
+        if number >> shift == _address_number(family, network) >> shift:
+            return True
+    return False
+
+
+def is_public_address(address):
+    '''
+    Whether the IPv4 or IPv6 address is on the public internet.
+    '''
+    # Link-local IPv6 addresses can come with a "%interface" suffix.
+    address = address.split('%', 1)[0]
+    family = ':' in address and socket.AF_INET6 or socket.AF_INET
+    number = _address_number(family, address)
+    if family == socket.AF_INET6 and _in_networks(family, number, EMBEDDED_IPV4):
+        family, number = socket.AF_INET, number & 0xffffffff
+    return not _in_networks(family, number, PRIVATE_NETWORKS[family])
+
+
+def _connect(address, timeout = socket._GLOBAL_DEFAULT_TIMEOUT,
+             source_address = None):
+    # socket.create_connection(), refusing hosts that resolve to an
+    # address that isn't public.  The address checked is the one
+    # connected to, so the host can't resolve differently in between.
+    host, port = address
+    candidates = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    if not ALLOW_PRIVATE_ADDRESSES:
+        for family, socktype, proto, name, sockaddr in candidates:
+            if not is_public_address(sockaddr[0]):
+                raise RefusedURL('%s resolves to %s' % (host, sockaddr[0]))
+
+    error = socket.error('No addresses for %s' % host)
+    for family, socktype, proto, name, sockaddr in candidates:
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except socket.error as e:
+            error = e
+            if sock is not None:
+                sock.close()
+    raise error
+
+
+class _HTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPConnection.__init__(self, *args, **kwargs)
+        self._create_connection = _connect
+
+
+class _HTTPSConnection(httplib.HTTPSConnection):
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+        self._create_connection = _connect
+
+
+class _HTTPHandler(urllib2.HTTPHandler):
+
+    def http_open(self, request):
+        return self.do_open(_HTTPConnection, request)
+
+
+class _HTTPSHandler(urllib2.HTTPSHandler):
+
+    def https_open(self, request):
+        return self.do_open(_HTTPSConnection, request, context = self._context)
+
+
+class _RedirectHandler(urllib2.HTTPRedirectHandler):
+    # The new host is checked when it's connected to.
+
+    def http_error_302(self, request, fp, code, message, headers):
+        url = urlparse.urljoin(
+            request.get_full_url(),
+            headers.get('location') or headers.get('uri') or ''
+        )
+        if urlparse.urlsplit(url).scheme.lower() not in SCHEMES:
+            fp.close()
+            raise RefusedURL('Redirected to %s' % url)
+        return urllib2.HTTPRedirectHandler.http_error_302(
+            self, request, fp, code, message, headers
+        )
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+def _build_opener():
+    # Only the handlers fetch() needs: no file:, ftp: or proxies.
+    opener = urllib2.OpenerDirector()
+    for handler in (_HTTPHandler(), _HTTPSHandler(), _RedirectHandler(),
+                    urllib2.HTTPDefaultErrorHandler(),
+                    urllib2.HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+class MetadataParser(HTMLParser):
+    '''
+    Picks the <title> and the canonical and icon <link>s out of a page.
+    '''
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.title = None
+        self.canonical = None
+        self.icon = None
+        self._in_title = False
+        self._title = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title' and self.title is None:
+            self._in_title = True
+        elif tag == 'link':
+            attrs = dict(attrs)
+            rel = (attrs.get('rel') or '').lower().split()
+            href = attrs.get('href')
+            if not href:
+                return
+            if 'canonical' in rel and self.canonical is None:
+                self.canonical = href
+            elif 'icon' in rel and self.icon is None:
+                self.icon = href
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._in_title:
+            self._in_title = False
+            self.title = u''.join(self._title)
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title.append(data)
+
+    def handle_charref(self, name):
+        if self._in_title:
+            self._title.append(self.unescape('&#%s;' % name))
+
+    def handle_entityref(self, name):
+        if self._in_title:
+            self._title.append(self.unescape('&%s;' % name))
+
+
+def _clean_url(base, href):
+    # Absolute http(s) URLs that fit the column, or ''.
+    if not href:
+        return ''
+    url = urlparse.urljoin(base, href.strip())
+    if urlparse.urlsplit(url).scheme not in ('http', 'https'):
+        return ''
+    if len(url) > URL_LENGTH:
+        return ''
+    return url
+
+
+def fetch(url, timeout = None, max_bytes = MAX_BYTES):
+    '''
+    Fetch url and return a dictionary with its 'status', 'title',
+    'canonical_url' and 'favicon_url'.  HTTP errors are results like any
+    other; FetchError is raised if there was no response at all, and
+    RefusedURL if url isn't a public HTTP or HTTPS address.
+    '''
+    if urlparse.urlsplit(url).scheme.lower() not in SCHEMES:
+        raise RefusedURL('Not an HTTP or HTTPS URL: %s' % url)
+    request = urllib2.Request(url, headers = {'User-Agent': USER_AGENT})
+    try:
+        response = _build_opener().open(request, timeout = timeout or TIMEOUT)
+    except urllib2.HTTPError as e:
+        return {'status': e.code, 'title': '', 'canonical_url': '',
+                'favicon_url': ''}
+    except (urllib2.URLError, HTTPException, socket.error, ValueError) as e:
+        raise FetchError(str(e))
+
+    try:
+        info = response.info()
+        final_url = response.geturl()
+        body = ''
+        if info.gettype() in ('text/html', 'application/xhtml+xml'):
+            body = response.read(max_bytes)
+        status = response.getcode()
+    except (HTTPException, socket.error) as e:
+        raise FetchError(str(e))
+    finally:
+        response.close()
+
+    parser = MetadataParser()
+    try:
+        parser.feed(body.decode(info.getparam('charset') or 'utf-8', 'replace'))
+    except (HTMLParseError, LookupError):
+        # Keep whatever was found before the page stopped making sense.
+        pass
+
+    return {
+        'status': status,
+        'title': u' '.join((parser.title or u'').split())[:TITLE_LENGTH],
+        'canonical_url': _clean_url(final_url, parser.canonical) or
+                         _clean_url(final_url, final_url),
+        'favicon_url': _clean_url(final_url, parser.icon),
+    }
+
+
+class HostThrottle(object):
+    '''
+    Hands out request slots so that requests to the same host are at
+    least delay seconds apart, whichever thread makes them.
+    '''
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, url):
+        host = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next.get(host, 0))
+            self._next[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _fetch_all(urls, workers, throttle):
+    # Fetch urls on up to workers threads.  Returns {url: result}, where
+    # a result is a fetch() dictionary or a FetchError.
+    tasks = Queue()
+    for url in urls:
+        tasks.put(url)
+    results = {}
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            try:
+                url = tasks.get_nowait()
+            except Empty:
+                return
+            try:
+                throttle.wait(url)
+                result = fetch(url)
+            except FetchError as e:
+                result = e
+            except Exception as e:
+                # A bug or an error fetch() doesn't expect mustn't lose
+                # the url's result, or kill the thread with urls left.
+                result = FetchError(str(e))
+            with lock:
+                results[url] = result
+
+    threads = [threading.Thread(target = work)
+               for i in range(min(workers, len(urls)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def enqueue(link_ids):
+    '''
+    Queue a metadata fetch for each of link_ids.  Only call it for new
+    links: a link that already has a job can't get a second one.
+    '''
+    now = timezone.now()
+    LinkFetchJob.objects.bulk_create([
+        LinkFetchJob(link_id = link_id, due = now) for link_id in link_ids
+    ])
+
+
+@transaction.commit_on_success
+def _claim(limit):
+    now = timezone.now()
+    # Unique to this claim, and short enough for LinkFetchJob.worker
+    # whatever the host name.
+    worker = '%s:%d:%s' % (
+        socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:12]
+    )
+    ids = list(LinkFetchJob.objects.filter(due__lte = now).order_by(
+        'due'
+    ).values_list('id', flat = True)[:limit])
+    # Only jobs that are still due are taken, so two workers claiming
+    # at once can't both get the same job.
+    LinkFetchJob.objects.filter(id__in = ids, due__lte = now).update(
+        worker = worker, due = now + timedelta(seconds = LEASE)
+    )
+    return list(LinkFetchJob.objects.filter(
+        worker = worker
+    ).select_related('link'))
+
+
+@transaction.commit_on_success
+def _store(jobs, results):
+    now = timezone.now()
+    done = []
+    for job in jobs:
+        result = results.get(job.link.url)
+        if result is None:
+            result = FetchError('not fetched')
+        if isinstance(result, FetchError):
+            job.attempts += 1
+            job.error = str(result)[:ERROR_LENGTH]
+            if job.attempts < MAX_ATTEMPTS and \
+                    not isinstance(result, RefusedURL):
+                job.due = now + timedelta(
+                    seconds = RETRY_DELAY * 2 ** (job.attempts - 1)
+                )
+                job.worker = ''
+                job.save()
+                continue
+            # Give up, remembering that the link is unreachable (or
+            # off limits).
+            result = {'status': None}
+        LinkMetadata(link_id = job.link_id, **result).save()
+        done.append(job.id)
+    LinkFetchJob.objects.filter(id__in = done).delete()
+    return len(done)
+
+
+def fetch_pending(limit = 100, workers = None, throttle = None):
+    '''
+    Fetch the metadata of up to limit links whose jobs are due.  Returns
+    the number of jobs taken and how many of them were finished (the
+    rest will be retried).
+    '''
+    jobs = _claim(limit)
+    if not jobs:
+        return 0, 0
+    results = _fetch_all(
+        set(job.link.url for job in jobs),
+        workers or FETCH_WORKERS,
+        throttle or HostThrottle(HOST_DELAY)
+    )
+    return len(jobs), _store(jobs, results)
@@ -0,0 +1,170 @@
+import threading
+import time
+from django.db.backends import BaseDatabaseWrapper
+from django.template.base import Template
+from bookmarks import instrumentation, replicas
+
+_local = threading.local()
+
+
+def _instrument_templates():
+    '''
+    Wrap Template.render so the time spent rendering templates is added
+    up per request.  Included and extended templates are rendered inside
+    their parent, so only the outermost render is timed.
+    '''
+    if getattr(Template.render, 'instrumented', False):
+        return
+    original = Template.render
+
+    def render(self, context):
+        depth = getattr(_local, 'depth', 0)
+        _local.depth = depth + 1
+        start = time.time()
+        try:
+            return original(self, context)
+        finally:
+            _local.depth = depth
+            if depth == 0 and hasattr(_local, 'template_time'):
+                _local.template_time += time.time() - start
+    render.instrumented = True
+    Template.render = render
+
+
+class _CountingCursor(object):
+    # Counts and times the queries run through cursor into
+    # _local.queries, without keeping their SQL the way the debug
+    # cursor does.
+
+    def __init__(self, cursor, alias):
+        self.cursor = cursor
+        self.alias = alias
+
+    def _timed(self, method, args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            stats = getattr(_local, 'queries', None)
+            if stats is not None:
+                alias = stats.setdefault(self.alias, [0, 0.0])
+                alias[0] += 1
+                alias[1] += time.time() - start
+
+    def execute(self, *args):
+        return self._timed(self.cursor.execute, args)
+
+    def executemany(self, *args):
+        return self._timed(self.cursor.executemany, args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def _instrument_cursors():
+    '''
+    Wrap the cursors of every database connection in a _CountingCursor
+    while a request is being recorded.
+    '''
+    if getattr(BaseDatabaseWrapper.cursor, 'instrumented', False):
+        return
+    original = BaseDatabaseWrapper.cursor
+
+    def cursor(self):
+        result = original(self)
+        if getattr(_local, 'queries', None) is None:
+            return result
+        return _CountingCursor(result, self.alias)
+    cursor.instrumented = True
+    BaseDatabaseWrapper.cursor = cursor
+
+
+class InstrumentationMiddleware(object):
+    '''
+    Records wall time, database queries and time, template time and
+    response size per view in bookmarks.instrumentation.  It should be
+    the first middleware so the timings include everything else.
+    '''
+
+    def __init__(self):
+        _instrument_templates()
+        _instrument_cursors()
+
+    def process_request(self, request):
+        request._stats_start = time.time()
+        request._stats_view = '<unresolved>'
+        _local.template_time = 0.0
+        # {alias: [queries, seconds]}, filled in by _CountingCursor.
+        _local.queries = {}
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._stats_view = '%s.%s' % (view_func.__module__, view_func.__name__)
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_stats_start'):
+            return response
+
+        queries = 0
+        db_time = 0.0
+        aliases = {}
+        for alias, (count, seconds) in (getattr(_local, 'queries', None) or {}).items():
+            queries += count
+            db_time += seconds
+            # Per database too, to see how much the replicas take.
+            aliases['queries:' + alias] = count
+            aliases['db_ms:' + alias] = seconds * 1000
+        _local.queries = None
+
+        values = {
+            'wall_ms': (time.time() - request._stats_start) * 1000,
+            'queries': queries,
+            'db_ms': db_time * 1000,
+            'template_ms': getattr(_local, 'template_time', 0.0) * 1000,
+        }
+        values.update(aliases)
+        # Don't read the content of streamed responses (e.g. exports),
+        # that would consume the iterator.
+        if response.has_header('Content-Length'):
+            values['bytes'] = int(response['Content-Length'])
+        elif not getattr(response, 'streaming', False):
+            values['bytes'] = len(response.content)
+        instrumentation.record(request._stats_view, values)
+        return response
+
+
+class ReplicaMiddleware(object):
+    '''
+    Sends the reads of read-only views to a replica unless the browser
+    wrote something recently, and sets the cookie that keeps it on the
+    primary after a write (see bookmarks/replicas.py).  Also installs
+    the persistent connection handling.
+    '''
+
+    def __init__(self):
+        replicas.install_connection_reuse()
+
+    def process_request(self, request):
+        # Every request starts out on the primary.
+        replicas.use_primary()
+        if request.method == 'POST':
+            replicas.pin(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = '%s.%s' % (view_func.__module__, view_func.__name__)
+        if (request.method in ('GET', 'HEAD') and
+                view in replicas.READ_ONLY_VIEWS and
+                not replicas.is_pinned(request)):
+            replicas.use_replica()
+
+    def process_response(self, request, response):
+        replicas.use_primary()
+        if getattr(request, '_replica_pin', False):
+            response.set_cookie(
+                replicas.STICKY_COOKIE,
+                '%.3f' % (time.time() + replicas.STICKY_SECONDS),
+                max_age = replicas.STICKY_SECONDS
+            )
+        return response
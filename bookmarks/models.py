@@ -1,14 +1,71 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.comments.models import Comment
 
 # Link inherits from models.Model which is the base
 # class for all models.
 class Link(models.Model):
     url = models.URLField(unique=True)
+    # SHA-1 of the canonical form of url (see bookmarks/links.py), so
+    # every spelling of an address ends up at the same Link.  Being
+    # fixed width keeps its index small however long the URLs get.
+    # Links saved before it existed have none until "manage.py
+    # merge_links" runs.
+    url_hash = models.CharField(max_length=40, unique=True, null=True)
 
     def __unicode__(self):
         return self.url
 
+class LinkMetadata(models.Model):
+    # What the background fetcher (bookmarks/metadata.py) found at a
+    # link: the page title, its canonical URL and favicon and the HTTP
+    # status.  Kept out of Link so syncdb can add it to existing
+    # databases.
+    link = models.OneToOneField(Link, primary_key=True, related_name='metadata')
+    title = models.CharField(max_length=200, blank=True)
+    canonical_url = models.CharField(max_length=200, blank=True)
+    favicon_url = models.CharField(max_length=200, blank=True)
+    # None if the page couldn't be fetched at all.
+    status = models.IntegerField(null=True)
+    fetched = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.link_id, self.status)
+
+class LinkFetchJob(models.Model):
+    # A link waiting for its metadata.  Saving a bookmark for a new link
+    # only inserts one of these; "manage.py fetch_metadata" does the
+    # fetching.  due is pushed forward while a worker holds the job and
+    # after failed attempts.
+    link = models.ForeignKey(Link, unique=True)
+    due = models.DateTimeField(db_index=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True)
+    error = models.CharField(max_length=200, blank=True)
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.link_id, self.attempts)
+
+class Task(models.Model):
+    # Work taken off the request path, such as fanning a new bookmark
+    # out to the friends feeds.  It's inserted in the same transaction
+    # as the change it follows up on and "manage.py run_tasks" runs it
+    # (see bookmarks/tasks.py).  due is pushed forward while a worker
+    # holds the task and after failed attempts; failed is set once it
+    # has run out of attempts.
+    name = models.CharField(max_length=64)
+    # JSON encoded keyword arguments.
+    arguments = models.TextField()
+    due = models.DateTimeField(db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    failed = models.BooleanField(default=False)
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.name, self.attempts)
+
 class Bookmark(models.Model):
     title = models.CharField(max_length=200)
     user = models.ForeignKey(User)
@@ -17,9 +74,20 @@ class Bookmark(models.Model):
     def __unicode__(self):
         return u'%s, %s' % (self.user.username, self.link.url)
 
+    class Meta:
+        # A user can bookmark a link only once.  This also makes
+        # get_or_create in _bookmark_save safe against two saves of the
+        # same URL racing each other.
+        unique_together = (('user', 'link'), )
+
 class Tag(models.Model):
     name = models.CharField(max_length=64, unique=True)
     bookmarks = models.ManyToManyField(Bookmark)
+    # Denormalized number of bookmarks carrying this tag.  It's kept in
+    # sync by _bookmark_save so the tag cloud doesn't have to COUNT(*)
+    # the tag/bookmark table once per tag.  Run "manage.py
+    # update_tag_counts" to rebuild it from scratch.
+    bookmark_count = models.IntegerField(default=0, db_index=True)
 
     def __unicode__(self):
         return self.name
@@ -28,16 +96,85 @@ class SharedBookmark(models.Model):
     # Each bookmark can only be shared one time.
     bookmark = models.ForeignKey(Bookmark, unique=True)
     # When creating a shared bookmark, automatically set date field to current date/time.
-    date = models.DateTimeField(auto_now_add=True)
+    # Indexed for the main page, which lists the newest shares.
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     # When creating a shared bookmark, initialize its votes to 1.
-    votes = models.IntegerField(default=1)
+    votes = models.IntegerField(default=1, db_index=True)
     # Each user can vote for one or more shared bookmarks and each shared bookmark
     # can be voted on by one or more users.
     users_voted = models.ManyToManyField(User)
+    # Denormalized number of public comments, kept in sync as comments
+    # are posted and removed (see bookmarks/discussion.py).  Run
+    # "manage.py render_comments" to rebuild it from scratch.
+    comment_count = models.IntegerField(default=0)
 
     def __unicode__(self):
         return u'%s, %s' % (self.bookmark, self.votes)
 
+class RenderedComment(models.Model):
+    # A public comment on a shared bookmark, rendered to HTML once when
+    # it was posted, so bookmark_page doesn't go through the generic
+    # relation or run the comment filters on every view.
+    comment = models.OneToOneField(Comment, related_name='rendered')
+    shared_bookmark = models.ForeignKey(SharedBookmark)
+    html = models.TextField()
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.shared_bookmark_id, self.comment_id)
+
+class PopularBookmark(models.Model):
+    # Precomputed popular page.  Each period has a row per shared bookmark
+    # in it with that bookmark's score, so the popular page is just the
+    # top rows of one period.  Scores are updated as votes come in and
+    # "manage.py refresh_popularity" rebuilds the periods as bookmarks
+    # age (see bookmarks/popularity.py).
+    PERIOD_CHOICES = (
+        ('day', 'Last day'),
+        ('week', 'Last week'),
+        ('all', 'All time'),
+    )
+    period = models.CharField(max_length=8, choices=PERIOD_CHOICES)
+    shared_bookmark = models.ForeignKey(SharedBookmark)
+    score = models.FloatField(db_index=True)
+
+    def __unicode__(self):
+        return u'%s, %s, %s' % (self.period, self.shared_bookmark_id, self.score)
+
+    class Meta:
+        unique_together = (('period', 'shared_bookmark'), )
+
+class PendingVote(models.Model):
+    # Votes waiting to be applied to their shared bookmark when
+    # VOTE_BUFFERING is on.  Recording one is a plain insert, so voters
+    # don't all queue up for the lock on a popular bookmark's row;
+    # "manage.py flush_votes" moves them over in batches.
+    shared_bookmark = models.ForeignKey(SharedBookmark)
+    user = models.ForeignKey(User)
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.user.username, self.shared_bookmark_id)
+
+    class Meta:
+        # A user can only have one vote waiting per bookmark.
+        unique_together = (('shared_bookmark', 'user'), )
+
+class FeedItem(models.Model):
+    # A bookmark in someone's friends feed.  Rows are written when a
+    # bookmark is saved, one per follower of its owner (fan-out on
+    # write), so the friends page only reads its own rows.  Owners with
+    # very many followers are skipped and read at display time instead
+    # (see bookmarks/feeds.py).
+    owner = models.ForeignKey(User, related_name = 'feed_items')
+    bookmark = models.ForeignKey(Bookmark)
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.owner.username, self.bookmark_id)
+
+    class Meta:
+        # Also the index the friends page is read through.
+        unique_together = (('owner', 'bookmark'), )
+
 class Friendship(models.Model):
     # Since this class has two FKs that point to the same class, we have
     # to specify a 'related_name' attribute to differentiate them.
@@ -62,3 +199,19 @@ class Friendship(models.Model):
         # In other words, any particular friendship can only be added to the 
         # database one time.
         unique_together = (('to_friend', 'from_friend'), )
+
+class FollowerCount(models.Model):
+    # How many users have user as a friend, kept up to date by
+    # friend_add, so feeds can tell whose bookmarks aren't fanned out
+    # without counting followers (see bookmarks/feeds.py).
+    user = models.OneToOneField(
+        User, primary_key = True, related_name = 'follower_count'
+    )
+    count = models.IntegerField(default = 0)
+
+    def __unicode__(self):
+        return u'%s, %d' % (self.user_id, self.count)
+
+# Connects the receivers that keep RenderedComment and comment_count up
+# to date, and the one that tunes new SQLite connections.
+from bookmarks import discussion, sqlite_tuning
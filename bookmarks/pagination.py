@@ -0,0 +1,81 @@
+'''
+Keyset (cursor) pagination for newest-first lists.
+
+Instead of page numbers, which need a COUNT(*) and an OFFSET that gets
+slower the further in you go, pages are found with "id < x" or "id > x"
+conditions on an indexed key.  Page 5000 costs the same as page 1.
+
+The position is passed around as an opaque cursor token: "a" for the
+items after (older than) a key, "b" for the items before (newer than) it.
+'''
+import base64
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, key):
+    token = base64.urlsafe_b64encode('%s:%d' % (direction, key))
+    return token.rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        token = str(token)
+        value = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, key = value.split(':')
+        key = int(key)
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(token)
+    if direction not in ('a', 'b'):
+        raise InvalidCursor(token)
+    return direction, key
+
+
+class KeysetPage(object):
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+def paginate(query_set, cursor, per_page, key = 'id'):
+    '''
+    Return the KeysetPage of query_set, newest (highest key) first, that
+    cursor points at.  A cursor of None means the first page.  Raises
+    InvalidCursor for tokens that weren't made by this module.
+    '''
+    if cursor:
+        direction, position = decode_cursor(cursor)
+    else:
+        direction, position = 'a', None
+
+    if direction == 'a':
+        if position is not None:
+            query_set = query_set.filter(**{key + '__lt': position})
+        items = list(query_set.order_by('-' + key)[:per_page + 1])
+        has_next = len(items) > per_page
+        has_prev = position is not None
+        items = items[:per_page]
+    else:
+        query_set = query_set.filter(**{key + '__gt': position})
+        items = list(query_set.order_by(key)[:per_page + 1])
+        has_prev = len(items) > per_page
+        has_next = True
+        items = items[:per_page]
+        items.reverse()
+
+    if not items:
+        return KeysetPage(items, None, None)
+    return KeysetPage(
+        items,
+        has_next and encode_cursor('a', getattr(items[-1], key)) or None,
+        has_prev and encode_cursor('b', getattr(items[0], key)) or None
+    )
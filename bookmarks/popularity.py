@@ -0,0 +1,117 @@
+'''
+Popular page rankings.
+
+The "day" and "week" periods rank shared bookmarks by a hot score that
+favours newer shares, so a new bookmark with a few votes can beat an
+older one with more.  "all" ranks by votes alone.  Scores are stored in
+PopularBookmark and kept current by update_scores() when votes arrive;
+refresh() rebuilds a period from scratch to drop bookmarks that have
+aged out of it.
+
+Rather than decaying as time passes, a hot score grows with the time a
+bookmark was shared: every DECAY seconds later is worth ten times the
+votes.  It doesn't depend on when it was computed, so a score updated
+for a new vote stays comparable with the ones stored earlier.
+'''
+import math
+from datetime import datetime, timedelta
+from django.utils import timezone
+from bookmarks import cache
+from bookmarks.models import PopularBookmark, SharedBookmark
+
+# How far back each period reaches.  None means no limit.
+PERIODS = {
+    'day': timedelta(1),
+    'week': timedelta(7),
+    'all': None,
+}
+DEFAULT_PERIOD = 'day'
+
+# Seconds between shares that make up for ten times the votes.
+# Smaller values favour new bookmarks more.
+DECAY = 45000
+# Hot scores count time from here, to keep the numbers small.
+EPOCH = datetime(2012, 1, 1)
+
+
+def score(period, votes, date):
+    if PERIODS[period] is None:
+        return float(votes)
+    if timezone.is_aware(date):
+        date = timezone.make_naive(date, timezone.utc)
+    seconds = (date - EPOCH).total_seconds()
+    return math.log10(max(votes, 1)) + seconds / DECAY
+
+
+def periods_for(date, now):
+    # The periods a bookmark shared at date belongs in.
+    return [period for period, length in PERIODS.items()
+            if length is None or date > now - length]
+
+
+def top(period, count = 10):
+    '''
+    Return the count highest ranked shared bookmarks for period.
+    '''
+    ranked = PopularBookmark.objects.filter(period = period).select_related(
+        'shared_bookmark__bookmark__link', 'shared_bookmark__bookmark__user'
+    ).order_by('-score')[:count]
+    return [popular.shared_bookmark for popular in ranked]
+
+
+def add_shared(shared_bookmark):
+    '''
+    Put a newly shared bookmark in every period's ranking.
+    '''
+    now = timezone.now()
+    PopularBookmark.objects.bulk_create([
+        PopularBookmark(
+            period = period,
+            shared_bookmark = shared_bookmark,
+            score = score(period, shared_bookmark.votes, shared_bookmark.date)
+        )
+        for period in periods_for(shared_bookmark.date, now)
+    ])
+
+
+def update_scores(shared_bookmark_ids):
+    '''
+    Recompute the scores of shared bookmarks whose votes changed.
+    '''
+    shared = SharedBookmark.objects.filter(id__in = list(shared_bookmark_ids))
+    for id, votes, date in shared.values_list('id', 'votes', 'date'):
+        for period in PERIODS:
+            PopularBookmark.objects.filter(
+                period = period, shared_bookmark = id
+            ).update(score = score(period, votes, date))
+
+
+@cache.commit_on_success
+def refresh(period, batch_size = 1000):
+    '''
+    Rebuild the ranking for period.  Returns the number of bookmarks
+    ranked.
+    '''
+    now = timezone.now()
+    shared = SharedBookmark.objects.all()
+    if PERIODS[period] is not None:
+        shared = shared.filter(date__gt = now - PERIODS[period])
+
+    PopularBookmark.objects.filter(period = period).delete()
+    total = 0
+    rows = []
+    for id, votes, date in shared.values_list('id', 'votes', 'date').iterator():
+        rows.append(PopularBookmark(
+            period = period,
+            shared_bookmark_id = id,
+            score = score(period, votes, date)
+        ))
+        if len(rows) == batch_size:
+            PopularBookmark.objects.bulk_create(rows)
+            total += len(rows)
+            rows = []
+    PopularBookmark.objects.bulk_create(rows)
+    total += len(rows)
+
+    cache.invalidate('shared', 'all')
+    return total
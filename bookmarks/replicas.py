@@ -0,0 +1,147 @@
+'''
+Read replicas and persistent connections.
+
+Almost all requests are for read-only pages.  With DATABASE_REPLICAS
+naming aliases in DATABASES that are copies of "default" (replicated
+Postgres/MySQL servers, or SQLite files copied from the primary for
+testing), bookmarks.middleware.ReplicaMiddleware sends the reads of the
+views in READ_ONLY_VIEWS to one of them, picked at random for each
+request, and ReplicaRouter sends everything else to "default".
+
+Replication lags, so a user who just saved a bookmark or voted could
+read a copy that doesn't have the change yet.  pin() marks a request as
+having written; its response sets a cookie that keeps that browser's
+reads on "default" for REPLICA_STICKY_SECONDS.  POST requests pin
+themselves.  Other users can still read the old data for as long as the
+lag lasts, and fragments rendered from it are cached until the next
+change or FRAGMENT_CACHE_TIMEOUT, so keep the replicas close behind.
+
+Django closes every database connection at the end of each request.
+An alias with a CONN_MAX_AGE (in seconds, or None for no limit) in its
+DATABASES entry instead keeps its connection that long, saving a
+connect (and for a server, a login) per request.  Any transaction left
+open by a request is rolled back, just as closing would have.
+'''
+import random
+import threading
+import time
+from django.conf import settings
+from django.core import signals
+from django.db import close_connection, connections
+from django.db.backends.signals import connection_created
+
+REPLICAS = tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+STICKY_SECONDS = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+STICKY_COOKIE = 'bookmarks_primary'
+
+READ_ONLY_VIEWS = set([
+    'bookmarks.views.main_page',
+    'bookmarks.views.popular_page',
+    'bookmarks.views.tag_page',
+    'bookmarks.views.tag_cloud_page',
+    'bookmarks.views.search_page',
+    'bookmarks.views.user_page',
+    'bookmarks.views.friends_page',
+    'bookmarks.views.bookmark_page',
+    'bookmarks.api.api_user_bookmarks',
+    'bookmarks.api.api_tag_bookmarks',
+    'bookmarks.api.api_friends_feed',
+    'bookmarks.api.api_popular',
+    'bookmarks.api.api_search',
+])
+
+_state = threading.local()
+
+
+def use_replica():
+    '''
+    Send this thread's reads to a replica, if there are any, until
+    use_primary() is called.
+    '''
+    _state.alias = REPLICAS and random.choice(REPLICAS) or None
+
+
+def use_primary():
+    _state.alias = None
+
+
+def pin(request):
+    '''
+    Keep reads from request's browser on the primary for a while,
+    because request changed something.
+    '''
+    request._replica_pin = True
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRouter(object):
+    '''
+    Reads go to the replica picked for the request, if any; writes,
+    syncdb and everything outside read-only views use "default".
+    '''
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        return True
+
+    def allow_syncdb(self, db, model):
+        if db in REPLICAS:
+            return False
+        return None
+
+
+def _connection_opened(sender, connection, **kwargs):
+    connection._opened = time.time()
+
+
+def close_old_connections(**kwargs):
+    '''
+    Run at the end of each request instead of Django's
+    close_connection: close the connections that have no CONN_MAX_AGE
+    or have reached it, and end any transaction the others have open.
+    '''
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        if not hasattr(connection, '_opened'):
+            # Opened before install_connection_reuse() ran.
+            connection._opened = now
+        max_age = connection.settings_dict.get('CONN_MAX_AGE', 0)
+        if max_age is not None and now - connection._opened >= max_age:
+            connection.close()
+            continue
+        try:
+            connection._rollback()
+        except Exception:
+            # Broken; the next request gets a new one.
+            connection.close()
+
+
+def install_connection_reuse():
+    '''
+    Replace Django's close_connection with close_old_connections, if
+    any alias asks for persistent connections.
+    '''
+    if not any('CONN_MAX_AGE' in connections[alias].settings_dict
+               for alias in connections):
+        return
+    connection_created.connect(
+        _connection_opened, dispatch_uid = 'bookmarks.replicas.opened'
+    )
+    signals.request_finished.disconnect(close_connection)
+    signals.request_finished.connect(
+        close_old_connections, dispatch_uid = 'bookmarks.replicas.close'
+    )
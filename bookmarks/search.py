@@ -0,0 +1,162 @@
+'''
+Full-text search over bookmark titles, URLs and tag names.
+
+A saved bookmark is indexed in the background by the bookmark_saved
+task (see bookmarks/tasks.py), shortly after _bookmark_save commits.
+The importer indexes each batch of bookmarks itself, in the batch's
+transaction, and merging duplicate links re-indexes the bookmarks it
+touches.  The whole index can be rebuilt in bulk with "manage.py
+rebuild_search_index".  The backend is picked with
+the SEARCH_BACKEND setting (a dotted path to a class); by default SQLite
+databases get an FTS5 index and everything else falls back to plain
+database queries.
+'''
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.importlib import import_module
+from bookmarks.models import Bookmark
+
+
+class DatabaseBackend(object):
+    '''
+    Fallback backend that searches the bookmark tables directly.
+    There is no separate index to maintain, so index() and remove()
+    don't do anything.
+    '''
+
+    def create(self):
+        pass
+
+    def index(self, documents):
+        pass
+
+    def remove(self, bookmark_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, keywords, offset, limit):
+        q = Q()
+        for keyword in keywords:
+            q = q & (Q(title__icontains = keyword) |
+                     Q(link__url__icontains = keyword) |
+                     Q(tag__name__icontains = keyword))
+        ids = Bookmark.objects.filter(q).distinct().order_by('-id')
+        return list(ids.values_list('id', flat = True)[offset:offset + limit])
+
+
+class SqliteFtsBackend(object):
+    '''
+    SQLite FTS5 index with one row per bookmark.  The row id is the
+    bookmark id and results are ranked with bm25, weighting title
+    matches over tag matches over URL matches.
+    '''
+    table = 'bookmarks_search'
+
+    def create(self):
+        # syncdb creates the table from sql/bookmark.sqlite3.sql; this
+        # is for databases that predate the search index.
+        connection.cursor().execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS %s '
+            'USING fts5(title, url, tags)' % self.table
+        )
+        transaction.commit_unless_managed()
+
+    def index(self, documents):
+        # documents is a sequence of (id, title, url, tag names) tuples.
+        documents = list(documents)
+        if not documents:
+            return
+        self._delete([document[0] for document in documents])
+        connection.cursor().executemany(
+            'INSERT INTO %s (rowid, title, url, tags) VALUES (%%s, %%s, %%s, %%s)'
+            % self.table,
+            [(id, title, url, ' '.join(tags))
+             for id, title, url, tags in documents]
+        )
+        transaction.commit_unless_managed()
+
+    def remove(self, bookmark_ids):
+        self._delete(bookmark_ids)
+        transaction.commit_unless_managed()
+
+    def _delete(self, bookmark_ids):
+        bookmark_ids = list(bookmark_ids)
+        if bookmark_ids:
+            connection.cursor().execute(
+                'DELETE FROM %s WHERE rowid IN (%s)' % (
+                    self.table, ', '.join(['%s'] * len(bookmark_ids))
+                ),
+                bookmark_ids
+            )
+
+    def clear(self):
+        connection.cursor().execute('DELETE FROM %s' % self.table)
+        transaction.commit_unless_managed()
+
+    def search(self, keywords, offset, limit):
+        # Quote every keyword so FTS syntax in user input is taken
+        # literally, and make each one a prefix match.
+        match = ' '.join(
+            '"%s"*' % keyword.replace('"', '""') for keyword in keywords
+        )
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s '
+            'ORDER BY bm25(%s, 10.0, 1.0, 5.0) LIMIT %%s OFFSET %%s' % (
+                self.table, self.table, self.table
+            ),
+            [match, limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+_backend = None
+
+def get_backend():
+    '''
+    Return the configured search backend, creating it on first use.
+    '''
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', None)
+        if path is None:
+            if connection.vendor == 'sqlite':
+                backend_class = SqliteFtsBackend
+            else:
+                backend_class = DatabaseBackend
+        else:
+            module, name = path.rsplit('.', 1)
+            backend_class = getattr(import_module(module), name)
+        _backend = backend_class()
+    return _backend
+
+
+def bookmark_documents(query_set, batch_size = 1000):
+    '''
+    Yield (id, title, url, tag names) tuples for the bookmarks in
+    query_set, reading them batch_size at a time in id order.
+    '''
+    query_set = query_set.select_related('link').prefetch_related('tag_set')
+    last_id = 0
+    while True:
+        batch = list(query_set.filter(id__gt = last_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        for bookmark in batch:
+            yield (bookmark.id, bookmark.title, bookmark.link.url,
+                   [tag.name for tag in bookmark.tag_set.all()])
+        last_id = batch[-1].id
+
+
+def search_bookmarks(query, offset = 0, limit = 10):
+    '''
+    Return the ids of the bookmarks matching every keyword in query,
+    best match first.
+    '''
+    keywords = query.split()
+    if not keywords:
+        return []
+    return get_backend().search(keywords, offset, limit)
@@ -0,0 +1,2 @@
+-- The user page lists a user's bookmarks newest first.
+CREATE INDEX bookmarks_bookmark_user_id_id ON bookmarks_bookmark (user_id, id);
@@ -0,0 +1,2 @@
+-- Full-text index used by bookmarks.search.SqliteFtsBackend.
+CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_search USING fts5(title, url, tags);
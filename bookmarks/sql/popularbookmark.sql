@@ -0,0 +1,2 @@
+-- The popular page reads the top scores of one period.
+CREATE INDEX bookmarks_popularbookmark_period_score ON bookmarks_popularbookmark (period, score);
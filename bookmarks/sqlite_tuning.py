@@ -0,0 +1,87 @@
+'''
+SQLite tuning.
+
+With SQLite's default rollback journal a writer locks out every reader
+while it commits, and a second writer gets "database is locked" as soon
+as the 5 second timeout of Python's sqlite3 module runs out.  Small
+nodes running straight on the sqlite3 backend should set
+SQLITE_PRAGMAS; each new SQLite connection then runs them, e.g.
+
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',     # readers and a writer side by side
+        'synchronous': 'NORMAL',   # with WAL, only checkpoints fsync
+        'busy_timeout': 10000,     # ms a writer waits for the lock
+        'cache_size': -64000,      # page cache in KiB (negative) or pages
+        'mmap_size': 268435456,    # bytes of the file read through mmap
+        'temp_store': 'MEMORY',
+    }
+
+journal_mode is set first, since it can't change inside a transaction;
+the rest follow in name order.  WAL mode is stored in the database file,
+so it stays on for connections that don't set it.
+
+"manage.py benchmark_concurrency" runs readers and writers against the
+database side by side and counts lock errors, to compare settings.
+'''
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+
+PRAGMAS = getattr(settings, 'SQLITE_PRAGMAS', {})
+
+_NAME = re.compile(r'^[a-z_]+$')
+_VALUE = re.compile(r'^(-?\d+|[A-Za-z]+)$')
+
+
+def pragma_statements(pragmas):
+    '''
+    Return the PRAGMA statements for a {name: value} dictionary, in the
+    order they have to run.  Raises ImproperlyConfigured for anything
+    that isn't a plain name and a number or word.
+    '''
+    statements = []
+    for name in sorted(pragmas, key = lambda name: (name != 'journal_mode', name)):
+        value = unicode(pragmas[name])
+        if not _NAME.match(name) or not _VALUE.match(value):
+            raise ImproperlyConfigured(
+                'Bad SQLITE_PRAGMAS entry: %r: %r' % (name, pragmas[name])
+            )
+        statements.append('PRAGMA %s = %s' % (name, value))
+    return statements
+
+
+def apply_pragmas(connection, pragmas):
+    '''
+    Run pragmas on a sqlite3 module connection.
+    '''
+    for statement in pragma_statements(pragmas):
+        # Some pragmas (journal_mode, mmap_size) answer with a row.
+        connection.execute(statement).fetchall()
+
+
+def current_pragmas(connection, names):
+    '''
+    Return {name: value} for the pragma names as a sqlite3 module
+    connection has them.
+    '''
+    values = {}
+    for name in names:
+        if not _NAME.match(name):
+            raise ValueError(name)
+        row = connection.execute('PRAGMA %s' % name).fetchone()
+        values[name] = row and row[0]
+    return values
+
+
+def connection_opened(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and PRAGMAS:
+        apply_pragmas(connection.connection, PRAGMAS)
+
+
+# Check the setting now rather than on the first connection.
+pragma_statements(PRAGMAS)
+
+connection_created.connect(
+    connection_opened, dispatch_uid = 'bookmarks.sqlite_tuning.connection_opened'
+)
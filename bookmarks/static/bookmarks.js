@@ -7,3 +7,57 @@ $(function() {
 function display_alert() {
     alert("Hello, world!  This tested JavaScript.");
 }
+
+function bookmark_vote() {
+    // This refers to the "[+]" link.
+    var link = $(this);
+    // Ask for a JSON reply instead of being redirected back here.
+    $.getJSON(link.attr("href") + "&ajax", function(result) {
+        // Update the vote count next to this link, or the one on the
+        // page if the link isn't in a list.
+        var count = link.closest("li").find(".vote-count");
+        if (!count.length) {
+            count = $(".vote-count");
+        }
+        count.text(count.text().replace(/\d+/, result.votes));
+    });
+    // Tell the browser not to follow the vote link.
+    return false;
+}
+
+$(document).ready(function() {
+    $("a.vote").click(bookmark_vote);
+});
+
+function tag_autocomplete() {
+    // This refers to the tags field.  Suggest tags for the word being
+    // typed, which is the last one in the field.
+    var field = $(this);
+    var words = field.val().split(/\s+/);
+    var prefix = words[words.length - 1];
+    var list = field.siblings("ul.tag-suggestions");
+    if (!list.length) {
+        list = $('<ul class="tag-suggestions"></ul>').insertAfter(field);
+    }
+    if (!prefix) {
+        list.empty();
+        return;
+    }
+    $.getJSON("/tags/autocomplete/", {q: prefix}, function(tags) {
+        list.empty();
+        $.each(tags, function(i, tag) {
+            $("<li></li>").text(tag).click(function() {
+                // Replace the partly typed word with the suggestion.
+                words[words.length - 1] = tag;
+                field.val(words.join(" ") + " ").focus();
+                list.empty();
+            }).appendTo(list);
+        });
+    });
+}
+
+$(document).ready(function() {
+    // The save form is also loaded into lists for editing, so listen
+    // on the document.
+    $(document).on("keyup", "#id_tags", tag_autocomplete);
+});
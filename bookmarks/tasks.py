@@ -0,0 +1,234 @@
+'''
+Background tasks.
+
+Saving a bookmark has follow-up work that the user doesn't wait for:
+fanning it out to the friends feeds, indexing it for search and ranking
+a new share on the popular page.  enqueue() records that work as a Task
+row instead, in the same transaction as the save, so a task exists if
+and only if the change it follows up on was committed.
+
+"manage.py run_tasks" runs the tasks that are due on a pool of worker
+threads, each task in its own transaction.  Several of them can run at
+once, on one machine or many: a task is claimed by pushing its due time
+LEASE seconds ahead, and only tasks still due can be claimed, so no two
+workers run the same one.  A worker that dies leaves its tasks to come
+back when their lease runs out.  A task that raises is retried with an
+exponential backoff, and marked failed, with the traceback in error,
+after MAX_ATTEMPTS attempts.
+
+Tasks are the functions decorated with @task below, called with the
+keyword arguments given to enqueue().  They must be safe to run twice.
+queue_stats() (/stats/tasks/) shows how many are waiting.
+'''
+import json
+import os
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from Queue import Empty, Queue
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from bookmarks import cache, feeds, popularity, search
+from bookmarks.models import Bookmark, SharedBookmark, Task
+
+WORKERS = getattr(settings, 'TASK_WORKERS', 4)
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30
+# How long a claimed task belongs to its worker.
+LEASE = 60 * 5
+
+_tasks = {}
+
+
+def task(function):
+    '''
+    Make function runnable by name through enqueue().
+    '''
+    _tasks[function.__name__] = function
+    return function
+
+
+def enqueue(name, **arguments):
+    '''
+    Have the task called name run in the background with arguments,
+    which must be JSON serializable.  Call it inside the transaction
+    making the change the task follows up on.
+    '''
+    if name not in _tasks:
+        raise ValueError('Unknown task: %s' % name)
+    Task.objects.create(
+        name = name, arguments = json.dumps(arguments), due = timezone.now()
+    )
+
+
+@transaction.commit_on_success
+def _claim(limit):
+    now = timezone.now()
+    # Unique to this claim, and short enough for Task.worker whatever
+    # the host name.
+    worker = '%s:%d:%s' % (
+        socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:12]
+    )
+    ids = list(Task.objects.filter(due__lte = now, failed = False).order_by(
+        'due'
+    ).values_list('id', flat = True)[:limit])
+    # Only tasks that are still due are taken, so two workers claiming
+    # at once can't both get the same task.
+    Task.objects.filter(id__in = ids, due__lte = now).update(
+        worker = worker, due = now + timedelta(seconds = LEASE)
+    )
+    return list(Task.objects.filter(worker = worker))
+
+
+@cache.commit_on_success
+def _call(job):
+    arguments = json.loads(job.arguments)
+    _tasks[job.name](**dict(
+        (str(key), value) for key, value in arguments.items()
+    ))
+
+
+def _run(job):
+    # Run one claimed task and record the outcome.  Returns True if it
+    # succeeded.
+    try:
+        _call(job)
+    except Exception:
+        job.attempts += 1
+        job.error = traceback.format_exc()
+        job.worker = ''
+        if job.attempts >= MAX_ATTEMPTS:
+            job.failed = True
+        else:
+            job.due = timezone.now() + timedelta(
+                seconds = RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        with transaction.commit_on_success():
+            job.save()
+        return False
+
+    with transaction.commit_on_success():
+        Task.objects.filter(id = job.id).delete()
+    return True
+
+
+def run_pending(limit = 100, workers = 1):
+    '''
+    Run up to limit tasks that are due, on workers threads (the calling
+    thread if workers is 1).  Returns the number of tasks taken and how
+    many of them succeeded.
+    '''
+    jobs = _claim(limit)
+    if workers <= 1 or len(jobs) <= 1:
+        return len(jobs), len([job for job in jobs if _run(job)])
+
+    queue = Queue()
+    for job in jobs:
+        queue.put(job)
+    succeeded = []
+
+    def work():
+        try:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except Empty:
+                    return
+                if _run(job):
+                    succeeded.append(job.id)
+        finally:
+            # Each thread has its own connection.
+            connection.close()
+
+    threads = [threading.Thread(target = work)
+               for i in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(jobs), len(succeeded)
+
+
+def queue_stats():
+    '''
+    Return the number of tasks waiting (pending), due now (due), held
+    by a worker (running) and given up on (failed), the age in seconds
+    of the oldest due task and the number waiting per task name.
+    '''
+    now = timezone.now()
+    waiting = Task.objects.filter(failed = False)
+    stats = {
+        'pending': waiting.count(),
+        'due': waiting.filter(due__lte = now).count(),
+        'running': waiting.exclude(worker = '').filter(due__gt = now).count(),
+        'failed': Task.objects.filter(failed = True).count(),
+        'by_name': dict(waiting.values('name').annotate(
+            count = Count('id')
+        ).values_list('name', 'count')),
+    }
+    oldest = waiting.filter(due__lte = now).aggregate(Min('due'))['due__min']
+    stats['oldest_due_seconds'] = oldest and (now - oldest).total_seconds() or 0
+    return stats
+
+
+@task
+def bookmark_saved(bookmark_id, created):
+    '''
+    Fan a bookmark out to the friends feeds if it's new and bring its
+    search index entry up to date.
+    '''
+    bookmark = list(Bookmark.objects.filter(id = bookmark_id)[:1])
+    if not bookmark:
+        # Deleted or merged away since.
+        return
+    bookmark = bookmark[0]
+
+    # fan_out() skips the followers who have it already, so a retry or
+    # a backfill that got there first doesn't stop the others getting it.
+    if created:
+        feeds.fan_out(bookmark)
+    _invalidate_followers(bookmark.user_id)
+
+    search.get_backend().index(
+        search.bookmark_documents(Bookmark.objects.filter(id = bookmark_id))
+    )
+    cache.invalidate('search', 'all')
+
+
+@task
+def bookmarks_imported(user_id, bookmark_ids):
+    '''
+    Fan a batch of imported bookmarks out to the friends feeds.  The
+    importer has indexed them for search already.
+    '''
+    feeds.fan_out_batch(user_id, list(Bookmark.objects.filter(
+        id__in = bookmark_ids
+    ).values_list('id', flat = True)))
+    _invalidate_followers(user_id)
+
+
+def _invalidate_followers(user_id):
+    # Throw away the cached friends pages of user_id's followers.  Like
+    # the fan-out, this is skipped for users with more than FANOUT_LIMIT
+    # followers, whose pages catch up when their fragments expire.
+    followers = feeds.follower_ids(user_id)
+    if followers:
+        cache.invalidate('friends', *User.objects.filter(
+            id__in = followers
+        ).values_list('username', flat = True))
+
+
+@task
+def bookmark_shared(shared_bookmark_id):
+    '''
+    Put a newly shared bookmark in the popular page rankings.
+    '''
+    shared = list(SharedBookmark.objects.filter(id = shared_bookmark_id)[:1])
+    if shared and not shared[0].popularbookmark_set.exists():
+        popularity.add_shared(shared[0])
+        cache.invalidate('shared', 'all')
@@ -0,0 +1,63 @@
+from django import template
+from bookmarks import cache
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, scope, ident, vary_on):
+        self.nodelist = nodelist
+        self.scope = scope
+        self.ident = ident
+        self.vary_on = vary_on
+
+    def render(self, context):
+        if 'fragment_key' in context:
+            # The view looked the fragment up already, before deciding
+            # whether to query for its contents (see views._fragment).
+            key = context['fragment_key']
+            content = context['fragment']
+        else:
+            key = cache.fragment_key(
+                self.scope.resolve(context),
+                self.ident.resolve(context),
+                [var.resolve(context) for var in self.vary_on]
+            )
+            content = cache.get_fragment(key)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set_fragment(key, content)
+        return content
+
+
+@register.tag
+def fragment_cache(parser, token):
+    '''
+    Cache the enclosed template fragment until its scope is invalidated.
+
+    Usage::
+
+        {% load bookmark_cache %}
+        {% fragment_cache "user" username page show_edit %}
+            ... bookmark list ...
+        {% endfragment_cache %}
+
+    The first two arguments are the scope and identifier passed to
+    bookmarks.cache.invalidate(); any others are things the fragment
+    varies on.  A view can look the fragment up itself and put its key
+    and content (None on a miss) in the context as fragment_key and
+    fragment, to skip its queries on a hit.
+    '''
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            "'%s' tag requires at least a scope and an identifier." % bits[0]
+        )
+    return FragmentCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]]
+    )
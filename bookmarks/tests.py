@@ -5,8 +5,32 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import BaseHTTPServer
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from StringIO import StringIO
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import override_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.contrib.comments.forms import CommentForm
+from django.contrib.comments.models import Comment
+from bookmarks import api, autocomplete, benchmarks, discussion, feeds, \
+    frontpage, importers, instrumentation, links, metadata, popularity, \
+    replicas, sqlite_tuning, tasks, votes, warmup
+from bookmarks.cache import after_commit, cache_stats, commit_on_success, \
+    get_version, invalidate
+from bookmarks.models import *
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -15,6 +39,22 @@ class SimpleTest(TestCase):
         """
         self.assertEqual(1 + 1, 2)
 
+class QueryCounter(object):
+    """
+    Context manager that counts the queries run inside its block,
+    whatever the DEBUG setting is.
+    """
+    def __enter__(self):
+        self.old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.start = len(connection.queries)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.count = len(connection.queries) - self.start
+        connection.use_debug_cursor = self.old_debug_cursor
+
+
 class ViewTest(TestCase):
     fixtures = ['test_data.json']
 
@@ -51,3 +91,1503 @@ class ViewTest(TestCase):
         self.assertContains(response, 'http://www.example.com/')
         self.assertContains(response, 'Test URL')
         self.assertContains(response, 'test-tag')
+
+    def test_tag_counts(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+
+        data = {
+            'url'  : 'http://www.example.com/',
+            'title': 'Test URL',
+            'tags' : 'count-a count-b count-a'
+        }
+        self.client.post('/save/', data)
+        self.assertEqual(Tag.objects.get(name = 'count-a').bookmark_count, 1)
+        self.assertEqual(Tag.objects.get(name = 'count-b').bookmark_count, 1)
+
+        # Editing the bookmark moves it from count-b to count-c.
+        data['tags'] = 'count-a count-c'
+        self.client.post('/save/', data)
+        self.assertEqual(Tag.objects.get(name = 'count-a').bookmark_count, 1)
+        self.assertEqual(Tag.objects.get(name = 'count-b').bookmark_count, 0)
+        self.assertEqual(Tag.objects.get(name = 'count-c').bookmark_count, 1)
+
+    def test_tag_cloud_page(self):
+        call_command('update_tag_counts', verbosity = 0)
+
+        response = self.client.get('/tag/')
+        self.assertContains(response, 'tag-cloud-')
+
+        # Only the most used tag is left in a top 1 cloud.
+        top = Tag.objects.order_by('-bookmark_count')[0]
+        response = self.client.get('/tag/?top=1')
+        self.assertEqual(len(response.context['tags']), 1)
+        self.assertEqual(response.context['tags'][0]['name'], top.name)
+
+        # A top that isn't positive shows the whole cloud.
+        count = Tag.objects.filter(bookmark_count__gt = 0).count()
+        for value in ('0', '-1'):
+            response = self.client.get('/tag/?top=' + value)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['tags']), count)
+
+
+class QueryBudgetTest(TestCase):
+    fixtures = ['test_data.json']
+
+    # Maximum number of queries each bookmark list page may run,
+    # however many bookmarks it shows.
+    BUDGETS = {
+        '/': 1,
+        '/user/flaugher/': 5,
+        '/tag/budget/': 4,
+        '/search/?query=budget': 3,
+        '/friends/flaugher/': 5,
+    }
+
+    def setUp(self):
+        self.client = Client()
+
+    def _add_bookmarks(self, count):
+        # flaugher is in his own friend list in the fixture, so these
+        # bookmarks also show up on his friends page.
+        user = User.objects.get(username = 'flaugher')
+        tag, dummy = Tag.objects.get_or_create(name = 'budget')
+        other, dummy = Tag.objects.get_or_create(name = 'budget-other')
+        start = Bookmark.objects.count()
+        for i in range(start, start + count):
+            link = Link.objects.create(url = 'http://budget%d.example.com/' % i)
+            bookmark = Bookmark.objects.create(
+                title = 'budget %d' % i, user = user, link = link
+            )
+            bookmark.tag_set.add(tag, other)
+            feeds.fan_out(bookmark)
+
+    def _count(self, url):
+        # Bookmarks are added behind the fragment cache's back here.
+        cache.clear()
+        with QueryCounter() as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return counter.count
+
+    def test_query_budgets(self):
+        self._add_bookmarks(2)
+        small = dict((url, self._count(url)) for url in self.BUDGETS)
+
+        self._add_bookmarks(8)
+        for url, budget in self.BUDGETS.items():
+            count = self._count(url)
+            self.assertTrue(
+                count <= budget,
+                msg = '%s ran %d queries (budget %d)' % (url, count, budget)
+            )
+            self.assertEqual(
+                count, small[url],
+                msg = '%s query count grows with the number of bookmarks' % url
+            )
+
+
+class SearchTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        call_command('rebuild_search_index')
+
+    def test_search_fixture_data(self):
+        response = self.client.get('/search/', {'query': 'javascript'})
+        self.assertContains(response, 'Eloquent JavaScript - Book')
+        self.assertNotContains(response, 'CNBC')
+
+    def test_search_finds_saved_bookmark(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url'  : 'http://www.example.com/',
+            'title': 'Searchable Example',
+            'tags' : 'findme'
+        })
+        # Indexed in the background.
+        tasks.run_pending()
+
+        # Matches on title, tag and URL.
+        for query in ('searchable', 'findme', 'example.com'):
+            response = self.client.get('/search/', {'query': query})
+            self.assertContains(response, 'Searchable Example')
+
+    def test_search_pagination(self):
+        user = User.objects.get(username = 'flaugher')
+        for i in range(15):
+            link = Link.objects.create(url = 'http://paged%d.example.com/' % i)
+            Bookmark.objects.create(title = 'paged %d' % i, user = user, link = link)
+        call_command('rebuild_search_index')
+
+        response = self.client.get('/search/', {'query': 'paged'})
+        self.assertEqual(len(response.context['bookmarks']), 10)
+        self.assertTrue(response.context['has_next'])
+
+        response = self.client.get('/search/', {'query': 'paged', 'page': 2})
+        self.assertEqual(len(response.context['bookmarks']), 5)
+        self.assertFalse(response.context['has_next'])
+
+
+class FragmentCacheTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_user_page_cached_until_save(self):
+        self.client.get('/user/flaugher/')
+        hits = cache_stats()['hits']
+        self.client.get('/user/flaugher/')
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+
+        # Saving a bookmark invalidates the cached list.
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url'  : 'http://www.example.com/',
+            'title': 'Fresh Bookmark',
+            'tags' : 'fresh'
+        })
+        response = self.client.get('/user/flaugher/')
+        self.assertContains(response, 'Fresh Bookmark')
+        response = self.client.get('/tag/fresh/')
+        self.assertContains(response, 'Fresh Bookmark')
+
+    def test_cached_lists_skip_the_database(self):
+        for url in ('/user/flaugher/', '/tag/book/', '/friends/flaugher/'):
+            self.client.get(url)
+            with QueryCounter() as counter:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(counter.count, 0)
+        self.assertEqual(self.client.get('/user/nobody/').status_code, 404)
+
+    def test_shared_list_invalidated_by_vote(self):
+        # flaugher hasn't voted for shared bookmark 2 in the fixture.
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        shared = SharedBookmark.objects.get(id = 2)
+        self.client.get('/')
+        self.client.get('/vote/', {'id': shared.id})
+        response = self.client.get('/')
+        self.assertContains(response, 'Votes: %d' % (shared.votes + 1))
+
+    def test_invalidation_waits_for_commit(self):
+        version = get_version('user', 'flaugher')
+
+        @commit_on_success
+        def save():
+            invalidate('user', 'flaugher')
+            # Not bumped until the transaction has committed.
+            self.assertEqual(get_version('user', 'flaugher'), version)
+
+        @commit_on_success
+        def fail():
+            invalidate('user', 'flaugher')
+            raise ValueError
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(get_version('user', 'flaugher'), version)
+        save()
+        self.assertNotEqual(get_version('user', 'flaugher'), version)
+
+    def test_cache_stats_page_is_staff_only(self):
+        response = self.client.get('/stats/cache/')
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        response = self.client.get('/stats/cache/')
+        self.assertContains(response, 'hit_ratio')
+
+
+class VoteTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username = 'flaugher', password = 'flaugher')
+
+    def test_vote_counted_once(self):
+        # flaugher hasn't voted for shared bookmark 2 in the fixture.
+        votes = SharedBookmark.objects.get(id = 2).votes
+
+        response = self.client.get('/vote/', {'id': 2, 'ajax': ''})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), {
+            'id': 2, 'votes': votes + 1, 'counted': True
+        })
+
+        response = self.client.get('/vote/', {'id': 2, 'ajax': ''})
+        self.assertEqual(json.loads(response.content)['counted'], False)
+
+        shared = SharedBookmark.objects.get(id = 2)
+        self.assertEqual(shared.votes, votes + 1)
+        self.assertTrue(shared.users_voted.filter(username = 'flaugher').exists())
+
+    def test_vote_redirects_without_ajax(self):
+        response = self.client.get('/vote/', {'id': 2}, HTTP_REFERER = '/popular/')
+        self.assertRedirects(response, '/popular/')
+
+    def test_vote_unknown_bookmark(self):
+        response = self.client.get('/vote/', {'id': 999})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/vote/', {'id': 'abc'})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(VOTE_BUFFERING = True)
+    def test_buffered_votes(self):
+        votes = SharedBookmark.objects.get(id = 2).votes
+
+        response = self.client.get('/vote/', {'id': 2, 'ajax': ''})
+        self.assertEqual(json.loads(response.content)['votes'], votes + 1)
+        response = self.client.get('/vote/', {'id': 2, 'ajax': ''})
+        self.assertEqual(json.loads(response.content)['counted'], False)
+
+        # Nothing is applied until the buffer is flushed.
+        self.assertEqual(SharedBookmark.objects.get(id = 2).votes, votes)
+        self.assertEqual(PendingVote.objects.count(), 1)
+
+        call_command('flush_votes', verbosity = 0)
+        shared = SharedBookmark.objects.get(id = 2)
+        self.assertEqual(shared.votes, votes + 1)
+        self.assertTrue(shared.users_voted.filter(username = 'flaugher').exists())
+        self.assertEqual(PendingVote.objects.count(), 0)
+
+
+class PopularityTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        call_command('refresh_popularity', verbosity = 0)
+
+    def test_all_time_ranked_by_votes(self):
+        response = self.client.get('/popular/', {'period': 'all'})
+        ranked = response.context['shared_bookmarks']
+        self.assertEqual(len(ranked), SharedBookmark.objects.count())
+        self.assertEqual(ranked[0]['votes'], 3)
+
+        # The fixture bookmarks are years old.
+        response = self.client.get('/popular/')
+        self.assertContains(response, 'No bookmarks found.')
+
+        response = self.client.get('/popular/', {'period': 'year'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_new_share_and_vote_ranked(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url'  : 'http://www.example.com/',
+            'title': 'Hot Bookmark',
+            'tags' : '',
+            'share': 'True'
+        })
+        tasks.run_pending()
+        response = self.client.get('/popular/')
+        self.assertContains(response, 'Hot Bookmark')
+
+        shared = SharedBookmark.objects.get(bookmark__title = 'Hot Bookmark')
+        before = PopularBookmark.objects.get(period = 'week', shared_bookmark = shared).score
+        shared.users_voted.clear()
+        self.client.get('/vote/', {'id': shared.id})
+        after = PopularBookmark.objects.get(period = 'week', shared_bookmark = shared).score
+        self.assertTrue(after > before)
+
+    def test_votes_move_older_shares_up(self):
+        flaugher = User.objects.get(username = 'flaugher')
+        shares = []
+        for hours in (10, 9):
+            link = Link.objects.create(url = 'http://hot%d.example.com/' % hours)
+            bookmark = Bookmark.objects.create(
+                title = 'Hot %d' % hours, user = flaugher, link = link
+            )
+            shared = SharedBookmark.objects.create(bookmark = bookmark)
+            SharedBookmark.objects.filter(id = shared.id).update(
+                date = shared.date - timedelta(hours = hours)
+            )
+            shares.append(SharedBookmark.objects.get(id = shared.id))
+            popularity.add_shared(shares[-1])
+        older, newer = shares
+        self.assertEqual(popularity.top('day', 2), [newer, older])
+
+        # Two more votes make up for the hour.
+        for username in ('robert', 'shari'):
+            votes.record_vote(User.objects.get(username = username), older.id)
+        self.assertEqual(popularity.top('day', 2), [older, newer])
+
+
+NETSCAPE_EXPORT = '''<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<DL><p>
+    <DT><H3>Reading</H3>
+    <DL><p>
+        <DT><A HREF="http://www.packtpub.com/" TAGS="book">Packt</A>
+        <DT><A HREF="http://import1.example.com/" TAGS="imported,news">Import &amp; One</A>
+        <DT><A HREF="http://import2.example.com/">Import Two</A>
+    </DL><p>
+</DL><p>
+'''
+
+class ImportTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.get(username = 'flaugher')
+
+    def test_parse_netscape(self):
+        records = list(importers.parse_netscape(StringIO(NETSCAPE_EXPORT)))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1], {
+            'url': 'http://import1.example.com/',
+            'title': u'Import & One',
+            'tags': ['imported', 'news']
+        })
+
+    def test_import_upload(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        upload = StringIO(NETSCAPE_EXPORT)
+        upload.name = 'bookmarks.html'
+
+        response = self.client.post('/import/', {'file': upload})
+        self.assertRedirects(response, '/user/flaugher/')
+
+        # packtpub.com was already bookmarked in the fixture.
+        self.assertEqual(Bookmark.objects.filter(user = self.user).count(), 13)
+        bookmark = Bookmark.objects.get(link__url = 'http://import1.example.com/')
+        self.assertEqual(bookmark.title, 'Import & One')
+        self.assertEqual(
+            sorted(tag.name for tag in bookmark.tag_set.all()),
+            ['imported', 'news']
+        )
+        self.assertEqual(Tag.objects.get(name = 'imported').bookmark_count, 1)
+        # The skipped bookmark's tags are left alone.
+        self.assertEqual(Tag.objects.get(name = 'book').bookmarks.count(), 2)
+
+    def test_import_json_and_csv(self):
+        lines = StringIO(
+            '{"url": "http://json.example.com/", "title": "JSON", "tags": ["a", "b"]}\n'
+            '{"url": "http://json.example.com/", "title": "JSON again"}\n'
+        )
+        stats = importers.import_bookmarks(self.user, importers.parse_json(lines))
+        self.assertEqual((stats['read'], stats['created']), (2, 1))
+        self.assertEqual(
+            Bookmark.objects.get(link__url = 'http://json.example.com/').title,
+            'JSON again'
+        )
+
+        rows = StringIO('url,title,tags\nhttp://csv.example.com/,CSV,c d\n,No URL,\n')
+        stats = importers.import_bookmarks(self.user, importers.parse_csv(rows))
+        self.assertEqual((stats['read'], stats['created'], stats['skipped']), (2, 1, 1))
+
+    def test_import_json_array_file(self):
+        handle, path = tempfile.mkstemp(suffix = '.json')
+        try:
+            with os.fdopen(handle, 'w') as output:
+                output.write(
+                    '\n  [{"url": "http://array1.example.com/", "title": "One"},\n'
+                    '   {"url": "http://array2.example.com/", "tags": "x y"}]\n'
+                )
+            with open(path) as upload:
+                stats = importers.import_bookmarks(
+                    self.user, importers.parse_json(upload)
+                )
+        finally:
+            os.remove(path)
+        self.assertEqual((stats['read'], stats['created']), (2, 2))
+        bookmark = Bookmark.objects.get(link__url = 'http://array2.example.com/')
+        self.assertEqual(
+            sorted(tag.name for tag in bookmark.tag_set.all()), ['x', 'y']
+        )
+
+    def test_truncated_json_file(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        upload = StringIO(
+            '{"url": "http://json1.example.com/", "title": "One"}\n'
+            '{"url": "http://json2.example.com/", "ti'
+        )
+        upload.name = 'bookmarks.json'
+
+        response = self.client.post('/import/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['file'][0].startswith(
+            'Line 2 is not valid JSON'
+        ))
+        self.assertContains(response, 'Imported 1 bookmarks (0 skipped)')
+        # The bookmark before the error was kept.
+        self.assertTrue(Bookmark.objects.filter(
+            user = self.user, link__url = 'http://json1.example.com/'
+        ).exists())
+
+    def test_json_array_item_not_an_object(self):
+        upload = StringIO(
+            '[{"url": "http://array1.example.com/"}, "http://array2.example.com/"]'
+        )
+        try:
+            importers.import_bookmarks(self.user, importers.parse_json(upload))
+        except importers.ParseError as e:
+            self.assertEqual(str(e), 'Item 2 is not a JSON object.')
+            self.assertEqual((e.stats['read'], e.stats['created']), (1, 1))
+        else:
+            self.fail('ParseError not raised')
+
+        rows = StringIO('url,title\nhttp://csv.example.com/,C\0SV\n')
+        self.assertRaises(
+            importers.ParseError, list, importers.parse_csv(rows)
+        )
+
+    def test_invalid_urls_skipped(self):
+        records = [
+            {'url': 'javascript://%0aalert(document.cookie)//',
+             'title': 'Script', 'tags': []},
+            {'url': 'file:///etc/passwd', 'title': 'File', 'tags': []},
+            {'url': 'http://long.example.com/' + 'a' * 200,
+             'title': 'Long', 'tags': []},
+            {'url': 'http://valid.example.com/', 'title': 'Valid', 'tags': []},
+        ]
+        stats = importers.import_bookmarks(self.user, records)
+        self.assertEqual((stats['read'], stats['created'], stats['skipped']), (4, 1, 3))
+        self.assertFalse(Link.objects.filter(url__startswith = 'javascript').exists())
+        self.assertFalse(Link.objects.filter(url__startswith = 'file').exists())
+        self.assertFalse(Link.objects.filter(url__contains = 'long.example').exists())
+
+
+class ExportTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_export_formats(self):
+        response = self.client.get('/user/flaugher/export/', {'format': 'json'})
+        self.assertEqual(response['Content-Type'], 'application/x-json-stream')
+        rows = [json.loads(line) for line in response.content.splitlines()]
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(rows[0], {
+            'url': 'http://www.packtpub.com/',
+            'title': 'Packt Publishing Inc',
+            'tags': ['book', 'publisher']
+        })
+
+        response = self.client.get('/user/flaugher/export/', {'format': 'csv'})
+        self.assertEqual(len(response.content.splitlines()), 12)
+
+        response = self.client.get('/user/flaugher/export/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_round_trip(self):
+        # What we export as HTML can be imported by another user.
+        response = self.client.get('/user/flaugher/export/')
+        user = User.objects.get(username = 'robert')
+        stats = importers.import_bookmarks(
+            user, importers.parse_netscape(StringIO(response.content))
+        )
+        self.assertEqual(stats['created'], 11)
+        self.assertEqual(
+            sorted(Bookmark.objects.get(user = user, link__id = 1).tag_set.values_list('name', flat = True)),
+            ['book', 'publisher']
+        )
+
+
+class BookmarkSaveQueryTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username = 'flaugher', password = 'flaugher')
+
+    def _save_queries(self, url, tags):
+        with QueryCounter() as counter:
+            response = self.client.post('/save/', {
+                'url'  : url,
+                'title': 'Query Count',
+                'tags' : tags
+            })
+        self.assertRedirects(response, '/user/flaugher/')
+        return counter.count
+
+    def test_queries_per_save(self):
+        many = ' '.join('many-%d' % i for i in range(20))
+        few_new = self._save_queries('http://few.example.com/', 'few-1 few-2')
+        many_new = self._save_queries('http://many.example.com/', many)
+        self.assertEqual(few_new, many_new)
+
+        # Edits replacing a couple of tags or half of twenty cost the same.
+        few_edit = self._save_queries('http://few.example.com/', 'few-1 few-3')
+        many_edit = self._save_queries(
+            'http://many.example.com/',
+            ' '.join('many-%d' % i for i in range(10, 30))
+        )
+        self.assertEqual(few_edit, many_edit)
+
+        bookmark = Bookmark.objects.get(link__url = 'http://many.example.com/')
+        self.assertEqual(bookmark.tag_set.count(), 20)
+        self.assertEqual(Tag.objects.get(name = 'many-0').bookmark_count, 0)
+        self.assertEqual(Tag.objects.get(name = 'many-15').bookmark_count, 1)
+
+
+class PaginationTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def _titles(self, response):
+        return [bookmark.title for bookmark in response.context['bookmarks']]
+
+    def test_user_page_cursor_walk(self):
+        expected = list(Bookmark.objects.filter(
+            user__username = 'flaugher'
+        ).order_by('-id').values_list('title', flat = True))
+
+        # Walk forward to the end...
+        pages = []
+        response = self.client.get('/user/flaugher/')
+        pages.append(self._titles(response))
+        while response.context['has_next']:
+            response = self.client.get('/user/flaugher/?' + response.context['next_link'])
+            pages.append(self._titles(response))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(len(pages[0]), 4)
+
+        # ...and back to the start.
+        while response.context['has_prev']:
+            response = self.client.get('/user/flaugher/?' + response.context['prev_link'])
+            self.assertEqual(self._titles(response), pages.pop(-2))
+        self.assertEqual(self._titles(response), expected[:4])
+
+    def test_tag_page_is_paginated(self):
+        user = User.objects.get(username = 'flaugher')
+        tag = Tag.objects.get(name = 'book')
+        for i in range(15):
+            link = Link.objects.create(url = 'http://tagged%d.example.com/' % i)
+            tag.bookmarks.add(Bookmark.objects.create(
+                title = 'tagged %d' % i, user = user, link = link
+            ))
+
+        response = self.client.get('/tag/book/')
+        self.assertEqual(len(response.context['bookmarks']), 10)
+        response = self.client.get('/tag/book/?' + response.context['next_link'])
+        self.assertEqual(len(response.context['bookmarks']), 7)
+        self.assertFalse(response.context['has_next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/user/flaugher/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        call_command('rebuild_feeds')
+
+    def test_feed_matches_friends_bookmarks(self):
+        # flaugher's friends are himself, robert and shari.
+        expected = list(Bookmark.objects.filter(
+            user__username__in = ['flaugher', 'robert', 'shari']
+        ).order_by('-id').values_list('title', flat = True)[:10])
+        response = self.client.get('/friends/flaugher/')
+        self.assertEqual(
+            [bookmark.title for bookmark in response.context['bookmarks']],
+            expected
+        )
+
+    def test_new_bookmark_fanned_out(self):
+        # robert has flaugher as a friend.
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url'  : 'http://www.example.com/',
+            'title': 'Fanned Out',
+            'tags' : ''
+        })
+        tasks.run_pending()
+        robert = User.objects.get(username = 'robert')
+        self.assertTrue(FeedItem.objects.filter(
+            owner = robert, bookmark__title = 'Fanned Out'
+        ).exists())
+        response = self.client.get('/friends/robert/')
+        self.assertContains(response, 'Fanned Out')
+
+    def test_fan_out_after_backfill(self):
+        # robert has flaugher as a friend, and so does flaugher.  A
+        # backfill of robert's feed runs before the bookmark_saved task.
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url'  : 'http://www.example.com/',
+            'title': 'Backfilled',
+            'tags' : ''
+        })
+        flaugher = User.objects.get(username = 'flaugher')
+        robert = User.objects.get(username = 'robert')
+        feeds.backfill(robert, flaugher)
+        tasks.run_pending()
+        self.assertEqual(Task.objects.count(), 0)
+        for owner in (flaugher, robert):
+            self.assertEqual(FeedItem.objects.filter(
+                owner = owner, bookmark__title = 'Backfilled'
+            ).count(), 1)
+
+    def test_imported_bookmarks_fanned_out(self):
+        # robert has flaugher as a friend.
+        flaugher = User.objects.get(username = 'flaugher')
+        self.client.get('/friends/robert/')
+        importers.import_bookmarks(flaugher, [
+            {'url': 'http://imported.example.com/', 'title': 'Imported',
+             'tags': []},
+        ])
+        tasks.run_pending()
+        self.assertTrue(FeedItem.objects.filter(
+            owner__username = 'robert', bookmark__title = 'Imported'
+        ).exists())
+        # The cached friends page was thrown away.
+        response = self.client.get('/friends/robert/')
+        self.assertContains(response, 'Imported')
+
+    def test_follower_count_kept_by_friend_add(self):
+        shari = User.objects.get(username = 'shari')
+        count = Friendship.objects.filter(to_friend = shari).count()
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        Friendship.objects.filter(
+            from_friend__username = 'flaugher', to_friend = shari
+        ).delete()
+        FollowerCount.objects.filter(user = shari).update(count = count - 1)
+        self.client.get('/friends/add/', {'username': 'shari'})
+        self.assertEqual(FollowerCount.objects.get(user = shari).count, count)
+
+    def test_popular_users_read_on_demand(self):
+        old_limit = feeds.FANOUT_LIMIT
+        # flaugher has two followers, so a limit of 1 skips fan-out.
+        feeds.FANOUT_LIMIT = 1
+        try:
+            self.client.login(username = 'flaugher', password = 'flaugher')
+            self.client.post('/save/', {
+                'url'  : 'http://www.example.com/',
+                'title': 'Read On Demand',
+                'tags' : ''
+            })
+            self.assertFalse(FeedItem.objects.filter(
+                bookmark__title = 'Read On Demand'
+            ).exists())
+            response = self.client.get('/friends/robert/')
+            self.assertContains(response, 'Read On Demand')
+        finally:
+            feeds.FANOUT_LIMIT = old_limit
+
+
+class InstrumentationTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        instrumentation.reset()
+
+    def test_views_recorded(self):
+        for i in range(3):
+            self.client.get('/user/flaugher/')
+        self.client.get('/tag/')
+
+        report = instrumentation.report()
+        summary = report['bookmarks.views.user_page']
+        self.assertEqual(summary['count'], 3)
+        self.assertTrue(summary['queries']['p50'] > 0)
+        self.assertTrue(summary['template_ms']['p99'] <= summary['wall_ms']['p99'])
+        self.assertTrue(summary['bytes']['max'] > 0)
+        self.assertEqual(report['bookmarks.views.tag_cloud_page']['count'], 1)
+
+    def test_queries_counted_without_logging_them(self):
+        start = len(connection.queries)
+        self.client.get('/user/flaugher/')
+        self.assertEqual(len(connection.queries), start)
+        self.assertFalse(connection.use_debug_cursor)
+        summary = instrumentation.report()['bookmarks.views.user_page']
+        self.assertTrue(summary['queries:default']['max'] > 0)
+
+    def test_streamed_responses_not_read(self):
+        response = self.client.get('/user/flaugher/export/', {'format': 'json'})
+        self.assertEqual(len(response.content.splitlines()), 11)
+        summary = instrumentation.report()['bookmarks.views.bookmark_export_page']
+        self.assertFalse('bytes' in summary)
+
+    def test_view_stats_page_is_staff_only(self):
+        response = self.client.get('/stats/views/')
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.get('/')
+        response = self.client.get('/stats/views/')
+        self.assertIn('bookmarks.views.main_page', json.loads(response.content))
+
+
+class BenchmarkTest(TestCase):
+
+    def test_generate_and_run(self):
+        counts = benchmarks.generate_dataset(
+            users = 5, bookmarks_per_user = 6, tags = 20,
+            friends_per_user = 2, seed = 1
+        )
+        self.assertEqual(counts['users'], 5)
+        self.assertEqual(Bookmark.objects.count(), counts['bookmarks'])
+        self.assertTrue(Tag.objects.filter(bookmark_count__gt = 0).exists())
+
+        from django_bookmarks import urls
+        results, missing = benchmarks.run_benchmarks(urls.urlpatterns, iterations = 1)
+        self.assertEqual(missing, [])
+        for name, result in results.items():
+            self.assertTrue(result['status'] < 400,
+                            msg = '%s returned %d' % (name, result['status']))
+
+
+class WarmUpTest(TestCase):
+
+    def test_warm_up_compiles_every_template(self):
+        names = list(warmup.template_names())
+        self.assertTrue('bookmark_list.html' in names)
+        self.assertTrue('registration/register.html' in names)
+        stats = warmup.warm_up()
+        self.assertEqual(stats['errors'], [])
+        self.assertEqual(stats['templates'], len(names))
+
+    def test_measure_startup(self):
+        result = benchmarks.measure_startup('/register/success/', runs = 1)
+        self.assertEqual(result['status'], 200)
+        self.assertTrue(result['total_ms'] >= result['load_ms'] + result['first_ms'])
+
+
+class IndexTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def _plan(self, query_set):
+        sql, params = query_set.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, query_set):
+        plan = self._plan(query_set)
+        for step in plan:
+            # Every table access has to go through an index, and rows
+            # must come out of it already in order.
+            if step.startswith('SCAN') or step.startswith('SEARCH'):
+                self.assertTrue('USING' in step, msg = '; '.join(plan))
+            self.assertFalse('TEMP B-TREE' in step, msg = '; '.join(plan))
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            return
+        user = User.objects.get(username = 'flaugher')
+        link = Link.objects.get(id = 1)
+
+        # main_page
+        self.assertUsesIndex(SharedBookmark.objects.order_by('-date')[:10])
+        # user_page
+        self.assertUsesIndex(Bookmark.objects.filter(user = user).order_by('-id')[:5])
+        # _bookmark_save
+        self.assertUsesIndex(Bookmark.objects.filter(user = user, link = link))
+        # popular_page
+        self.assertUsesIndex(
+            PopularBookmark.objects.filter(period = 'day').order_by('-score')[:10]
+        )
+        # Vote ordering for the all time ranking
+        self.assertUsesIndex(SharedBookmark.objects.order_by('-votes')[:10])
+
+    def test_bookmark_unique_per_user_and_link(self):
+        user = User.objects.get(username = 'flaugher')
+        link = Link.objects.get(id = 1)
+        self.assertRaises(
+            IntegrityError,
+            Bookmark.objects.create, title = 'Again', user = user, link = link
+        )
+
+
+class MetadataTestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    pages = {
+        '/page': '<html><head><title> A &amp; B\n page </title>'
+                 '<link rel="canonical" href="/canonical">'
+                 '<link rel="shortcut icon" href="/icon.png">'
+                 '</head><body>Hello</body></html>',
+        '/plain': '<html><head><title>Plain</title></head></html>',
+    }
+
+    def do_GET(self):
+        if self.path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/plain')
+            self.end_headers()
+        elif self.path == '/to-ftp':
+            self.send_response(302)
+            self.send_header('Location', 'ftp://ftp.example.com/')
+            self.end_headers()
+        elif self.path in self.pages:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(self.pages[self.path])
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetadataTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        # A stand-in web server on a free local port.
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), MetadataTestHandler
+        )
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        # The stand-in server is on the loopback address.
+        metadata.ALLOW_PRIVATE_ADDRESSES = True
+
+    def tearDown(self):
+        metadata.ALLOW_PRIVATE_ADDRESSES = False
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _fetch_all(self):
+        return metadata.fetch_pending(
+            throttle = metadata.HostThrottle(0)
+        )
+
+    def test_fetch(self):
+        result = metadata.fetch(self.base + '/page')
+        self.assertEqual(result, {
+            'status': 200,
+            'title': u'A & B page',
+            'canonical_url': self.base + '/canonical',
+            'favicon_url': self.base + '/icon.png',
+        })
+        # Redirects are followed and the final URL is the canonical one.
+        result = metadata.fetch(self.base + '/moved')
+        self.assertEqual(result['title'], u'Plain')
+        self.assertEqual(result['canonical_url'], self.base + '/plain')
+        self.assertEqual(metadata.fetch(self.base + '/gone')['status'], 404)
+
+    def test_refused_urls(self):
+        self.assertRaises(
+            metadata.RefusedURL, metadata.fetch, self.base + '/to-ftp'
+        )
+        metadata.ALLOW_PRIVATE_ADDRESSES = False
+        for url in (self.base + '/page', 'file:///etc/passwd',
+                    'http://169.254.169.254/latest/meta-data/'):
+            self.assertRaises(metadata.RefusedURL, metadata.fetch, url)
+        self.assertTrue(metadata.is_public_address('93.184.216.34'))
+        for address in ('10.0.0.1', '172.20.1.1', '192.168.1.1', '::1',
+                        'fe80::1', '::ffff:127.0.0.1'):
+            self.assertFalse(metadata.is_public_address(address))
+
+        # Refused links aren't retried.
+        link = Link.objects.create(url = self.base + '/page')
+        metadata.enqueue([link.id])
+        self.assertEqual(self._fetch_all(), (1, 1))
+        self.assertEqual(LinkMetadata.objects.get(link = link).status, None)
+
+    def test_saving_queues_a_fetch(self):
+        client = Client()
+        client.login(username = 'flaugher', password = 'flaugher')
+        client.post('/save/', {
+            'url': self.base + '/page',
+            'title': 'Typed',
+            'tags': ''
+        })
+        link = Link.objects.get(url = self.base + '/page')
+        self.assertTrue(LinkFetchJob.objects.filter(link = link).exists())
+        self.assertFalse(LinkMetadata.objects.filter(link = link).exists())
+
+        self.assertEqual(self._fetch_all(), (1, 1))
+        self.assertFalse(LinkFetchJob.objects.exists())
+        self.assertEqual(link.metadata.title, u'A & B page')
+        self.assertEqual(link.metadata.status, 200)
+
+        # Without a bookmark of their own, users get the page title
+        # suggested.
+        Bookmark.objects.filter(link = link).delete()
+        response = client.get('/save/', {'url': self.base + '/page'})
+        self.assertEqual(response.context['form']['title'].value(), u'A & B page')
+
+    def test_fetch_pending(self):
+        links = [Link.objects.create(url = self.base + path)
+                 for path in ('/page', '/plain', '/gone')]
+        metadata.enqueue([link.id for link in links])
+        self.assertEqual(self._fetch_all(), (3, 3))
+        self.assertEqual(
+            dict(LinkMetadata.objects.values_list('link__url', 'status')), {
+                self.base + '/page': 200,
+                self.base + '/plain': 200,
+                self.base + '/gone': 404,
+            }
+        )
+        # Nothing left to do.
+        self.assertEqual(self._fetch_all(), (0, 0))
+
+    def test_unreachable_links_are_retried(self):
+        # Nothing listens on a port that was just closed.
+        closed = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), MetadataTestHandler)
+        url = 'http://127.0.0.1:%d/' % closed.server_port
+        closed.server_close()
+        link = Link.objects.create(url = url)
+        metadata.enqueue([link.id])
+
+        self.assertEqual(self._fetch_all(), (1, 0))
+        job = LinkFetchJob.objects.get(link = link)
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue(job.error)
+        # Not due again until the retry delay has passed.
+        self.assertEqual(self._fetch_all(), (0, 0))
+
+        # The last attempt gives up and records the link as unreachable.
+        LinkFetchJob.objects.filter(id = job.id).update(
+            attempts = metadata.MAX_ATTEMPTS - 1, due = job.due - timedelta(days = 1)
+        )
+        self.assertEqual(self._fetch_all(), (1, 1))
+        self.assertEqual(LinkMetadata.objects.get(link = link).status, None)
+        self.assertFalse(LinkFetchJob.objects.exists())
+
+    def test_host_throttle(self):
+        throttle = metadata.HostThrottle(0.05)
+        start = time.time()
+        throttle.wait('http://a.example.com/1')
+        throttle.wait('http://b.example.com/1')
+        self.assertTrue(time.time() - start < 0.05)
+        throttle.wait('http://a.example.com/2')
+        self.assertTrue(time.time() - start >= 0.05)
+
+
+class LinkTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def test_canonicalize(self):
+        for url, canonical in [
+            ('HTTP://Example.COM', 'http://example.com/'),
+            ('example.com/a/./b/../c', 'http://example.com/a/c'),
+            ('https://example.com:443/#top', 'https://example.com/'),
+            ('http://example.com.:8080/%7euser/%2f', 'http://example.com:8080/~user/%2F'),
+            ('http://example.com/?b=2&utm_source=feed&a=1&fbclid=x',
+             'http://example.com/?a=1&b=2'),
+        ]:
+            self.assertEqual(links.canonicalize(url), canonical)
+        self.assertEqual(links.url_key('http://x.com'),
+                         links.url_key('https://x.com/?utm_source=feed'))
+        self.assertNotEqual(links.url_key('http://x.com/a'),
+                            links.url_key('http://x.com/b'))
+        self.assertEqual(len(links.url_key('http://x.com/' + 'a' * 500)), 40)
+
+    def test_save_variants_share_a_link(self):
+        client = Client()
+        client.login(username = 'flaugher', password = 'flaugher')
+        for url, title in [('http://Variant.example.com', 'First'),
+                           ('https://variant.example.com/?utm_source=feed', 'Second')]:
+            client.post('/save/', {'url': url, 'title': title, 'tags': ''})
+        link = Link.objects.get(url_hash = links.url_key('variant.example.com'))
+        self.assertEqual(link.url, 'http://variant.example.com/')
+        self.assertEqual(
+            list(Bookmark.objects.filter(link = link).values_list('title', flat = True)),
+            ['Second']
+        )
+
+    def test_merge_links(self):
+        flaugher, robert, shari = [User.objects.get(username = name)
+                                   for name in ('flaugher', 'robert', 'shari')]
+        # Links saved before canonical keys, so they have none.
+        first, second, third = [Link.objects.create(url = url) for url in (
+            'http://merge.example.com/',
+            'https://merge.example.com/?utm_source=feed',
+            'http://MERGE.example.com:80/#top',
+        )]
+        one = Bookmark.objects.create(title = 'One', user = flaugher, link = first)
+        two = Bookmark.objects.create(title = 'Two', user = flaugher, link = second)
+        three = Bookmark.objects.create(title = 'Three', user = robert, link = third)
+        for bookmark, names in ((one, ['merge-a']), (two, ['merge-a', 'merge-b'])):
+            for name in names:
+                Tag.objects.get_or_create(name = name)[0].bookmarks.add(bookmark)
+        call_command('update_tag_counts', verbosity = 0)
+        kept = SharedBookmark.objects.create(bookmark = one)
+        kept.users_voted.add(flaugher)
+        duplicate = SharedBookmark.objects.create(bookmark = two, votes = 2)
+        duplicate.users_voted.add(flaugher, shari)
+        comments = [Comment.objects.create(
+            content_object = shared, site_id = 1, user = shari, comment = text
+        ) for shared, text in ((kept, 'On the keeper'), (duplicate, 'On the duplicate'))]
+        for comment in comments:
+            discussion.add(comment)
+
+        call_command('merge_links', batch_size = 5, verbosity = 0)
+
+        self.assertEqual(list(Link.objects.filter(
+            url__icontains = 'merge.example.com'
+        ).values_list('id', flat = True)), [first.id])
+        self.assertEqual(Link.objects.get(id = first.id).url_hash,
+                         links.url_key(first.url))
+        self.assertEqual(Link.objects.filter(url_hash = None).count(), 0)
+
+        # flaugher's two bookmarks became one with both tags, robert's
+        # moved over.
+        self.assertEqual(
+            sorted(Bookmark.objects.filter(link = first).values_list('id', flat = True)),
+            [one.id, three.id]
+        )
+        self.assertEqual(sorted(tag.name for tag in one.tag_set.all()),
+                         ['merge-a', 'merge-b'])
+        self.assertEqual(Tag.objects.get(name = 'merge-a').bookmark_count, 1)
+        self.assertEqual(Tag.objects.get(name = 'merge-b').bookmark_count, 1)
+
+        # The votes were pooled on the remaining share.
+        self.assertFalse(SharedBookmark.objects.filter(id = duplicate.id).exists())
+        kept = SharedBookmark.objects.get(id = kept.id)
+        self.assertEqual(kept.votes, 2)
+        self.assertEqual(sorted(kept.users_voted.values_list('username', flat = True)),
+                         ['flaugher', 'shari'])
+        # And so were the comments.
+        self.assertEqual(kept.comment_count, 2)
+        self.assertEqual(
+            sorted(Comment.objects.filter(object_pk = unicode(kept.id)).values_list(
+                'comment', flat = True
+            )), ['On the duplicate', 'On the keeper']
+        )
+        self.assertEqual(
+            RenderedComment.objects.filter(shared_bookmark = kept).count(), 2
+        )
+
+        self.assertEqual(links.get_or_create_link('merge.example.com'), (first, False))
+
+
+class ApiTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def _get(self, url, status = 200, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, status)
+        if status == 200 or status == 400:
+            return response, json.loads(response.content)
+        return response, None
+
+    def test_user_bookmarks(self):
+        response, data = self._get('/api/user/flaugher/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(data['bookmarks']), 11)
+        self.assertEqual(sorted(data['bookmarks'][0]),
+                         ['id', 'tags', 'title', 'url', 'user'])
+        ids = [bookmark['id'] for bookmark in data['bookmarks']]
+        self.assertEqual(ids, sorted(ids, reverse = True))
+
+        response, data = self._get('/api/user/flaugher/?fields=id,url')
+        self.assertEqual(sorted(data['bookmarks'][0]), ['id', 'url'])
+
+        self._get('/api/user/flaugher/?fields=id,password', status = 400)
+        self._get('/api/user/flaugher/?cursor=nonsense', status = 400)
+        self._get('/api/user/nobody/', status = 404)
+
+    def test_cursor_pagination(self):
+        old_page_size = api.PAGE_SIZE
+        api.PAGE_SIZE = 5
+        try:
+            ids = []
+            url = '/api/user/flaugher/?fields=id'
+            cursor = None
+            while True:
+                response, data = self._get(cursor and url + '&cursor=' + cursor or url)
+                ids.extend(bookmark['id'] for bookmark in data['bookmarks'])
+                cursor = data['next']
+                if cursor is None:
+                    break
+        finally:
+            api.PAGE_SIZE = old_page_size
+        self.assertEqual(ids, list(Bookmark.objects.filter(
+            user__username = 'flaugher'
+        ).order_by('-id').values_list('id', flat = True)))
+
+    def test_conditional_get(self):
+        url = '/api/user/flaugher/'
+        response, data = self._get(url)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        # Unchanged lists are answered with a 304 and no queries.
+        with QueryCounter() as counter:
+            response, data = self._get(url, status = 304, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(response.content, '')
+        self._get(url, status = 304, HTTP_IF_MODIFIED_SINCE = last_modified)
+        # Each URL has its own ETag.
+        self._get(url + '?fields=id', HTTP_IF_NONE_MATCH = etag)
+
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.post('/save/', {
+            'url': 'http://api.example.com/',
+            'title': 'Fresh',
+            'tags': ''
+        })
+        response, data = self._get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(data['bookmarks'][0]['title'], 'Fresh')
+
+    def test_friends_feed_of_popular_users(self):
+        old_limit = feeds.FANOUT_LIMIT
+        # flaugher has two followers, so a limit of 1 skips fan-out.
+        feeds.FANOUT_LIMIT = 1
+        try:
+            feeds.recount_followers()
+            url = '/api/friends/robert/'
+            response, data = self._get(url)
+            etag = response['ETag']
+            self.assertFalse(response.has_header('Last-Modified'))
+            self._get(url, status = 304, HTTP_IF_NONE_MATCH = etag)
+
+            self.client.login(username = 'flaugher', password = 'flaugher')
+            self.client.post('/save/', {
+                'url': 'http://api.example.com/',
+                'title': 'Fresh',
+                'tags': ''
+            })
+            tasks.run_pending()
+            response, data = self._get(url, HTTP_IF_NONE_MATCH = etag)
+            self.assertEqual(data['bookmarks'][0]['title'], 'Fresh')
+        finally:
+            feeds.FANOUT_LIMIT = old_limit
+
+    def test_other_lists(self):
+        call_command('rebuild_search_index', verbosity = 0)
+        response, data = self._get('/api/search/?query=javascript&fields=title')
+        self.assertTrue({'title': 'Eloquent JavaScript - Book'} in data['bookmarks'])
+        self.assertEqual((data['page'], data['next'], data['previous']), (1, None, None))
+
+        response, data = self._get('/api/tag/%s/' % Tag.objects.all()[0].name)
+        self.assertTrue(data['bookmarks'])
+
+        response, data = self._get('/api/friends/flaugher/')
+        self.assertTrue('bookmarks' in data)
+
+        call_command('refresh_popularity', verbosity = 0)
+        response, data = self._get('/api/popular/?period=all&fields=id,votes')
+        votes = [bookmark['votes'] for bookmark in data['bookmarks']]
+        self.assertEqual(votes, sorted(votes, reverse = True))
+        self._get('/api/popular/?period=year', status = 404)
+
+
+class AutocompleteTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        call_command('update_tag_counts', verbosity = 0)
+        autocomplete.reset()
+
+    def tearDown(self):
+        autocomplete.reset()
+
+    def _suggest(self, prefix):
+        response = self.client.get('/tags/autocomplete/', {'q': prefix})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(response.content)
+
+    def test_ranking(self):
+        index = autocomplete.TagIndex(
+            [('python', 5), ('pyramid', 9), ('Pygments', 1), ('ruby', 7)]
+        )
+        self.assertEqual(index.suggest('PY'), ['pyramid', 'python', 'Pygments'])
+        self.assertEqual(index.suggest('py', limit = 1), ['pyramid'])
+        # The user's own tags come first.
+        index.users[1] = {'Pygments': 2}
+        self.assertEqual(index.suggest('py', 1), ['Pygments', 'pyramid', 'python'])
+        index.update({'pyramid': -9, 'pyside': 1}, 1)
+        self.assertEqual(index.suggest('py', 1), ['Pygments', 'pyside', 'python'])
+
+    def test_suggestions_skip_the_database(self):
+        self.assertEqual(self._suggest('java'), ['JavaScript'])
+        self.assertEqual(self._suggest(''), [])
+        with QueryCounter() as counter:
+            self.assertEqual(self._suggest('in'), ['investing'])
+        self.assertEqual(counter.count, 0)
+
+    def test_saved_tags_are_suggested(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.assertEqual(self._suggest('fin'), ['finance'])
+        self.client.post('/save/', {
+            'url': 'http://fintech.example.com/',
+            'title': 'Fintech',
+            'tags': 'fintech'
+        })
+        self.assertEqual(sorted(self._suggest('fin')), ['finance', 'fintech'])
+
+    def test_rolled_back_changes_are_dropped(self):
+        self.assertEqual(self._suggest('fin'), ['finance'])
+
+        @commit_on_success
+        def save():
+            after_commit(autocomplete.tags_changed, {'fintech': 1})
+            raise ValueError
+
+        self.assertRaises(ValueError, save)
+        self.assertEqual(self._suggest('fin'), ['finance'])
+
+
+class FrontPageTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        frontpage.reset()
+
+    def test_snapshot(self):
+        with QueryCounter() as counter:
+            rows = frontpage.snapshot()
+        self.assertEqual(counter.count, 1)
+        self.assertEqual([row['id'] for row in rows], [5, 4, 3, 2, 1])
+        self.assertEqual(rows[-1], {
+            'id': 1,
+            'title': 'Packt Publishing Inc',
+            'url': 'http://www.packtpub.com/',
+            'username': 'flaugher',
+            'votes': 3,
+        })
+
+        # Other processes find the rows in the cache.
+        frontpage.reset()
+        with QueryCounter() as counter:
+            self.assertEqual(frontpage.snapshot(), rows)
+        self.assertEqual(counter.count, 0)
+
+    def test_snapshot_follows_votes(self):
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        rows = frontpage.snapshot()
+        self.client.get('/vote/', {'id': 2})
+        votes = dict((row['id'], row['votes']) for row in frontpage.snapshot())
+        self.assertEqual(votes[2], rows[3]['votes'] + 1)
+
+
+class CommentTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.shared = SharedBookmark.objects.get(id = 1)
+
+    def _post(self, text):
+        data = CommentForm(self.shared).initial
+        data['comment'] = text
+        response = self.client.post('/comments/post/', data)
+        self.assertEqual(response.status_code, 302)
+
+    def _comment_count(self):
+        return SharedBookmark.objects.get(id = self.shared.id).comment_count
+
+    def test_comments_are_rendered_when_posted(self):
+        self._post('See http://www.example.com/')
+        self.assertEqual(self._comment_count(), 1)
+        rendered = RenderedComment.objects.get(shared_bookmark = self.shared)
+        self.assertTrue('<b>flaugher</b>' in rendered.html)
+        self.assertTrue('<a href="http://www.example.com/"' in rendered.html)
+
+        response = self.client.get('/bookmark/%d/' % self.shared.id)
+        self.assertContains(response, rendered.html)
+        self.assertContains(response, 'Number of comments: 1')
+
+        Comment.objects.get(id = rendered.comment_id).delete()
+        self.assertEqual(self._comment_count(), 0)
+        self.assertFalse(RenderedComment.objects.exists())
+
+    def test_comment_pages(self):
+        old_per_page = discussion.PER_PAGE
+        discussion.PER_PAGE = 2
+        try:
+            self._post('First')
+            url = '/bookmark/%d/' % self.shared.id
+            self.client.get(url)
+            with QueryCounter() as counter:
+                self.client.get(url)
+            few = counter.count
+
+            self._post('Second')
+            self._post('Third')
+            with QueryCounter() as counter:
+                response = self.client.get(url)
+            self.assertEqual(counter.count, few)
+        finally:
+            discussion.PER_PAGE = old_per_page
+        self.assertContains(response, 'Third')
+        self.assertNotContains(response, 'First')
+        self.assertContains(response, 'Older')
+        self.assertContains(response, 'Number of comments: 3')
+
+    def test_render_comments_command(self):
+        Comment.objects.create(
+            content_object = self.shared,
+            user = User.objects.get(username = 'flaugher'),
+            comment = 'Posted before comments were rendered',
+            site_id = 1
+        )
+        self.assertEqual(self._comment_count(), 0)
+        call_command('render_comments', verbosity = 0)
+        self.assertEqual(self._comment_count(), 1)
+        self.assertEqual(RenderedComment.objects.count(), 1)
+
+
+class ReplicaTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        instrumentation.reset()
+        self.old_replicas = replicas.REPLICAS
+        self.old_use_replica = replicas.use_replica
+        self.replica_requests = []
+        # There's only the one database here, so note which requests
+        # would have read from a replica instead.
+        replicas.use_replica = lambda: self.replica_requests.append(True)
+
+    def tearDown(self):
+        replicas.REPLICAS = self.old_replicas
+        replicas.use_replica = self.old_use_replica
+        replicas.use_primary()
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        replicas.REPLICAS = ('replica', )
+        self.old_use_replica()
+        self.assertEqual(router.db_for_read(Bookmark), 'replica')
+        self.assertEqual(router.db_for_write(Bookmark), 'default')
+        self.assertEqual(router.allow_syncdb('replica', Bookmark), False)
+        replicas.use_primary()
+        self.assertEqual(router.db_for_read(Bookmark), None)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.get('/')
+        self.client.get('/tag/')
+        self.assertEqual(len(self.replica_requests), 2)
+
+        self.client.login(username = 'flaugher', password = 'flaugher')
+        self.client.get('/save/')
+        self.assertEqual(len(self.replica_requests), 2)
+        response = self.client.post('/save/', {
+            'url': 'http://replica.example.com/',
+            'title': 'Replica',
+            'tags': ''
+        })
+        self.assertTrue(replicas.STICKY_COOKIE in response.cookies)
+        self.client.get('/user/flaugher/')
+        self.assertEqual(len(self.replica_requests), 2)
+
+        del self.client.cookies[replicas.STICKY_COOKIE]
+        self.client.get('/user/flaugher/')
+        self.assertEqual(len(self.replica_requests), 3)
+
+    def test_queries_recorded_per_alias(self):
+        self.client.get('/user/flaugher/')
+        summary = instrumentation.report()['bookmarks.views.user_page']
+        self.assertEqual(summary['queries:default'], summary['queries'])
+        self.assertTrue('db_ms:default' in summary)
+
+
+class SqliteTuningTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.connection = sqlite3.connect(os.path.join(self.directory, 'test.db'))
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def test_apply_pragmas(self):
+        sqlite_tuning.apply_pragmas(self.connection, {
+            'synchronous': 'NORMAL',
+            'busy_timeout': 10000,
+            'cache_size': -64000,
+            'journal_mode': 'WAL',
+        })
+        self.assertEqual(sqlite_tuning.current_pragmas(self.connection, [
+            'journal_mode', 'synchronous', 'busy_timeout', 'cache_size'
+        ]), {
+            'journal_mode': 'wal',
+            'synchronous': 1,
+            'busy_timeout': 10000,
+            'cache_size': -64000,
+        })
+
+    def test_journal_mode_first(self):
+        statements = sqlite_tuning.pragma_statements(
+            {'cache_size': 100, 'journal_mode': 'WAL'}
+        )
+        self.assertEqual(statements, [
+            'PRAGMA journal_mode = WAL', 'PRAGMA cache_size = 100'
+        ])
+
+    def test_bad_pragmas(self):
+        self.assertRaises(ImproperlyConfigured, sqlite_tuning.pragma_statements,
+                          {'journal_mode': 'WAL; DROP TABLE x'})
+        self.assertRaises(ImproperlyConfigured, sqlite_tuning.pragma_statements,
+                          {'cache size': 100})
+
+
+class TaskTest(TestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username = 'flaugher', password = 'flaugher')
+
+    def tearDown(self):
+        tasks._tasks.pop('always_fails', None)
+
+    def test_save_side_effects_run_in_background(self):
+        self.client.post('/save/', {
+            'url': 'http://tasks.example.com/',
+            'title': 'Background',
+            'tags': '',
+            'share': 'True'
+        })
+        self.assertFalse(FeedItem.objects.filter(bookmark__title = 'Background').exists())
+        stats = tasks.queue_stats()
+        self.assertEqual(stats['pending'], 2)
+        self.assertEqual(stats['by_name'], {'bookmark_saved': 1, 'bookmark_shared': 1})
+
+        self.assertEqual(tasks.run_pending(), (2, 2))
+        self.assertTrue(FeedItem.objects.filter(bookmark__title = 'Background').exists())
+        self.assertTrue(PopularBookmark.objects.filter(
+            shared_bookmark__bookmark__title = 'Background'
+        ).exists())
+        self.assertEqual(tasks.queue_stats()['pending'], 0)
+
+        response = self.client.get('/stats/tasks/')
+        self.assertEqual(json.loads(response.content)['pending'], 0)
+
+    def test_failing_task_retried(self):
+        @tasks.task
+        def always_fails():
+            raise ValueError('Broken')
+
+        tasks.enqueue('always_fails')
+        self.assertEqual(tasks.run_pending(), (1, 0))
+        job = Task.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue('Broken' in job.error)
+        # Not due again until the backoff has passed.
+        self.assertEqual(tasks.run_pending(), (0, 0))
+
+        Task.objects.update(attempts = tasks.MAX_ATTEMPTS - 1, due = job.created)
+        self.assertEqual(tasks.run_pending(), (1, 0))
+        self.assertTrue(Task.objects.get().failed)
+        self.assertEqual(tasks.queue_stats()['failed'], 1)
+        self.assertEqual(tasks.run_pending(), (0, 0))
+
+        self.assertRaises(ValueError, tasks.enqueue, 'no_such_task')
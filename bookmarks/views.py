@@ -1,27 +1,36 @@
 # Import various classes from modules
 from django.http import HttpResponse, Http404, HttpResponseRedirect
-from django.template import Context, RequestContext
-from django.template.loader import get_template
+from django.template import RequestContext
 from django.contrib.auth.models import User
 from django.shortcuts import render_to_response, get_object_or_404
-from django.contrib.auth import logout
+from django.contrib import messages
+from django.contrib.auth import SESSION_KEY, logout
 from django.contrib.auth.decorators import login_required
-from bookmarks.forms import *
-from bookmarks.models import *
-import pdb
-from datetime import datetime, timedelta
-from django.db.models import Q
-from django.core.paginator import Paginator, InvalidPage
+from django.contrib.admin.views.decorators import staff_member_required
+from bookmarks.forms import BookmarkSaveForm, ImportForm, RegistrationForm, \
+    SearchForm
+from bookmarks.models import Bookmark, Friendship, Link, LinkMetadata, \
+    SharedBookmark, Tag
+import json
+from django.db import IntegrityError
+from django.db.models import F, Min, Max
+from django.conf import settings
+from django.utils.http import urlquote
+from bookmarks import autocomplete, cache, discussion, exporters, feeds, \
+    frontpage, importers, instrumentation, links, metadata, pagination, \
+    popularity, replicas, search, tasks, votes
 
 ITEMS_PER_PAGE = 4
+LIST_ITEMS_PER_PAGE = 10
+SEARCH_RESULTS_PER_PAGE = 10
 
 
 # "request" is an object that contains the contents of the 
 # HTTP request as a hash, E.g. request.POST contains POST data.
 def main_page(request):
-    shared_bookmarks = SharedBookmark.objects.order_by(
-        '-date'
-    )[:10]  # Limit the list to the first 10 results.
+    # The 10 newest shared bookmarks, as precomputed rows (see
+    # bookmarks/frontpage.py).
+    shared_bookmarks = frontpage.snapshot()
 
     variables = RequestContext(request, {
         'shared_bookmarks': shared_bookmarks
@@ -47,71 +56,89 @@ def user_page(request, username):
     from the database and create a user object.  If the user
     isn't found, generate a 404 error page.
     '''
-    user = get_object_or_404(User, username=username)
-    query_set = user.bookmark_set.order_by('-id')
-    paginator = Paginator(query_set, ITEMS_PER_PAGE)
+    # If the user is viewing their own page, display the 'edit' link
+    # next to each bookmark.
+    show_edit = username == request.user.username
+    cursor = request.GET.get('cursor', '')
+    context = _fragment('user', username, [cursor, show_edit])
+
+    if context['fragment'] is None:
+        user = get_object_or_404(User, username=username)
+        query_set = _bookmark_list_query(user.bookmark_set.all())
+        page = _keyset_page(request, query_set, ITEMS_PER_PAGE)
+        context.update(_keyset_context(page))
+        context['bookmarks'] = page.items
 
     if request.user.is_authenticated():
         is_friend = Friendship.objects.filter(
             from_friend = request.user,
-            to_friend = user
+            to_friend__username = username
         )
     else:
         is_friend = False
 
-    try:
-        page_number = int(request.GET['page'])  # GET should contain a 'page' variable...
-    except (KeyError, ValueError):  # If it doesn't, assume we want the first page.
-        page_number = 1
-
-    try:
-        page = paginator.page(page_number)  # Get the current page.
-    except InvalidPage:
-        raise Http404
-
-    bookmarks = page.object_list  # Retrieve the bookmarks for the current page.
-
     # username, bookmarks, show_tags are the context.
-    variables = RequestContext(request, {
-        'bookmarks': bookmarks,
+    variables = RequestContext(request, dict(context, **{
         'username': username,
         'show_tags': True,
-        # If the user is viewing their own page, display the 'edit'
-        # link next to each bookmark.
-        'show_edit': username == request.user.username,
-        'show_paginator': paginator.num_pages > 1,  # If more than one page, show paginator.
-        'has_prev': page.has_previous(),            # If there's a previous page, show link to it.
-        'has_next': page.has_next(),                # If there's a next page, show link to it.
-        'page': page_number,                        # Index of current page
-        'pages': paginator.num_pages,               # Total number of pages
-        'next_page': page_number + 1,               # Index of next page
-        'prev_page': page_number - 1,               # Index of previous page
+        'show_edit': show_edit,
+        'cursor': cursor,
         'is_friend': is_friend
-    })
+    }))
     # View is finished. Render the user page.
     return render_to_response('user_page.html', variables)
 
 
+def bookmark_export_page(request, username):
+    user = get_object_or_404(User, username=username)
+
+    format = request.GET.get('format', 'html')
+    if format not in exporters.FORMATS:
+        raise Http404
+    writer, mimetype, extension = exporters.FORMATS[format]
+
+    # The response is built from a generator, so the bookmarks are read
+    # and sent a batch at a time instead of being rendered up front.
+    response = HttpResponse(
+        exporters.export_bookmarks(user, format),
+        mimetype = mimetype
+    )
+    # Tells InstrumentationMiddleware not to read the content.
+    response.streaming = True
+    response['Content-Disposition'] = \
+        'attachment; filename=%s-bookmarks.%s' % (username, extension)
+    return response
+
+
 def tag_page(request, tag_name):
 
     ''' 
     Use the tag name to create a tag object. This object
     is populated from information about the tag from the database.
     '''
-    tag = get_object_or_404(Tag, name=tag_name)
+    cursor = request.GET.get('cursor', '')
+    context = _fragment('tag', tag_name, [cursor])
 
-    # Get all bookmarks associated with the given tag in descending order.
-    bookmarks = tag.bookmarks.order_by('-id')
+    if context['fragment'] is None:
+        tag = get_object_or_404(Tag, name=tag_name)
+
+        # Get one page of the bookmarks associated with the given tag
+        # in descending order.
+        page = _keyset_page(
+            request, _bookmark_list_query(tag.bookmarks.all()), LIST_ITEMS_PER_PAGE
+        )
+        context.update(_keyset_context(page))
+        context['bookmarks'] = page.items
 
     # Set up variables to pass to the tag_page template.
     # bookmarks, etc. comprise the context.  Context is just
     # a dictionary of values.
-    variables = RequestContext(request, {
-        'bookmarks': bookmarks,
+    variables = RequestContext(request, dict(context, **{
         'tag_name' : tag_name,
+        'cursor': cursor,
         'show_tags': True,
         'show_user': True
-    })
+    }))
     # View is done. Now populate template with the contents
     # of the dictionary, i.e, the context.  It gets passed a
     # Context instance by default, not a RequestContext.
@@ -172,7 +199,9 @@ def bookmark_save_page(request):
 
             if ajax:  # If this is an Ajax request...
                 variables = RequestContext(request, {
-                    'bookmarks': [bookmark],
+                    'bookmarks': _bookmark_list_query(
+                        Bookmark.objects.filter(id = bookmark.id)
+                    ),
                     'show_edit': True,
                     'show_tags': True
                 })
@@ -198,7 +227,7 @@ def bookmark_save_page(request):
         try:
             # Get the link and bookmark objects that correspond
             # to this URL and user.
-            link = Link.objects.get(url = url)
+            link = links.get_link(url)
             bookmark = Bookmark.objects.get(
                 link = link,
                 user = request.user
@@ -210,12 +239,19 @@ def bookmark_save_page(request):
             tags = ' '.join(
                 tag.name for tag in bookmark.tag_set.all()
             )
-        except (Link.DoesNotExist, Bookmark.DoesNotExist):
+        except Link.DoesNotExist:
             # This is a null operation.  Essentially, if we
-            # can't find either the URL or its associated
-            # bookmark, we'll only populate the URL field below,
-            # leaving the title and tags fields blank.
+            # can't find the URL, we'll only populate the URL
+            # field below, leaving the title and tags fields blank.
             pass
+        except Bookmark.DoesNotExist:
+            # Someone else has bookmarked the URL, so suggest the
+            # page title the metadata fetcher found, if any.
+            titles = LinkMetadata.objects.filter(link = link).values_list(
+                'title', flat = True
+            )
+            if titles:
+                title = titles[0]
 
         # Bind the data to the BookmarkSaveForm.
         form = BookmarkSaveForm({
@@ -252,45 +288,83 @@ def tag_cloud_page(request):
     # Maximum tag weight
     MAX_WEIGHT = 5
 
-    # Get all tags sorted by name.
-    tags = Tag.objects.order_by('name')
-
-    # Get a starting value for min and max counts by
-    # counting the number of bookmarks associated with
-    # the first tag in the QuerySet.
-    min_count = max_count = tags[0].bookmarks.count()
+    # Tags that aren't attached to any bookmark don't belong in the cloud.
+    tags = Tag.objects.filter(bookmark_count__gt=0)
 
-    # Adjust min and max counts:
-    # Get the number of bookmarks associated with each tag.
-    # If that number is less than min_count, set min_count
-    # to that lower number.  Also, if it's greater than
-    # max_count, set max_count to that higher number.
-    for tag in tags:
-        # Create a temporary attribute for the count.
-        tag.count = tag.bookmarks.count()
-        if tag.count < min_count:
-            min_count = tag.count
-        if max_count < tag.count:
-            max_count = tag.count
+    # Optionally only show the N most used tags, either from the "top"
+    # GET variable or from the TAG_CLOUD_MAX_TAGS setting.  A "top" that
+    # isn't a positive number is ignored.
+    try:
+        top = int(request.GET['top'])
+    except (KeyError, ValueError):
+        top = None
+    if top is None or top <= 0:
+        top = getattr(settings, 'TAG_CLOUD_MAX_TAGS', None)
+
+    if top:
+        # The top N tags are a small list, so min/max and sorting by
+        # name can be done in Python.
+        tags = list(
+            tags.order_by('-bookmark_count').values('name', 'bookmark_count')[:top]
+        )
+        tags.sort(key=lambda tag: tag['name'])
+        counts = [tag['bookmark_count'] for tag in tags]
+        min_count = min(counts) if counts else 0
+        max_count = max(counts) if counts else 0
+    else:
+        # Let the database find the smallest and largest counts
+        # in a single aggregate query.
+        bounds = tags.aggregate(
+            min_count=Min('bookmark_count'),
+            max_count=Max('bookmark_count')
+        )
+        min_count = bounds['min_count'] or 0
+        max_count = bounds['max_count'] or 0
+        tags = tags.order_by('name').values('name', 'bookmark_count')
 
     # Calculate the count range. Avoid dividing by zero.
     range = float(max_count - min_count)
     if range == 0.0:
         range = 1.0
 
-    # Calculate the tag weights.
+    # Calculate the tag weights while walking the tags exactly once.
+    cloud = []
     for tag in tags:
-        tag.weight = int(
-            MAX_WEIGHT * (tag.count - min_count) / range
+        tag['weight'] = int(
+            MAX_WEIGHT * (tag['bookmark_count'] - min_count) / range
         )
+        cloud.append(tag)
 
     variables = RequestContext(request, {
-        'tags': tags 
+        'tags': cloud
     })
     
     return render_to_response('tag_cloud_page.html', variables)
 
 
+def tag_autocomplete_page(request):
+    '''
+    Return a JSON list of the tags starting with the 'q' GET variable,
+    for suggesting tags as they're typed.  The suggestions come from an
+    in-memory index (see bookmarks/autocomplete.py), so this doesn't
+    query the database.
+    '''
+    prefix = request.GET.get('q', '').strip()
+    try:
+        limit = max(int(request.GET.get('limit', 10)), 1)
+    except ValueError:
+        limit = 10
+
+    tags = []
+    if prefix:
+        # Take the user id straight from the session so the User isn't
+        # loaded on every keystroke.
+        tags = autocomplete.suggest(
+            prefix, request.session.get(SESSION_KEY), limit
+        )
+    return HttpResponse(json.dumps(tags), mimetype = 'application/json')
+
+
 def search_page(request):
 
     form = SearchForm()  # Generate the search form.
@@ -298,27 +372,48 @@ def search_page(request):
     show_results = False # If False, there was no query so don't display _anything_.
                          # If True, there was a query so either display results or
                          # or "No bookmarks found".
+    query = ''
+    has_next = False
+
+    try:
+        page_number = max(int(request.GET['page']), 1)
+    except (KeyError, ValueError):
+        page_number = 1
 
     if 'query' in request.GET:  # If a query was sent...
         show_results = True     # ... show search results.
         query = request.GET['query'].strip()  # Strip non-white space chars from query string.
 
         if query:
-            keywords = query.split()
-            
-            q = Q()
-            for keyword in keywords:
-                q = q & Q(title__icontains=keyword)
-
             form = SearchForm({ 'query': query })  # Bind the form to the query (huh?).
-            bookmarks = Bookmark.objects.filter(q)[:10]
+
+            # Ask the search index for one extra result so we know
+            # whether there's a next page.
+            ids = search.search_bookmarks(
+                query,
+                offset = (page_number - 1) * SEARCH_RESULTS_PER_PAGE,
+                limit = SEARCH_RESULTS_PER_PAGE + 1
+            )
+            has_next = len(ids) > SEARCH_RESULTS_PER_PAGE
+            ids = ids[:SEARCH_RESULTS_PER_PAGE]
+
+            # Load the matching bookmarks and put them back in rank order.
+            found = _bookmark_list_query(Bookmark.objects.filter(id__in = ids))
+            found = dict((bookmark.id, bookmark) for bookmark in found)
+            bookmarks = [found[id] for id in ids if id in found]
 
     variables = RequestContext(request, {  # Pass everything to template for rendering.
         'form': form,
         'bookmarks': bookmarks,
         'show_results': show_results,
         'show_tags': True,
-        'show_user': True
+        'show_user': True,
+        'show_paginator': page_number > 1 or has_next,
+        'has_prev': page_number > 1,
+        'has_next': has_next,
+        'page': page_number,
+        'prev_link': 'query=%s&page=%d' % (urlquote(query), page_number - 1),
+        'next_link': 'query=%s&page=%d' % (urlquote(query), page_number + 1)
     })
 
     if request.GET.has_key('ajax'):
@@ -327,36 +422,121 @@ def search_page(request):
         return render_to_response('search.html', variables)
 
 
+def _fragment(scope, ident, vary_on):
+    '''
+    Look up a page's cached bookmark list before anything is queried
+    for it.  Returns the template variables the fragment_cache tag uses
+    instead of looking it up again; the list only has to be read from
+    the database if 'fragment' is None.
+    '''
+    key = cache.fragment_key(scope, ident, vary_on)
+    return {'fragment_key': key, 'fragment': cache.get_fragment(key)}
+
+
+def _keyset_page(request, query_set, per_page):
+    '''
+    Return the page of query_set, newest first, that the 'cursor' GET
+    variable points at.
+    '''
+    try:
+        return pagination.paginate(
+            query_set, request.GET.get('cursor'), per_page
+        )
+    except pagination.InvalidCursor:
+        raise Http404
+
+
+def _keyset_context(page):
+    # Template variables for the paginator in bookmark_list.html.
+    return {
+        'show_paginator': page.has_next() or page.has_previous(),
+        'has_prev': page.has_previous(),
+        'has_next': page.has_next(),
+        'prev_link': 'cursor=%s' % page.prev_cursor,
+        'next_link': 'cursor=%s' % page.next_cursor
+    }
+
+
+def _bookmark_list_query(query_set):
+    '''
+    Prepare a bookmark QuerySet for bookmark_list.html.  The link and
+    user of every bookmark come back in the same query and all of their
+    tags in one more, so rendering a list costs the same number of
+    queries whatever its length.
+    '''
+    return query_set.select_related('link', 'user').prefetch_related('tag_set')
+
+
+@cache.commit_on_success
 def _bookmark_save(request, form):
 
     # Create or get link object from Bookmark model.
-    # See if the link is already in the database.  If it's not
-    # create one and store it in the database. Return the created
-    # object and a Boolean: True if it was created, False if it was
-    # already in the database.
-    link, dummy = Link.objects.get_or_create(
-        url = form.cleaned_data['url']
-    )
+    # See if the link is already in the database, under any spelling
+    # of its URL.  If it's not create one and store it in the
+    # database. Return the created object and a Boolean: True if it
+    # was created, False if it was already in the database.
+    link, link_created = links.get_or_create_link(form.cleaned_data['url'])
+    # Have this user read their own changes from the primary database
+    # for a while (see bookmarks/replicas.py).
+    replicas.pin(request)
+    if link_created:
+        # Have the page's title, favicon and so on fetched in the
+        # background.
+        metadata.enqueue([link.id])
 
     # Create or get bookmark.  We don't want to add the 
     # same bookmark twice so we use get or create.
+    title = form.cleaned_data['title']
     bookmark, created = Bookmark.objects.get_or_create(
         user = request.user,
-        link = link
+        link = link,
+        defaults = {'title': title}
     )
 
     # Update bookmark title.
-    bookmark.title = form.cleaned_data['title']
-
-    # If the bookmark is being updated, clear old tag list.
-    if not created:
-        bookmark.tag_set.clear()
-
-    # Create new tag list.
-    tag_names = form.cleaned_data['tags'].split()
-    for tag_name in tag_names:
-        tag, created = Tag.objects.get_or_create(name = tag_name)
-        bookmark.tag_set.add(tag)
+    if bookmark.title != title:
+        bookmark.title = title
+        Bookmark.objects.filter(id = bookmark.id).update(title = title)
+
+    # Work out which tags are added and removed by comparing the new
+    # names with the ones the bookmark already has, so an edit only
+    # touches the tags that changed.
+    Through = Tag.bookmarks.through
+    tag_names = set(form.cleaned_data['tags'].split())
+    if created:
+        old_tags = {}
+    else:
+        old_tags = dict(Through.objects.filter(
+            bookmark = bookmark
+        ).values_list('tag__name', 'tag_id'))
+    old_tag_names = list(old_tags)
+    added = importers.get_or_create_tags(tag_names.difference(old_tags))
+    removed = [old_tags[name] for name in old_tags if name not in tag_names]
+
+    if removed:
+        Through.objects.filter(bookmark = bookmark, tag__in = removed).delete()
+        Tag.objects.filter(id__in = removed).update(
+            bookmark_count = F('bookmark_count') - 1
+        )
+    if added:
+        Through.objects.bulk_create([
+            Through(bookmark_id = bookmark.id, tag_id = tag_id)
+            for tag_id in added.values()
+        ])
+        Tag.objects.filter(id__in = added.values()).update(
+            bookmark_count = F('bookmark_count') + 1
+        )
+    # Keep this process's tag suggestions current, once the changes are
+    # committed.
+    changes = dict((name, 1) for name in added)
+    changes.update((name, -1) for name in old_tags if name not in tag_names)
+    cache.after_commit(autocomplete.tags_changed, changes, request.user.id)
+    tag_names = list(tag_names)
+
+    # Fanning new bookmarks out to the followers' friends feeds and
+    # indexing them for search happen in the background, once this
+    # transaction has committed (see bookmarks/tasks.py).
+    tasks.enqueue('bookmark_saved', bookmark_id = bookmark.id, created = created)
 
     # Share bookmark on main page if requested.
     if form.cleaned_data['share']:
@@ -368,9 +548,17 @@ def _bookmark_save(request, form):
             # to the list of users for voted for the bookmark.
             shared.users_voted.add(request.user)
             shared.save()
-
-    # Save bookmark to database.
-    bookmark.save()
+            # Ranked on the popular page in the background.
+            tasks.enqueue('bookmark_shared', shared_bookmark_id = shared.id)
+
+    # Throw away the cached lists this bookmark appears in: its owner's
+    # page, its old and new tag pages and the shared lists if it's
+    # shared, once this transaction has committed.  The bookmark_saved
+    # task takes care of the friends pages and search results.
+    cache.invalidate('user', request.user.username)
+    cache.invalidate('tag', *set(old_tag_names + tag_names))
+    if SharedBookmark.objects.filter(bookmark = bookmark).exists():
+        cache.invalidate('shared', 'all')
 
     return bookmark
 
@@ -378,17 +566,29 @@ def _bookmark_save(request, form):
 @login_required
 def bookmark_vote_page(request):
 
+    # Boolean. True if 'ajax' in GET string.
+    ajax = 'ajax' in request.GET
+
     if 'id' in request.GET:
         try:
-            id = request.GET['id']
-            shared_bookmark = SharedBookmark.objects.get(id = id)
-            user_voted = shared_bookmark.users_voted.filter(username = request.user.username)
-            if not user_voted:
-                shared_bookmark.votes += 1
-                shared_bookmark.users_voted.add(request.user)
-                shared_bookmark.save()
-        except SharedBookmark.DoesNotExist:
+            vote_count, counted = votes.record_vote(
+                request.user, int(request.GET['id'])
+            )
+        except (ValueError, SharedBookmark.DoesNotExist):
             raise Http404('Bookmark not found.')
+        replicas.pin(request)
+
+        # Ajax votes just get the new count back instead of a redirect
+        # that re-renders the whole page.
+        if ajax:
+            return HttpResponse(
+                json.dumps({
+                    'id': int(request.GET['id']),
+                    'votes': vote_count,
+                    'counted': counted
+                }),
+                mimetype = 'application/json'
+            )
 
     if 'HTTP_REFERER' in request.META:
         return HttpResponseRedirect(request.META['HTTP_REFERER'])
@@ -397,18 +597,19 @@ def bookmark_vote_page(request):
 
 
 def popular_page(request):
-    
-    today = datetime.today()
-    yesterday = today - timedelta(1)
-    shared_bookmarks = SharedBookmark.objects.filter(
-        date__gt=yesterday
-    )
-    shared_bookmarks = shared_bookmarks.order_by(
-        '-votes'
-    )[:10]
+
+    # Which ranking to show: 'day' (the default), 'week' or 'all'.
+    period = request.GET.get('period', popularity.DEFAULT_PERIOD)
+    if period not in popularity.PERIODS:
+        raise Http404
+
+    # The rankings are precomputed, so this is just their top rows.
+    shared_bookmarks = [frontpage.row(shared_bookmark)
+                        for shared_bookmark in popularity.top(period, 10)]
 
     variables = RequestContext(request, {
-        'shared_bookmarks': shared_bookmarks
+        'shared_bookmarks': shared_bookmarks,
+        'period': period
     })
     return render_to_response('popular_page.html', variables)
 
@@ -416,32 +617,51 @@ def popular_page(request):
 def bookmark_page(request, bookmark_id):
 
     shared_bookmark = get_object_or_404(
-        SharedBookmark,
+        SharedBookmark.objects.select_related('bookmark__link', 'bookmark__user'),
         id=bookmark_id
     )
 
-    variables = RequestContext(request, {
-        'shared_bookmark': shared_bookmark
-    })
+    # One page of comments, newest first, rendered when they were posted
+    # (see bookmarks/discussion.py).
+    page = _keyset_page(
+        request, shared_bookmark.renderedcomment_set.all(), discussion.PER_PAGE
+    )
+
+    variables = RequestContext(request, dict(_keyset_context(page), **{
+        'shared_bookmark': shared_bookmark,
+        'comments': page.items
+    }))
     return render_to_response('bookmark_page.html', variables)
 
 def friends_page(request, username):
-    user = get_object_or_404(User, username = username)
-
-    # Create a list of friends of the given user using Python's list comprehension feature.
-    # Note that user.friend_set.all() returns a list of tuples containing the user's id
-    # and their friend's id.  friendship.to_friend grabs the persons they're friends with
-    # and adds those persons to the friends list.
-    friends = [friendship.to_friend for friendship in user.friend_set.all()]
-    friend_bookmarks = Bookmark.objects.filter(user__in=friends).order_by('-id')
+    cursor = request.GET.get('cursor', '')
+    context = _fragment('friends', username, [cursor])
+
+    if context['fragment'] is None:
+        user = get_object_or_404(User, username = username)
+
+        # Create a list of friends of the given user using Python's list comprehension feature.
+        # Note that user.friend_set.all() returns a list of tuples containing the user's id
+        # and their friend's id.  friendship.to_friend grabs the persons they're friends with
+        # and adds those persons to the friends list.
+        context['friends'] = [friendship.to_friend for friendship in
+                              user.friend_set.select_related('to_friend')]
+        # The feed is precomputed, so this reads one page of the user's own
+        # feed rows however many friends they have.
+        page = _keyset_page(
+            request,
+            _bookmark_list_query(feeds.feed_query(user)),
+            LIST_ITEMS_PER_PAGE
+        )
+        context.update(_keyset_context(page))
+        context['bookmarks'] = page.items
 
-    variables = RequestContext(request, {
+    variables = RequestContext(request, dict(context, **{
         'username': username,
-        'friends': friends,
-        'bookmarks': friend_bookmarks[:10],
+        'cursor': cursor,
         'show_tags': True,
         'show_user': True
-    })
+    }))
     return render_to_response('friends_page.html', variables)
 
 @login_required
@@ -457,12 +677,15 @@ def friend_add(request):
 
         try:
             friendship.save()
-            request.user.message_set.create(
-                message = u'%s was added to your friend list.' % friend.username
+            feeds.follower_added(friend)
+            feeds.backfill(request.user, friend)
+            cache.invalidate('friends', request.user.username)
+            messages.info(
+                request, u'%s was added to your friend list.' % friend.username
             )
-        except:
-            request.user.message_set.create(
-                message = u'%s is already a friend of yours.' % friend.username
+        except IntegrityError:
+            messages.info(
+                request, u'%s is already a friend of yours.' % friend.username
             )
 
         return HttpResponseRedirect(
@@ -470,3 +693,67 @@ def friend_add(request):
         )
     else:
         raise Http404
+
+
+@login_required
+def bookmark_import_page(request):
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            format = form.cleaned_data['format'] or \
+                     importers.guess_format(upload.name)
+
+            # The parser reads the upload a chunk at a time, so big
+            # files aren't loaded into memory.
+            try:
+                stats = importers.import_bookmarks(
+                    request.user, importers.PARSERS[format](upload)
+                )
+            except importers.ParseError as e:
+                # What came before the error is imported already.
+                form._errors['file'] = form.error_class([
+                    u'%s  Imported %d bookmarks (%d skipped) before it.'
+                    % (e, e.stats['created'], e.stats['skipped'])
+                ])
+            else:
+                messages.info(
+                    request,
+                    u'Imported %d bookmarks (%d skipped) in %.1f seconds.'
+                    % (stats['created'], stats['skipped'], stats['seconds'])
+                )
+                return HttpResponseRedirect('/user/%s/' % request.user.username)
+    else:
+        form = ImportForm()
+
+    variables = RequestContext(request, {
+        'form': form
+    })
+    return render_to_response('bookmark_import.html', variables)
+
+
+@staff_member_required
+def cache_stats_page(request):
+    # Fragment cache hit/miss counters for monitoring.
+    return HttpResponse(
+        json.dumps(cache.cache_stats()),
+        mimetype = 'application/json'
+    )
+
+
+@staff_member_required
+def task_stats_page(request):
+    # Background task queue depth for monitoring.
+    return HttpResponse(
+        json.dumps(tasks.queue_stats()),
+        mimetype = 'application/json'
+    )
+
+
+@staff_member_required
+def view_stats_page(request):
+    # Per-view latency, query and size percentiles for monitoring.
+    return HttpResponse(
+        json.dumps(instrumentation.report()),
+        mimetype = 'application/json'
+    )
@@ -0,0 +1,136 @@
+'''
+Voting for shared bookmarks.
+
+A vote is an insert into the SharedBookmark/User table, whose unique
+(sharedbookmark, user) constraint stops anyone from voting twice, and a
+database side "votes = votes + 1".  Nothing is read and written back, so
+concurrent votes can't overwrite each other.
+
+With the VOTE_BUFFERING setting on, votes are instead written to the
+PendingVote table and applied in batches by flush_votes(), which
+"manage.py flush_votes" runs once or on an interval.  Vote counts are
+then behind by at most one flush.
+'''
+from collections import defaultdict
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from bookmarks import cache, popularity
+from bookmarks.models import PendingVote, SharedBookmark
+
+Vote = SharedBookmark.users_voted.through
+
+
+def record_vote(user, shared_bookmark_id):
+    '''
+    Count user's vote for a shared bookmark.  Returns the new number of
+    votes and whether this vote was counted (False if the user had
+    already voted).  Raises SharedBookmark.DoesNotExist for unknown ids.
+    '''
+    if getattr(settings, 'VOTE_BUFFERING', False):
+        return _buffer_vote(user, shared_bookmark_id)
+    return _apply_vote(user, shared_bookmark_id)
+
+
+@cache.commit_on_success
+def _apply_vote(user, shared_bookmark_id):
+    sid = transaction.savepoint()
+    try:
+        Vote.objects.create(
+            sharedbookmark_id = shared_bookmark_id,
+            user_id = user.id
+        )
+    except IntegrityError:
+        # The user has voted for this bookmark before.
+        transaction.savepoint_rollback(sid)
+        counted = False
+    else:
+        transaction.savepoint_commit(sid)
+        SharedBookmark.objects.filter(id = shared_bookmark_id).update(
+            votes = F('votes') + 1
+        )
+        counted = True
+
+    # Raising DoesNotExist here also rolls back a vote for a
+    # bookmark that isn't there.
+    votes = SharedBookmark.objects.values_list('votes', flat = True).get(
+        id = shared_bookmark_id
+    )
+    if counted:
+        popularity.update_scores([shared_bookmark_id])
+        cache.invalidate('shared', 'all')
+    return votes, counted
+
+
+@transaction.commit_on_success
+def _buffer_vote(user, shared_bookmark_id):
+    votes = SharedBookmark.objects.values_list('votes', flat = True).get(
+        id = shared_bookmark_id
+    )
+    counted = False
+    if not Vote.objects.filter(sharedbookmark = shared_bookmark_id,
+                               user = user).exists():
+        sid = transaction.savepoint()
+        try:
+            PendingVote.objects.create(
+                shared_bookmark_id = shared_bookmark_id,
+                user = user
+            )
+        except IntegrityError:
+            # Already waiting in the buffer.
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
+            counted = True
+
+    # Report the count as it will be once the buffer is flushed.
+    pending = PendingVote.objects.filter(
+        shared_bookmark = shared_bookmark_id
+    ).count()
+    return votes + pending, counted
+
+
+@cache.commit_on_success
+def flush_votes(batch_size = 1000):
+    '''
+    Apply up to batch_size buffered votes.  Returns the number of
+    pending votes processed; votes by users who had already voted are
+    dropped.
+    '''
+    pending = list(PendingVote.objects.order_by('id').values_list(
+        'id', 'shared_bookmark_id', 'user_id'
+    )[:batch_size])
+    if not pending:
+        return 0
+
+    # Leave out votes that were already recorded.
+    existing = set(Vote.objects.filter(
+        sharedbookmark__in = set(row[1] for row in pending),
+        user__in = set(row[2] for row in pending)
+    ).values_list('sharedbookmark_id', 'user_id'))
+    new_votes = [(shared_id, user_id) for id, shared_id, user_id in pending
+                 if (shared_id, user_id) not in existing]
+
+    Vote.objects.bulk_create([
+        Vote(sharedbookmark_id = shared_id, user_id = user_id)
+        for shared_id, user_id in new_votes
+    ])
+
+    # One UPDATE per distinct increment rather than per bookmark.
+    counts = defaultdict(int)
+    for shared_id, user_id in new_votes:
+        counts[shared_id] += 1
+    by_increment = defaultdict(list)
+    for shared_id, count in counts.items():
+        by_increment[count].append(shared_id)
+    for increment, shared_ids in by_increment.items():
+        SharedBookmark.objects.filter(id__in = shared_ids).update(
+            votes = F('votes') + increment
+        )
+
+    PendingVote.objects.filter(id__in = [row[0] for row in pending]).delete()
+
+    if new_votes:
+        popularity.update_scores(counts.keys())
+        cache.invalidate('shared', 'all')
+    return len(pending)
@@ -0,0 +1,77 @@
+'''
+Worker warm-up.
+
+A new worker process spends its first requests importing the URLconf and
+views, loading the middleware and the tag autocompletion index and
+reading and compiling templates.
+warm_up() does all of that before the first request arrives.  With the
+cached template loader (see django_bookmarks/settings_production.py) the
+compiled templates then stay in memory for the life of the process, so
+no request reads a template from disk.
+
+django_bookmarks/wsgi.py calls it at startup when the WARM_UP_ON_START
+setting is on.  "manage.py warm_up" runs it once to check that every
+template compiles and to show how long it takes.
+'''
+import os
+import time
+from django.conf import settings
+from django.core.urlresolvers import get_resolver
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.template.loaders.app_directories import app_template_dirs
+from bookmarks import autocomplete
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt', '.xml')
+
+
+def template_names():
+    '''
+    Yield the name of every template in TEMPLATE_DIRS and the installed
+    apps' template directories.
+    '''
+    seen = set()
+    for directory in tuple(settings.TEMPLATE_DIRS) + tuple(app_template_dirs):
+        for root, dirs, files in os.walk(directory):
+            for filename in files:
+                if not filename.endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                name = os.path.relpath(
+                    os.path.join(root, filename), directory
+                ).replace(os.sep, '/')
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+
+def warm_up(handler = None):
+    '''
+    Import the URLconf, load handler's middleware if a WSGI handler is
+    given, load the tag autocompletion index and compile every template.
+    Returns a dictionary with the number of templates compiled, the
+    (name, message) pairs of those that failed and the seconds taken.
+    '''
+    start = time.time()
+    # Imports the views, and with them the models and forms.
+    get_resolver(None).url_patterns
+    if handler is not None and handler._request_middleware is None:
+        handler.load_middleware()
+
+    # The tag autocompletion index.
+    autocomplete.get_index()
+
+    compiled = 0
+    errors = []
+    for name in template_names():
+        try:
+            get_template(name)
+        except (TemplateSyntaxError, TemplateDoesNotExist, UnicodeDecodeError) as e:
+            errors.append((name, str(e)))
+        else:
+            compiled += 1
+
+    return {
+        'templates': compiled,
+        'errors': errors,
+        'seconds': time.time() - start,
+    }
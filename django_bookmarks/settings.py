@@ -22,9 +22,53 @@ DATABASES = {
     }
 }
 
-# Enable local memory caching for 5 minute intervals
-CACHES_BACKEND = 'locmem:///'
-CACHES_MIDDLEWARE_SECONDS = 60 * 5
+# Read-only views read from one of these DATABASES aliases, copies of
+# 'default' kept up to date by replication, and everything else uses
+# 'default' (see bookmarks/replicas.py).  For a while after a user
+# writes something their reads stay on 'default', so they see their
+# own changes in spite of replication lag.  Add 'CONN_MAX_AGE' (seconds)
+# to a database to keep its connection open across requests.
+DATABASE_ROUTERS = ['bookmarks.replicas.ReplicaRouter']
+DATABASE_REPLICAS = ()
+REPLICA_STICKY_SECONDS = 10
+
+# PRAGMA name: value pairs run on every new SQLite connection (see
+# bookmarks/sqlite_tuning.py and settings_production.py).
+SQLITE_PRAGMAS = {}
+
+# Rendered bookmark lists are cached as fragments and invalidated when
+# the bookmarks behind them change (see bookmarks/cache.py).  Use a
+# shared backend such as memcached when running more than one process.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+FRAGMENT_CACHE_TIMEOUT = 60 * 5
+
+# When True, votes are buffered in the PendingVote table and applied in
+# batches by "manage.py flush_votes --interval 10".
+VOTE_BUFFERING = False
+
+# Number of recent requests per view the statistics are taken from, and
+# how often (in seconds) each process publishes them to the cache.
+VIEW_STATS_SAMPLE_SIZE = 500
+VIEW_STATS_PUBLISH_INTERVAL = 10
+
+# "manage.py fetch_metadata" fetches new links' pages on this many
+# threads, waits at least METADATA_HOST_DELAY seconds between requests
+# to the same host and gives up on a page after METADATA_TIMEOUT seconds.
+METADATA_FETCH_WORKERS = 4
+METADATA_HOST_DELAY = 1.0
+METADATA_TIMEOUT = 10
+# Let it fetch pages on loopback, private and link-local addresses.
+# Anyone who can save a bookmark could then make it read internal
+# services, so only turn this on for development.
+METADATA_ALLOW_PRIVATE_ADDRESSES = False
+
+# Number of threads "manage.py run_tasks --interval 1" runs background
+# tasks (friends feed fan-out, search indexing) on.
+TASK_WORKERS = 4
 
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
@@ -91,6 +135,7 @@ STATICFILES_FINDERS = (
 SECRET_KEY = 'di+)due$@g)bo1dkqj_bti61&amp;z149l)z_uo+cn-k=xezq_cxq('
 
 # List of callables that know how to import templates from various sources.
+# settings_production.py wraps them in the cached loader.
 TEMPLATE_LOADERS = (
     'django.template.loaders.filesystem.Loader',
     'django.template.loaders.app_directories.Loader',
@@ -98,8 +143,11 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
-    # This next line must come first
-    'django.middleware.cache.UpdateCacheMiddleware',
+    # Per-view timing and query statistics (see /stats/views/).  This
+    # next line must come first.
+    'bookmarks.middleware.InstrumentationMiddleware',
+    # Read-only views read from the replicas in DATABASE_REPLICAS.
+    'bookmarks.middleware.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -109,8 +157,6 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    # This next line must come last
-    'django.middleware.cache.FetchFromCacheMiddleware',
 )
 
 ROOT_URLCONF = 'django_bookmarks.urls'
@@ -0,0 +1,62 @@
+# Settings for running django_bookmarks in production.  Point the WSGI
+# server at them with
+#
+#     DJANGO_SETTINGS_MODULE=django_bookmarks.settings_production
+#
+# Everything not set here comes from settings.py.
+
+from django_bookmarks.settings import *
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+
+# Compile each template once per process and keep it, instead of
+# reading and parsing it from disk on every render.  Template changes
+# then need a restart.
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+)
+
+# Reuse database connections for up to a minute instead of opening one
+# per request.
+DATABASES['default']['CONN_MAX_AGE'] = 60
+
+# Let readers and a writer use the SQLite database at the same time and
+# make writers wait for each other instead of failing with "database
+# is locked" (see bookmarks/sqlite_tuning.py).  Compare settings with
+# "manage.py benchmark_concurrency".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Every process has to see the same cache: fragment versions, the API's
+# validators and the cache statistics live there, and invalidations are
+# made by the web workers and by run_tasks, flush_votes and
+# refresh_popularity alike.  Settings.py's LocMemCache is per process.
+# This needs memcached running and the python-memcached package; without
+# them, the database cache works too:
+#
+#     CACHES = {'default': {
+#         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+#         'LOCATION': 'bookmarks_cache',   # "manage.py createcachetable bookmarks_cache"
+#     }}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
+# Keep sessions in the cache, so reading one (e.g. for every keystroke
+# in the tag autocompletion) doesn't have to query the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Import the views, load the middleware and compile every template when
+# a worker starts (see django_bookmarks/wsgi.py), so its first requests
+# don't pay for it.
+WARM_UP_ON_START = True
@@ -1,6 +1,7 @@
 import os
 from django.conf.urls import patterns, include, url
 from bookmarks.views import *
+from bookmarks.api import *
 from django.views.generic.simple import direct_to_template
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
@@ -37,17 +38,20 @@ urlpatterns = patterns('',
     (r'^test/$', test_page),
     (r'^popular/$', popular_page),
     (r'^user/(\w+)/$', user_page),
+    (r'^user/(\w+)/export/$', bookmark_export_page),
     # "[^\s]+" Matches one or more non-whitespace characters
     (r'^tag/([^\s]+)/$', tag_page),
     (r'^tag/$', tag_cloud_page),
+    (r'^tags/autocomplete/$', tag_autocomplete_page),
     (r'^search/$', search_page),
     # Comments
     (r'^comments/', include('django.contrib.comments.urls')),
     (r'^bookmark/(\d+)/$', bookmark_page),
 
     # Friends
-    (r'^friends/(\w+)/$', friends_page),
+    # friends/add/ has to come first, "add" would match (\w+) too.
     (r'^friends/add/$', friend_add),
+    (r'^friends/(\w+)/$', friends_page),
 
     # Session management
     # This login view is in a package outside my project
@@ -59,8 +63,21 @@ urlpatterns = patterns('',
 
     # Account management
     (r'^save/$', bookmark_save_page),
+    (r'^import/$', bookmark_import_page),
     (r'^vote/$', bookmark_vote_page),
 
+    # JSON API
+    (r'^api/user/(\w+)/$', api_user_bookmarks),
+    (r'^api/tag/([^\s]+)/$', api_tag_bookmarks),
+    (r'^api/friends/(\w+)/$', api_friends_feed),
+    (r'^api/popular/$', api_popular),
+    (r'^api/search/$', api_search),
+
+    # Monitoring
+    (r'^stats/cache/$', cache_stats_page),
+    (r'^stats/views/$', view_stats_page),
+    (r'^stats/tasks/$', task_stats_page),
+
     # Site media
     (r'^site_media/(?P<path>.*)$', 'django.views.static.serve', 
         { 'document_root': site_media }),
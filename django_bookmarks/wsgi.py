@@ -23,6 +23,17 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_bookmarks.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Do the work of the first requests now, before the worker takes any
+# (see bookmarks/warmup.py).
+from django.conf import settings
+if getattr(settings, 'WARM_UP_ON_START', False):
+    from bookmarks.warmup import warm_up
+    warm_up(application)
+    # Servers that fork workers after loading the application mustn't
+    # share the connection the warm-up opened.
+    from django.db import connection
+    connection.close()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)